@@ -1,14 +1,21 @@
-from collections import deque, defaultdict
+from collections import deque, defaultdict, namedtuple
 from itertools import chain
 from io import StringIO
+from pathlib import Path
+from time import perf_counter
 import json
+import os
+import re
+import threading
 
 import click
-import flask_migrate
+import sqlalchemy as sa
 from flask import current_app
-from alembic.migration import MigrationContext
+from alembic.migration import MigrationContext, MigrationStep
 from alembic.context import EnvironmentContext
-from alembic.script import ScriptDirectory
+from alembic.util import CommandError
+from alembic.script import Script, ScriptDirectory
+from alembic.script.revision import RevisionError
 from flask_migrate.cli import db as db_cli
 from flask.cli import with_appcontext
 
@@ -46,16 +53,133 @@ def box_drowing(up, down, left, right, bold=True):
         raise Exception("Unexpected box drowing symbol")
 
 
+SQL_SPECIAL_CHARS = re.compile(r"[;'\"$/-]")
+SQL_DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+# rest of an escape string constant (E'...'), where quotes may be escaped with a backslash
+SQL_ESCAPE_STRING_END = re.compile(r"(?:[^'\\]|\\.)*'", re.DOTALL)
+
+
+def is_escape_string_prefix(line, quote):
+    """
+    Whether the quote at the given position of the line starts an escape string (E'...')
+    """
+    if quote < 1 or line[quote - 1] not in "eE":
+        return False
+    return quote < 2 or not (line[quote - 2].isalnum() or line[quote - 2] in "_$")
+
+
+def iter_sql_statements(stream):
+    """
+    Yield SQL statements read from the given text stream one by one, splitting on semicolons
+    outside of quoted strings and identifiers (including E'...' escape strings), comments and
+    dollar-quoted strings.
+    """
+    statement = []
+    closing = None  # end of the current quoted string or comment
+    for line in stream:
+        pos = 0
+        while pos < len(line):
+            if closing is SQL_ESCAPE_STRING_END:
+                match = closing.match(line, pos)
+                end = match.end() if match is not None else -1
+            elif closing is not None:
+                end = line.find(closing, pos)
+                if end != -1:
+                    end += len(closing)
+            if closing is not None:
+                if end == -1:
+                    statement.append(line[pos:])
+                    break
+                statement.append(line[pos:end])
+                pos = end
+                closing = None
+                continue
+            match = SQL_SPECIAL_CHARS.search(line, pos)
+            if match is None:
+                statement.append(line[pos:])
+                break
+            start = match.start()
+            char = line[start]
+            statement.append(line[pos:start])
+            pos = start + 1
+            if char == ";":
+                sql = "".join(statement).strip()
+                statement = []
+                if sql:
+                    yield sql
+                continue
+            if char == "'" and is_escape_string_prefix(line, start):
+                closing = SQL_ESCAPE_STRING_END
+            elif char in "'\"":
+                closing = char
+            elif line.startswith("--", start):
+                statement.append(line[start:])
+                break
+            elif line.startswith("/*", start):
+                closing = "*/"
+                pos = start + 2
+            elif char == "$":
+                dollar_quote = SQL_DOLLAR_QUOTE.match(line, start)
+                if dollar_quote is not None:
+                    closing = dollar_quote.group()
+                    pos = dollar_quote.end()
+            statement.append(line[start:pos])
+    sql = "".join(statement).strip()
+    if sql:
+        yield sql
+
+
 @db_cli.command()
-@click.argument("command", nargs=-1, required=True)
+@click.argument("command", nargs=-1)
 @click.option("--commit/--no-commit", default=True, help="Commit transaction.")
 @click.option("--json", "json_output", is_flag=True, help="Output commands results as JSON.")
+@click.option(
+    "--jsonl",
+    "jsonl_output",
+    is_flag=True,
+    help="Stream commands results as JSON Lines, one row per line.",
+)
+@click.option(
+    "-f",
+    "--file",
+    "sql_file",
+    type=click.File("r"),
+    help="Execute statements of a SQL script one by one, with timing.",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Number of rows fetched at once with --jsonl.",
+)
 @with_appcontext
-def exec(command, commit, json_output):
+def exec(command, commit, json_output, jsonl_output, sql_file, batch_size):
+    """Execute SQL commands."""
+    if not command and sql_file is None:
+        raise click.UsageError("Missing SQL command or --file option.")
+    if json_output and jsonl_output:
+        raise click.UsageError("--json and --jsonl cannot be used together.")
     db = current_app.extensions["sqlalchemy"].db
+    statements = chain(command, iter_sql_statements(sql_file) if sql_file else [])
     results = []
-    for cmd in command:
-        results.append(db.session.execute(cmd))
+    for cmd in statements:
+        start = perf_counter()
+        if jsonl_output:
+            # server-side cursor, rows are printed as they arrive
+            result = db.session.execute(
+                sa.text(cmd),
+                execution_options={"stream_results": True, "yield_per": batch_size},
+            )
+            if result.returns_rows:
+                for row in result:
+                    click.echo(current_app.json.dumps(dict(row._mapping)))
+        else:
+            results.append(db.session.execute(sa.text(cmd)))
+        if sql_file is not None:
+            summary = " ".join(cmd.split())
+            if len(summary) > 80:
+                summary = summary[:79] + "…"
+            click.echo(f"{perf_counter() - start:8.3f}s  {summary}", err=True)
     if commit:
         db.session.commit()
     if json_output:
@@ -83,21 +207,484 @@ def exec(command, commit, json_output):
 @click.option(
     "-x", "--x-arg", multiple=True, help="Additional arguments consumed by custom env.py scripts"
 )
+@click.option(
+    "--single-transaction/--transaction-per-migration",
+    default=None,
+    help="Run all revisions in a single transaction or commit after each revision "
+    "(default is the transaction_per_migration option given to context.configure() by env.py, "
+    "a single transaction if not set). env.py must forward the configure_args of Flask-Migrate "
+    "to context.configure() for these options to be applied.",
+)
+@click.option(
+    "--report",
+    "show_report",
+    is_flag=True,
+    help="Print a summary of the duration, statements and lock waits of each revision.",
+)
+@click.option(
+    "--report-file",
+    type=click.File("w"),
+    default=None,
+    help="Write the report of each revision as JSON to the given file.",
+)
 @with_appcontext
-def autoupgrade(directory, sql, tag, x_arg):
-    """Upgrade all branches to head."""
+def autoupgrade(directory, sql, tag, x_arg, single_transaction, show_report, report_file):
+    """Upgrade all branches to head.
+
+    Revisions are cached in the file set with the MIGRATIONS_CACHE config key
+    (migrations-cache.json in the instance folder by default, False to disable the cache).
+    """
+    if sql and (show_report or report_file):
+        raise click.UsageError("--report and --report-file cannot be used with --sql.")
     db = current_app.extensions["sqlalchemy"].db
-    migrate = current_app.extensions["migrate"].migrate
-    config = migrate.get_config(directory, x_arg)
+    migrate = current_app.extensions["migrate"]
+    config = migrate.migrate.get_config(directory, x_arg)
     script = ScriptDirectory.from_config(config)
-    heads = set(script.get_heads())
     migration_context = MigrationContext.configure(db.session.connection())
     current_heads = migration_context.get_current_heads()
-    # get_current_heads does not return implicit revision through dependecies, get_all_current does
-    current_heads = set(map(lambda rev: rev.revision, script.get_all_current(current_heads)))
-    for head in current_heads - heads:
-        revision = head + "@head"
-        flask_migrate.upgrade(directory, revision, sql, tag, x_arg)
+    graph = RevisionGraph(load_revisions(script, get_revisions_cache_path()), current_heads)
+    targets = tuple(sorted(graph.get_upgrade_targets()))
+    if not targets:
+        return
+    report = UpgradeReport(sample_locks=show_report or report_file is not None)
+
+    def upgrade(rev, context):
+        if (
+            single_transaction is not None
+            and bool(context.opts.get("transaction_per_migration")) == single_transaction
+        ):
+            raise CommandError(
+                "env.py does not forward the configure_args of Flask-Migrate to "
+                "context.configure(): --single-transaction and --transaction-per-migration "
+                "cannot be applied."
+            )
+        steps = get_upgrade_steps(script, targets, rev)
+        return steps if sql else report.steps(steps, context)
+
+    configure_args = migrate.configure_args
+    previous_configure_args = dict(configure_args)
+    if single_transaction is not None:
+        configure_args["transaction_per_migration"] = not single_transaction
+    try:
+        with EnvironmentContext(
+            config,
+            script,
+            fn=upgrade,
+            as_sql=sql,
+            starting_rev=current_heads if sql else None,
+            destination_rev=targets,
+            tag=tag,
+        ):
+            script.run_env()
+    except CommandError as exc:
+        raise click.ClickException(str(exc))
+    finally:
+        configure_args.clear()
+        configure_args.update(previous_configure_args)
+        report.close()
+        if not sql:
+            click.echo(f"{report.duration:8.3f}s  total", err=True)
+        if show_report:
+            report.print_summary()
+        if report_file is not None:
+            json.dump(report.as_dict(), report_file, indent=2)
+
+
+def get_upgrade_steps(script, destination, current_rev):
+    """
+    Return the migration steps upgrading from `current_rev` to `destination` revisions,
+    as alembic does for an upgrade command
+    """
+    try:
+        revisions = list(script.iterate_revisions(destination, current_rev, implicit_base=True))
+    except RevisionError as exc:
+        raise CommandError(str(exc)) from exc
+    return [
+        MigrationStep.upgrade_from_script(script.revision_map, revision)
+        for revision in reversed(revisions)
+    ]
+
+
+LOCK_WAITS_QUERY = sa.text("""
+    SELECT l.mode, l.locktype, l.relation::regclass::text AS relation,
+           pg_blocking_pids(a.pid) AS blocking_pids
+    FROM pg_stat_activity a
+    JOIN pg_locks l ON l.pid = a.pid AND NOT l.granted
+    WHERE a.pid = :pid AND a.wait_event_type = 'Lock'
+""")
+
+
+class UpgradeReport:
+    """
+    Report of the revisions run by an upgrade: duration, number of statements and, on
+    PostgreSQL, time spent waiting for locks with the awaited locks and the blocking backends.
+
+    Lock waits are sampled every `interval` seconds from pg_stat_activity and pg_locks on a
+    side connection, so that they are estimates with this resolution.
+    """
+
+    def __init__(self, sample_locks=False, interval=0.1):
+        self.sample_locks = sample_locks
+        self.interval = interval
+        self.revisions = []
+        self.start = perf_counter()
+        self.end = None
+        self._current = None
+        self._connection = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @property
+    def duration(self):
+        return (self.end or perf_counter()) - self.start
+
+    def steps(self, steps, context):
+        """
+        Yield the given migration steps, recording each one once it has been run, that is when
+        the migration context asks for the next step.
+        """
+        connection = context.connection
+        if self.sample_locks and connection.dialect.name == "postgresql":
+            pid = connection.exec_driver_sql("SELECT pg_backend_pid()").scalar()
+            self._sampler = threading.Thread(
+                target=self._sample_locks, args=(connection.engine, pid), daemon=True
+            )
+            self._sampler.start()
+        self._connection = connection
+        sa.event.listen(connection, "before_cursor_execute", self._count_statement)
+        for step in steps:
+            self._begin(step)
+            yield step
+            self._finish()
+
+    def close(self):
+        """Stop recording, the revision being run, if any, is marked as failed."""
+        if self._current is not None:
+            self._finish(failed=True)
+        if self._connection is not None:
+            sa.event.remove(self._connection, "before_cursor_execute", self._count_statement)
+            self._connection = None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self.end is None:
+            self.end = perf_counter()
+
+    def _begin(self, step):
+        self._current = {
+            "revision": step.revision.revision,
+            "description": step.short_log,
+            "start": perf_counter(),
+            "duration": None,
+            "statements": 0,
+            "lock_wait": 0.0 if self._sampler is not None else None,
+            "locks": [],
+            "failed": False,
+        }
+
+    def _finish(self, failed=False):
+        current, self._current = self._current, None
+        current["duration"] = perf_counter() - current.pop("start")
+        current["failed"] = failed
+        self.revisions.append(current)
+        status = "  (failed)" if failed else ""
+        click.echo(f"{current['duration']:8.3f}s  {current['description']}{status}", err=True)
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current is not None:
+            self._current["statements"] += 1
+
+    def _sample_locks(self, engine, pid):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            while not self._stop.wait(self.interval):
+                current = self._current
+                if current is None:
+                    continue
+                rows = connection.execute(LOCK_WAITS_QUERY, {"pid": pid}).all()
+                if not rows:
+                    continue
+                current["lock_wait"] += self.interval
+                for row in rows:
+                    lock = {
+                        "mode": row.mode,
+                        "locktype": row.locktype,
+                        "relation": row.relation,
+                        "blocking_pids": sorted(row.blocking_pids),
+                    }
+                    if lock not in current["locks"]:
+                        current["locks"].append(lock)
+
+    def as_dict(self):
+        return {"duration": self.duration, "revisions": self.revisions}
+
+    def print_summary(self):
+        click.echo(f"{'duration':>9}  {'statements':>10}  {'lock wait':>9}  revision", err=True)
+        for revision in self.revisions:
+            lock_wait = revision["lock_wait"]
+            lock_wait = "-" if lock_wait is None else f"{lock_wait:.1f}s"
+            status = "  (failed)" if revision["failed"] else ""
+            click.echo(
+                f"{revision['duration']:8.3f}s  {revision['statements']:>10}  {lock_wait:>9}  "
+                f"{revision['description']}{status}",
+                err=True,
+            )
+            for lock in revision["locks"]:
+                on = f" on {lock['relation']}" if lock["relation"] else ""
+                blocking_pids = ", ".join(map(str, lock["blocking_pids"]))
+                click.echo(
+                    f"{'':>36}waiting for {lock['mode']} ({lock['locktype']}){on}"
+                    f", blocked by {blocking_pids or '?'}",
+                    err=True,
+                )
+
+
+REVISIONS_CACHE_VERSION = 1
+
+CachedRevision = namedtuple(
+    "CachedRevision", ["revision", "down_revision", "dependencies", "branch_labels", "doc"]
+)
+
+
+def get_revisions_cache_path():
+    """
+    Return the path of the revisions cache file, set with the MIGRATIONS_CACHE config key
+    (False to disable the cache) and stored in the instance folder by default.
+    """
+    return current_app.config.get(
+        "MIGRATIONS_CACHE", os.path.join(current_app.instance_path, "migrations-cache.json")
+    )
+
+
+def get_revisions_key(script):
+    """
+    Return the path, modification time and size of every revision file of the script
+    directory, without importing them, or None if the private alembic APIs listing these files
+    are not available in the installed alembic version.
+    """
+    version_locations = getattr(script, "_version_locations", None)
+    list_py_dir = getattr(Script, "_list_py_dir", None)
+    if version_locations is None or list_py_dir is None:
+        return None
+    key = []
+    for location in version_locations:
+        location = Path(location)  # str before alembic 1.13
+        if not location.exists():
+            continue
+        for path in list_py_dir(script, location):
+            stat = Path(path).stat()
+            key.append([str(path), stat.st_mtime_ns, stat.st_size])
+    return key
+
+
+def load_revisions(script, cache_path=None):
+    """
+    Return the revisions of the script directory as CachedRevision tuples, dependencies being
+    resolved to revision ids.
+
+    When `cache_path` is given, revisions are read from this file if no revision file has been
+    added, removed or modified since it has been written, so that revision modules are not
+    imported. Otherwise, revisions are loaded by alembic and the cache file is rewritten.
+    """
+    key = get_revisions_key(script) if cache_path else None
+    if key is None:
+        cache_path = None  # revision files can not be listed, the cache is disabled
+    if cache_path:
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = None
+        if cache and cache.get("version") == REVISIONS_CACHE_VERSION and cache["key"] == key:
+            return [
+                CachedRevision(
+                    revision=revision["revision"],
+                    down_revision=(
+                        tuple(revision["down_revision"])
+                        if isinstance(revision["down_revision"], list)
+                        else revision["down_revision"]
+                    ),
+                    dependencies=tuple(revision["dependencies"]),
+                    branch_labels=set(revision["branch_labels"]),
+                    doc=revision["doc"],
+                )
+                for revision in cache["revisions"]
+            ]
+    revisions = [
+        CachedRevision(
+            revision=revision.revision,
+            down_revision=revision.down_revision,
+            dependencies=tuple(
+                script.get_revision(dep).revision
+                for dep in (
+                    (revision.dependencies,)
+                    if isinstance(revision.dependencies, str)
+                    else revision.dependencies or ()
+                )
+            ),
+            branch_labels=set(revision.branch_labels),
+            doc=revision.doc,
+        )
+        for revision in script.walk_revisions()
+    ]
+    if cache_path:
+        cache = {
+            "version": REVISIONS_CACHE_VERSION,
+            "key": key,
+            "revisions": [
+                dict(revision._asdict(), branch_labels=sorted(revision.branch_labels))
+                for revision in revisions
+            ],
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # the cache is optional, e.g. on a read-only file system
+    return revisions
+
+
+class RevisionGraph:
+    """
+    Revision graph of a script directory, indexed once by revision id: down revisions, next
+    revisions (sorted), resolved dependencies, branch bases and applied revisions.
+
+    `revisions` objects must provide `revision`, `down_revision`, `dependencies` (resolved to
+    revision ids), `branch_labels` and `doc` attributes, such as the CachedRevision tuples
+    returned by `load_revisions`.
+    """
+
+    def __init__(self, revisions, current_heads=()):
+        self.revisions = {}
+        self.down = {}
+        self.next = defaultdict(list)
+        for revision in revisions:
+            rev = revision.revision
+            self.revisions[rev] = revision
+            down_revision = revision.down_revision
+            if down_revision is None:
+                self.down[rev] = ()
+            elif isinstance(down_revision, str):
+                self.down[rev] = (down_revision,)
+            else:
+                self.down[rev] = tuple(down_revision)
+            for down_rev in self.down[rev]:
+                self.next[down_rev].append(rev)
+        for next_revisions in self.next.values():
+            next_revisions.sort()
+        self.dependencies = {}
+        for rev, revision in self.revisions.items():
+            deps = revision.dependencies or ()
+            if isinstance(deps, str):
+                deps = (deps,)
+            self.dependencies[rev] = tuple(deps)
+        self.bases = {
+            next(iter(self.revisions[rev].branch_labels)): rev
+            for rev in sorted(
+                (rev for rev, down in self.down.items() if not down),
+                key=lambda rev: next(iter(self.revisions[rev].branch_labels)),
+            )
+        }
+        self.applied = self.get_ancestors(current_heads)
+
+    def get_ancestors(self, heads):
+        """
+        Return the set of the given revisions and their ancestors, following down revisions
+        and dependencies
+        """
+        ancestors = set()
+        todo = list(heads)
+        while todo:
+            rev = todo.pop()
+            if rev in ancestors:
+                continue
+            ancestors.add(rev)
+            todo.extend(self.down[rev])
+            todo.extend(self.dependencies[rev])
+        return ancestors
+
+    def get_upgrade_targets(self):
+        """
+        Return the heads following the applied revisions, that is the heads to upgrade to in
+        order to bring every installed branch up to date, without installing new branches.
+        """
+        targets = set()
+        seen = set(self.applied)
+        todo = [rev for applied in self.applied for rev in self.next[applied]]
+        while todo:
+            rev = todo.pop()
+            if rev in seen:
+                continue
+            seen.add(rev)
+            if not self.next[rev]:
+                targets.add(rev)
+            todo.extend(self.next[rev])
+        return targets
+
+    def layout(self, base):
+        """
+        Yield (revision id, down levels, next levels) for each revision of the branch starting
+        at the given base, levels being the columns of the lines coming from down revisions and
+        going to next revisions.
+
+        Revisions are visited depth first, a merge point being visited once all its down
+        revisions have been. The highest level used by pending revisions, needed to open a new
+        column at each fork, is maintained incrementally, so that the layout is linear in the
+        size of the graph (times its width in the worst case).
+        """
+        levels = defaultdict(set)
+        seen = set()
+        todo = []
+        in_todo = defaultdict(int)  # number of occurrences of each revision in todo
+        active = defaultdict(int)  # number of occurrences of each level in levels of todo
+        top = -1  # upper bound of the highest active level
+
+        def activate(level, count):
+            nonlocal top
+            active[level] += count
+            if count and level > top:
+                top = level
+
+        def push(rev):
+            todo.append(rev)
+            in_todo[rev] += 1
+            for level in levels[rev]:
+                activate(level, 1)
+
+        def add_level(rev, level):
+            if level not in levels[rev]:
+                levels[rev].add(level)
+                activate(level, in_todo[rev])
+
+        push(base)
+        while todo:
+            rev = todo.pop()
+            in_todo[rev] -= 1
+            for level in levels[rev]:
+                active[level] -= 1
+
+            down_levels = levels[rev]
+            down_revisions = self.down[rev]
+            if len(down_revisions) > 1 and (not seen.issuperset(down_revisions) or in_todo[rev]):
+                continue
+            seen.add(rev)
+
+            next_levels = set()
+            for j, next_rev in enumerate(self.next[rev]):
+                if j == 0:
+                    next_level = min(down_levels) if down_levels else 0
+                else:
+                    while not active[top]:
+                        top -= 1
+                    next_level = top + 1
+                add_level(next_rev, next_level)
+                next_levels.add(next_level)
+                push(next_rev)
+
+            yield rev, frozenset(down_levels), frozenset(next_levels)
 
 
 @db_cli.command()
@@ -116,7 +703,11 @@ def autoupgrade(directory, sql, tag, x_arg):
 @click.argument("branches", nargs=-1)
 @with_appcontext
 def status(directory, x_arg, show_dependencies, branches):
-    """Show all revisions sorted by branches."""
+    """Show all revisions sorted by branches.
+
+    Revisions are cached in the file set with the MIGRATIONS_CACHE config key
+    (migrations-cache.json in the instance folder by default, False to disable the cache).
+    """
     db = current_app.extensions["sqlalchemy"].db
     migrate = current_app.extensions["migrate"].migrate
 
@@ -125,22 +716,40 @@ def status(directory, x_arg, show_dependencies, branches):
     migration_context = MigrationContext.configure(db.session.connection())
 
     current_heads = migration_context.get_current_heads()
-    applied_rev = set(script.iterate_revisions(current_heads, "base"))
-
-    bases = [script.get_revision(base) for base in script.get_bases()]
-    bases = {
-        next(iter(base.branch_labels)): base
-        for base in sorted(bases, key=lambda rev: next(iter(rev.branch_labels)))
-    }
-    heads = [script.get_revision(head) for head in script.get_heads()]
-
-    def print_revision(
-        prefix, revision, *, file=None, show_branch_label=False, show_dependencies=False
-    ):
+    graph = RevisionGraph(load_revisions(script, get_revisions_cache_path()), current_heads)
+    print_status(graph, branches, show_dependencies)
+
+
+def print_status(graph, branches=(), show_dependencies=False):
+    """
+    Print revisions of the given RevisionGraph sorted by branches
+    """
+    applied_rev = graph.applied
+    dependency_trees = {}
+
+    def get_dependency_tree(rev):
+        """
+        Return (relative prefix, revision id) of the lines of the dependency tree of a revision,
+        computed once per revision
+        """
+        if rev not in dependency_trees:
+            tree = []
+            deps = graph.dependencies[rev]
+            for i, dep in enumerate(deps):
+                symbol = box_drowing(
+                    up=True, down=i < len(deps) - 1, left=False, right=True, bold=False
+                )
+                tree.append((symbol + " ", dep))
+                tree += [("  " + prefix, dep_rev) for prefix, dep_rev in get_dependency_tree(dep)]
+            dependency_trees[rev] = tree
+        return dependency_trees[rev]
+
+    def print_revision(prefix, rev, *, file=None, show_branch_label=False):
+        revision = graph.revisions[rev]
         (branch_label,) = revision.branch_labels
-        branch_base = bases[branch_label]
+        branch_base = graph.bases[branch_label]
         if branch_base in applied_rev:
-            fg = "white" if revision in applied_rev else "red"
+            fg = "white" if rev in applied_rev else "red"
         else:
             fg = None
         branch_display = f"({branch_label}) " if show_branch_label else ""
@@ -148,63 +757,14 @@ def status(directory, x_arg, show_dependencies, branches):
             click.style(f"{prefix}{branch_display}{revision.revision} {revision.doc}", fg=fg),
             file=file,
         )
-        if show_dependencies and revision.dependencies:
-            deps = (
-                (revision.dependencies,)
-                if type(revision.dependencies) == str
-                else revision.dependencies
-            )
-            for i, dep in enumerate(deps):
-                dep = script.get_revision(dep)
-                symbol = box_drowing(
-                    up=True, down=i < len(deps) - 1, left=False, right=True, bold=False
-                )
-                print_revision(
-                    " " * len(prefix) + symbol + " ",
-                    dep,
-                    file=output,
-                    show_branch_label=True,
-                    show_dependencies=show_dependencies,
-                )
 
     outdated = False
-    for branch_label, branch_base in bases.items():
+    for branch_label, branch_base in graph.bases.items():
         output = StringIO()
         if branches and branch_label not in branches:
             continue
-        levels = defaultdict(set)
         branch_outdated = False
-        seen = set()
-        todo = deque()
-        todo.append(branch_base)
-        while todo:
-            rev = todo.pop()
-
-            down_levels = levels[rev]
-            if rev.is_merge_point:
-                down_revisions = rev.down_revision
-            elif rev.down_revision:
-                down_revisions = [rev.down_revision]
-            else:
-                down_revisions = []
-            down_revisions = [script.get_revision(r) for r in down_revisions]
-
-            next_revisions = [script.get_revision(r) for r in rev.nextrev]
-
-            if rev.is_merge_point and (not seen.issuperset(down_revisions) or rev in todo):
-                continue
-            seen.add(rev)
-
-            next_levels = set()
-            for j, nextrev in enumerate(next_revisions):
-                if j == 0:
-                    next_level = min(down_levels) if down_levels else 0
-                else:
-                    next_level = max(chain(*[levels[rev] for rev in todo])) + 1
-                levels[nextrev].add(next_level)
-                next_levels.add(next_level)
-                todo.append(nextrev)
-
+        for rev, down_levels, next_levels in graph.layout(branch_base):
             all_levels = list(chain(down_levels, next_levels))
             min_level = min(all_levels, default=0)
             max_level = max(all_levels, default=0)
@@ -224,12 +784,13 @@ def status(directory, x_arg, show_dependencies, branches):
             if branch_base in applied_rev and rev not in applied_rev:
                 outdated = True
                 branch_outdated = True
-            print_revision(
-                f"  [{check}] {symbol} ",
-                rev,
-                file=output,
-                show_dependencies=show_dependencies,
-            )
+            prefix = f"  [{check}] {symbol} "
+            print_revision(prefix, rev, file=output)
+            if show_dependencies:
+                for dep_prefix, dep in get_dependency_tree(rev):
+                    print_revision(
+                        " " * len(prefix) + dep_prefix, dep, file=output, show_branch_label=True
+                    )
 
         if branch_base in applied_rev:
             fg = "white"
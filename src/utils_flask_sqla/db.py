@@ -1,31 +1,86 @@
-from flask import request
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal
+from functools import lru_cache
+from uuid import UUID
+
+import sqlalchemy as sa
+from flask import current_app, request
 from werkzeug.exceptions import BadRequest
 
-__all__ = ["ordered"]
+__all__ = ["ordered", "paginated", "paginated_with_count"]
 
+# Maximum number of (model, path) resolutions kept in cache
+PATH_CACHE_SIZE = 1024
 
-def get_column_from_path(select, model, path, *, join=False):
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def resolve_column_path(model, path):
     """
-    Return a tuple (select, column), with column retrieved from the model following the given path.
-    If join is True, each time a relationship is traversed, the related model is automatically
-    joined to the select statement.
+    Return a tuple (relationships, column) where relationships is a tuple of
+    (relationship path, relationship attribute) traversed following the given path from the model.
     """
-    field, _, path = path.partition(".")
-    if path:
+    relationships = []
+    *rel_fields, field = path.split(".")
+    for i, rel_field in enumerate(rel_fields):
         try:
-            rel = model.__mapper__.relationships[field]
+            rel = model.__mapper__.relationships[rel_field]
         except KeyError:
-            raise BadRequest("{} does not have a relationship '{}'".format(model, field))
-        if join:
-            select = select.join(getattr(model, field))
+            raise BadRequest("{} does not have a relationship '{}'".format(model, rel_field))
+        relationships.append((".".join(rel_fields[: i + 1]), getattr(model, rel_field)))
         model = rel.mapper.class_
-        return get_column_from_path(select, model, path, join=join)
-    else:
-        try:
-            col = model.__mapper__.columns[field]
-        except KeyError:
-            raise BadRequest("{} does not have a field '{}'".format(model, field))
-        return select, col
+    try:
+        col = model.__mapper__.columns[field]
+    except KeyError:
+        raise BadRequest("{} does not have a field '{}'".format(model, field))
+    return tuple(relationships), col
+
+
+def get_column_from_path(select, model, path, *, join=False, joined=None):
+    """
+    Return a tuple (select, column), with column retrieved from the model following the given path.
+    If join is True, each time a relationship is traversed, the related model is automatically
+    joined to the select statement.
+    If a set is given as joined, relationship paths already in the set are not joined again,
+    and joined relationship paths are added to it.
+    """
+    relationships, col = resolve_column_path(model, path)
+    if join:
+        for rel_path, rel in relationships:
+            if joined is not None:
+                if rel_path in joined:
+                    continue
+                joined.add(rel_path)
+            select = select.join(rel)
+    return select, col
+
+
+def get_sort_columns(select, model, sort_fields, *, join=False):
+    """
+    Return a tuple (select, columns) where columns is a list of (column, descending)
+    for the given sort fields, a list of column paths optionally prefixed with '-'.
+
+    Relationships are joined once whatever the number of fields referring to them.
+    If join is False, a BadRequest is raised if a column is not part of from clauses.
+    """
+    columns = []
+    joined = set()
+    from_columns = None
+    for path in sort_fields:
+        descending = path.startswith("-")
+        if descending:
+            path = path[1:]
+        select, col = get_column_from_path(select, model, path, join=join, joined=joined)
+        if not join:
+            if from_columns is None:
+                from_columns = {
+                    c for from_clause in select.get_final_froms() for c in from_clause.columns
+                }
+            if col not in from_columns:
+                raise BadRequest("{} is not part of from clauses".format(path))
+        columns.append((col, descending))
+    return select, columns
 
 
 def ordered(select, model, *, order_by=None, join=False, arg_name="sort", reset=False):
@@ -117,26 +172,8 @@ def ordered(select, model, *, order_by=None, join=False, arg_name="sort", reset=
 
     sort_fields = request.args.get(arg_name)
     if sort_fields:
-        order_by = []
-        sort_fields = sort_fields.split(",")
-        for path in sort_fields:
-            direction = None
-            if path.startswith("-"):
-                path = path[1:]
-                direction = "desc"
-
-            select, col = get_column_from_path(select, model, path, join=join)
-            if not join and not any(
-                [col in from_clause.columns.values() for from_clause in select.get_final_froms()]
-            ):
-                raise BadRequest("{} is not part of from clauses".format(path))
-
-            if direction == "desc":
-                col = col.desc()
-            else:
-                col = col.asc()
-
-            order_by.append(col)
+        select, columns = get_sort_columns(select, model, sort_fields.split(","), join=join)
+        order_by = [col.desc() if descending else col.asc() for col, descending in columns]
         if reset:
             select = select.order_by(None)
         return select.order_by(*order_by)
@@ -150,3 +187,245 @@ def ordered(select, model, *, order_by=None, join=False, arg_name="sort", reset=
             return select.order_by(order_by)
 
     return select
+
+
+def encode_cursor(values):
+    """
+    Encode the given sort key values into an opaque cursor
+    """
+    data = json.dumps(
+        [v.isoformat() if isinstance(v, (datetime.date, datetime.time)) else v for v in values],
+        default=str,
+        separators=(",", ":"),
+    )
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode the given cursor into sort key values of the given columns
+    """
+    try:
+        values = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise BadRequest("Invalid cursor")
+    return [decode_cursor_value(value, col) for value, col in zip(values, columns)]
+
+
+def decode_cursor_value(value, col):
+    if value is None:
+        return None
+    try:
+        python_type = col.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type in (datetime.datetime, datetime.date, datetime.time):
+            return python_type.fromisoformat(value)
+        elif python_type in (Decimal, UUID):
+            return python_type(value)
+    except (TypeError, ValueError):
+        raise BadRequest("Invalid cursor")
+    if python_type in (int, float, str, bool) and not isinstance(value, python_type):
+        if not (python_type is float and isinstance(value, int)):
+            raise BadRequest("Invalid cursor")
+    return value
+
+
+def get_keyset_clause(columns, values):
+    """
+    Return the where clause selecting rows located after the given sort key values,
+    columns being a list of (column, descending).
+    If all columns are sorted in the same direction, a row-value comparison is used.
+    """
+    values = [sa.literal(value, type_=col.type) for (col, _), value in zip(columns, values)]
+    descendings = {descending for _, descending in columns}
+    if len(descendings) == 1:
+        left = sa.tuple_(*[col for col, _ in columns])
+        right = sa.tuple_(*values)
+        return left < right if descendings.pop() else left > right
+    clauses = []
+    for i, ((col, descending), value) in enumerate(zip(columns, values)):
+        equalities = [c == v for (c, _), v in zip(columns[:i], values[:i])]
+        clauses.append(sa.and_(*equalities, col < value if descending else col > value))
+    return sa.or_(*clauses)
+
+
+def paginated(
+    select,
+    model,
+    *,
+    limit=20,
+    join=False,
+    arg_name="sort",
+    cursor_arg_name="cursor",
+    session=None,
+):
+    """
+    Keyset pagination of an ORM select statement, sorted following the query parameter `arg_name`
+    (same syntax than `ordered`) with primary key as tiebreaker.
+
+    Instead of an offset, the sort key values of the last row of a page are encoded into
+    an opaque cursor; the next page is retrieved by giving this cursor in the query parameter
+    `cursor_arg_name`, which is translated into a row-value comparison such as
+    `(a, b) > (:a, :b)`. Deep pages are then index seeks rather than scans of skipped rows.
+
+    Sort columns should not be nullable, as rows with NULL values can not be compared.
+
+    >>> ## URL of the query : http://localhost/api/route?sort=-date,name&cursor=WyIyMDI0...
+    >>> items, cursor = paginated(select(Station), Station, limit=50)
+
+    Parameters
+    ==========
+    select : Select
+        A SQLAlchemy select of the model
+    model : Model
+        The model of the select
+    limit : int
+        The maximum number of items per page
+    join : bool, optional
+        Whether to join relationships traversed by sort paths, see `ordered`
+    arg_name : str, optional
+        The name of the query parameter that contains the sorting information
+    cursor_arg_name : str, optional
+        The name of the query parameter that contains the cursor
+    session : Session, optional
+        Session to use, default to `model.query.session`
+
+    Returns
+    =======
+    Tuple[List[Model], Optional[str]]
+        Items of the page and cursor of the next page (None if this is the last page)
+    """
+    if session is None:
+        session = model.query.session
+    sort_fields = request.args.get(arg_name)
+    sort_fields = sort_fields.split(",") if sort_fields else []
+    select, columns = get_sort_columns(select, model, sort_fields, join=join)
+    sort_columns = {col for col, _ in columns}
+    columns += [(col, False) for col in model.__mapper__.primary_key if col not in sort_columns]
+
+    cursor = request.args.get(cursor_arg_name)
+    if cursor:
+        values = decode_cursor(cursor, [col for col, _ in columns])
+        select = select.where(get_keyset_clause(columns, values))
+    select = (
+        select.add_columns(*[col for col, _ in columns])
+        .order_by(None)
+        .order_by(*[col.desc() if descending else col.asc() for col, descending in columns])
+        .limit(limit + 1)
+    )
+    rows = session.execute(select).all()
+    items = [row[0] for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][1:]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def get_planner_count(select, session):
+    """
+    Return the number of rows estimated by the PostgreSQL planner for the given select,
+    or None if the database is not PostgreSQL.
+    """
+    dialect = session.get_bind().dialect
+    if dialect.name != "postgresql":
+        return None
+    compiled = select.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    plan = session.connection().exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + compiled.string, compiled.params
+    )
+    plan = plan.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+def get_default_session():
+    """
+    Return the session of the Flask-SQLAlchemy extension of the current application
+    """
+    extension = current_app.extensions["sqlalchemy"]
+    return getattr(extension, "db", extension).session
+
+
+def has_joined_collections(result):
+    """
+    Whether the rows of the given ORM result include joined eager loads of collections,
+    i.e. whether they must be made unique
+    """
+    cursor = getattr(result, "raw", None)
+    if cursor is None:
+        return False
+    return bool(getattr(cursor.context.compiled.compile_state, "multi_row_eager_loaders", False))
+
+
+def paginated_with_count(select, *, page=1, limit=20, approximate=None, session=None):
+    """
+    Return a page of a select statement together with the total number of rows, in a single
+    round trip: the total is computed by a `(SELECT count(*) FROM (<select>))` scalar subquery
+    added to the paged select, so that rows merged by DISTINCT or GROUP BY are counted once.
+
+    Rows are only made unique when collections are eagerly loaded with `joinedload`, the page
+    and the total then counting each object once; rows duplicated by joins of the select are
+    returned and counted as such.
+
+    Counting every filtered row may be expensive on large tables. If `approximate` is given,
+    the number of rows estimated by the PostgreSQL planner (`EXPLAIN`) is returned instead when
+    it exceeds `approximate`, and the page is retrieved without count.
+
+    >>> query = ordered(select(Station).where(Station.active), Station)
+    >>> items, total = paginated_with_count(query, page=3, limit=50, approximate=100000)
+
+    Parameters
+    ==========
+    select : Select
+        A SQLAlchemy select statement, usually ordered
+    page : int
+        The page number, starting at 1
+    limit : int
+        The number of items per page
+    approximate : Optional[int]
+        Threshold above which the planner estimation is used as total
+    session : Session, optional
+        Session to use, default to the session of the Flask-SQLAlchemy extension
+
+    Returns
+    =======
+    Tuple[List, int]
+        Items of the page and total number of rows. Items are the selected objects, or rows
+        if the select has several columns.
+    """
+    if session is None:
+        session = get_default_session()
+    offset = (page - 1) * limit
+    columns = len(select.column_descriptions)
+    count_select = sa.select(sa.func.count()).select_from(select.order_by(None).subquery())
+
+    def get_items(paged_select, with_total=False):
+        result = session.execute(paged_select.limit(limit).offset(offset))
+        if has_joined_collections(result):
+            result = result.unique()
+        rows = result.all()
+        if columns == 1:
+            items = [row[0] for row in rows]
+        else:
+            items = [tuple(row[:columns]) for row in rows]
+        if with_total:
+            return items, rows[0][-1] if rows else None
+        return items
+
+    if approximate is not None:
+        estimate = get_planner_count(select, session)
+        if estimate is not None and estimate > approximate:
+            return get_items(select), estimate
+    items, total = get_items(
+        select.add_columns(count_select.scalar_subquery().label("total")), with_total=True
+    )
+    if total is not None:
+        return items, total
+    elif offset == 0:
+        return items, 0
+    else:
+        # the page is beyond the last row, the total has not been returned
+        return items, session.scalar(count_select)
@@ -0,0 +1,174 @@
+"""
+Streaming ingestion of JSON arrays into SQLAlchemy models
+"""
+
+import codecs
+import json
+import logging
+import re
+from itertools import islice
+from time import perf_counter
+
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+__all__ = ["iter_json_array", "iter_request_json_array", "ingest"]
+
+logger = logging.getLogger(__name__)
+
+NON_WHITESPACE = re.compile(r"[^ \t\n\r]")
+
+
+def iter_json_array(stream, read_size=65536, encoding="utf-8"):
+    """
+    Yield elements of the JSON array read from the given binary stream, without loading
+    the whole document in memory.
+
+    A ValueError is raised if the document is not a well-formed JSON array.
+
+    >>> list(iter_json_array(io.BytesIO(b'[{"pk": 1}, {"pk": 2}]')))
+    [{'pk': 1}, {'pk': 2}]
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = stream.read(read_size)
+        if not data:
+            eof = True
+        buffer = buffer[pos:] + text_decoder.decode(data, final=eof)
+        pos = 0
+
+    def next_char():
+        """
+        Return next non-whitespace character (without consuming it), or None at end of stream
+        """
+        nonlocal pos
+        while True:
+            match = NON_WHITESPACE.search(buffer, pos)
+            if match is not None:
+                pos = match.start()
+                return buffer[pos]
+            pos = len(buffer)
+            if eof:
+                return None
+            fill()
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if next_char() == "]":
+        pos += 1
+    else:
+        while True:
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # a value not followed by a delimiter may be truncated (e.g. numbers)
+                    following = NON_WHITESPACE.search(buffer, end)
+                    if eof or (following is not None and following.group() in ",]"):
+                        break
+                fill()
+            pos = end
+            yield value
+            char = next_char()
+            pos += 1
+            if char == "]":
+                break
+            elif char != ",":
+                raise ValueError("Expected ',' or ']' in JSON array")
+    if next_char() is not None:
+        raise ValueError("Extra data after JSON array")
+
+
+def iter_request_json_array(read_size=65536):
+    """
+    Yield elements of the JSON array sent in the body of the current request,
+    reading it incrementally from the request stream.
+
+    A BadRequest is raised if the body is not a well-formed JSON array.
+    """
+    try:
+        yield from iter_json_array(request.stream, read_size=read_size)
+    except ValueError as e:
+        raise BadRequest(f"Invalid JSON array: {e}")
+
+
+def ingest(
+    model,
+    dicts_in,
+    *,
+    chunk_size=1000,
+    recursif=False,
+    commit=False,
+    session=None,
+    progress=None,
+):
+    """
+    Create model instances from an iterable of dicts using `from_dict`, by chunks.
+
+    After each chunk, created instances are flushed then expunged from the session,
+    keeping memory usage bounded whatever the number of elements.
+
+    >>> ingest(Station, iter_request_json_array(), chunk_size=500, commit=True)
+    {'count': 1200, 'chunks': [0.41, 0.39, 0.17]}
+
+    Parameters
+    ----------
+    model : Model
+        A model decorated with `@serializable`
+    dicts_in : Iterable[dict]
+        Values of the instances to create, e.g. `iter_request_json_array()`
+    chunk_size : int
+        Number of instances flushed at once
+    recursif : bool
+        Passed to `from_dict`
+    commit : bool
+        Commit the session after each chunk
+    session : Session, optional
+        Session to use, default to `model.query.session`
+    progress : callable, optional
+        Called after each chunk with the total number of ingested elements
+        and the chunk duration (in seconds)
+
+    Returns
+    -------
+    dict
+        Total number of ingested elements (`count`) and duration of each chunk (`chunks`)
+    """
+    if session is None:
+        session = model.query.session
+    report = {"count": 0, "chunks": []}
+    dicts_in = iter(dicts_in)
+    while True:
+        start = perf_counter()
+        chunk = list(islice(dicts_in, chunk_size))
+        if not chunk:
+            break
+        instances = [model().from_dict(dict_in, recursif) for dict_in in chunk]
+        session.add_all(instances)
+        session.flush()
+        for instance in instances:
+            session.expunge(instance)
+        if commit:
+            session.commit()
+        duration = perf_counter() - start
+        report["count"] += len(instances)
+        report["chunks"].append(duration)
+        logger.info(
+            "Ingested {} {} ({} in {:.3f}s)".format(
+                report["count"], model.__name__, len(instances), duration
+            )
+        )
+        if progress is not None:
+            progress(report["count"], duration)
+    return report
@@ -1,12 +1,18 @@
-from alembic import context
+from alembic import context, op
+from alembic.util import CommandError
 import logging
-from contextlib import ExitStack
+from contextlib import ExitStack, nullcontext
 from tempfile import TemporaryDirectory
 from shutil import copyfileobj
 from urllib.request import urlopen
+from datetime import date, datetime
+from time import perf_counter
 import lzma
+import threading
 import os, os.path
 
+import sqlalchemy as sa
+
 from ..utils import remote_file
 
 logger = logging.getLogger("alembic.runtime.migration")
@@ -35,3 +41,637 @@ class open_remote_file(remote_file):
     def __enter__(self):
         remote_file_path = super().__enter__()
         return self.enter_context(self.open_fct(remote_file_path))
+
+
+def get_table(table, *columns):
+    """
+    Retourne la table (éventuellement préfixée par son schéma, « schema.table ») avec les
+    colonnes demandées, ou la table elle-même s’il s’agit déjà d’un objet Table.
+    """
+    if isinstance(table, sa.sql.expression.TableClause):
+        return table
+    schema, _, name = table.rpartition(".")
+    return sa.table(name, *map(sa.column, columns), schema=schema or None)
+
+
+def execute_in_batches(
+    statement,
+    table,
+    key,
+    *,
+    batch_size=10000,
+    where=None,
+    start_after=None,
+    autocommit=None,
+    progress=None,
+    connection=None,
+):
+    """
+    Exécute une requête UPDATE, DELETE ou INSERT … SELECT par lots, en parcourant la table
+    selon l’ordre de la clé (pagination par clé, sans OFFSET), afin de ne pas verrouiller
+    toutes les lignes ni générer tout le WAL dans une seule transaction.
+
+    La requête est exécutée une fois par lot avec les paramètres `lower` et `upper`, bornes
+    incluses des clés du lot :
+
+    >>> execute_in_batches(
+    ...     "UPDATE gn_synthese.synthese SET id_area = NULL "
+    ...     "WHERE id_synthese BETWEEN :lower AND :upper",
+    ...     "gn_synthese.synthese",
+    ...     "id_synthese",
+    ...     batch_size=50000,
+    ... )
+    {'count': 1200000, 'batches': [1.2, 1.1, …], 'last': 1200000}
+
+    Dans une migration alembic, les lots sont exécutés hors de la transaction de la migration
+    (`autocommit_block`), chaque lot étant alors validé dès qu’il est terminé ; si ce n’est
+    pas souhaité (autocommit=False) ou hors d’une migration, chaque lot est exécuté dans un
+    savepoint. Les bornes des lots étant lues dans la base, le mode --sql n’est pas supporté.
+    Après une interruption, le traitement peut être repris après la dernière clé traitée,
+    indiquée dans les logs, avec `start_after`.
+
+    Parameters
+    ----------
+    statement : str or Executable
+        Requête à exécuter pour chaque lot, utilisant les paramètres `lower` et `upper`
+    table : str or Table
+        Table parcourue, éventuellement préfixée par son schéma
+    key : str
+        Colonne indexée selon laquelle la table est parcourue, les lignes de même clé étant
+        traitées dans le même lot
+    batch_size : int
+        Nombre de clés par lot
+    where : str or ClauseElement, optional
+        Filtre des lignes de la table à traiter, appliqué au calcul des bornes des lots
+    start_after : optional
+        Clé à partir de laquelle (exclue) reprendre le traitement
+    autocommit : bool, optional
+        Valider chaque lot hors de la transaction de la migration ; par défaut activé dans une
+        migration, il n’est pas supporté avec `connection`, dont la transaction est gérée par
+        l’appelant
+    progress : callable, optional
+        Appelée après chaque lot avec le nombre total de lignes traitées, la dernière clé
+        traitée et la durée du lot (en secondes)
+    connection : Connection, optional
+        Connexion à utiliser hors d’une migration, par défaut celle de la migration en cours
+
+    Returns
+    -------
+    dict
+        Nombre de lignes traitées (`count`), durée de chaque lot (`batches`) et dernière clé
+        traitée (`last`)
+    """
+    if isinstance(statement, str):
+        statement = sa.text(statement)
+    if isinstance(where, str):
+        where = sa.text(where)
+    table = get_table(table, key)
+    column = table.c[key]
+    keys = sa.select(column).order_by(column).limit(batch_size)
+    if where is not None:
+        keys = keys.where(where)
+
+    def get_bounds_query(keys):
+        keys = keys.subquery()
+        return sa.select(sa.func.min(keys.c[key]), sa.func.max(keys.c[key]), sa.func.count())
+
+    first_bounds = get_bounds_query(keys)
+    next_bounds = get_bounds_query(keys.where(column > sa.bindparam("start_after")))
+
+    if connection is None:
+        migration_context = op.get_context()
+        if migration_context.as_sql:
+            raise CommandError("execute_in_batches() cannot be used in --sql mode")
+        connection = op.get_bind()
+        if autocommit is None:
+            autocommit = True
+    elif autocommit:
+        raise CommandError("execute_in_batches() cannot autocommit on the given connection")
+    block = migration_context.autocommit_block() if autocommit else nullcontext()
+
+    report = {"count": 0, "batches": [], "last": start_after}
+    start = perf_counter()
+    with block:
+        while True:
+            if report["last"] is None:
+                bounds = connection.execute(first_bounds)
+            else:
+                bounds = connection.execute(next_bounds, {"start_after": report["last"]})
+            lower, upper, batch_count = bounds.one()
+            if not batch_count:
+                break
+            batch_start = perf_counter()
+            with nullcontext() if autocommit else connection.begin_nested():
+                result = connection.execute(statement, {"lower": lower, "upper": upper})
+            duration = perf_counter() - batch_start
+            report["count"] += max(result.rowcount, 0)
+            report["batches"].append(duration)
+            report["last"] = upper
+            elapsed = perf_counter() - start
+            logger.info(
+                "%d rows processed in %.1fs (%.0f rows/s), last key: %r",
+                report["count"],
+                elapsed,
+                report["count"] / elapsed,
+                upper,
+            )
+            if progress is not None:
+                progress(report["count"], upper, duration)
+            if batch_count < batch_size:
+                break
+    return report
+
+
+INDEX_VALIDITY_QUERY = sa.text("""
+    SELECT i.indisvalid
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relname = :name AND n.nspname = coalesce(:schema, current_schema())
+""")
+
+INDEX_PROGRESS_QUERY = sa.text("""
+    SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+    FROM pg_stat_progress_create_index
+    WHERE pid = :pid
+""")
+
+
+def sample_index_progress(engine, pid, stop, interval, progress):
+    """
+    Journalise, toutes les `interval` secondes jusqu’à ce que `stop` soit positionné,
+    l’avancement de la création d’index du processus `pid` lu dans
+    pg_stat_progress_create_index depuis une connexion annexe.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        while not stop.wait(interval):
+            row = connection.execute(INDEX_PROGRESS_QUERY, {"pid": pid}).one_or_none()
+            if row is None:
+                continue
+            row = dict(row._mapping)
+            if row["blocks_total"]:
+                done = f"{100 * row['blocks_done'] / row['blocks_total']:.0f}% blocks"
+            elif row["tuples_total"]:
+                done = f"{100 * row['tuples_done'] / row['tuples_total']:.0f}% tuples"
+            else:
+                done = "…"
+            logger.info("%s: %s", row["phase"], done)
+            if progress is not None:
+                progress(row)
+
+
+def create_index_concurrently(
+    index_name,
+    table_name,
+    columns,
+    *,
+    schema=None,
+    progress_interval=10,
+    progress=None,
+    **kw,
+):
+    """
+    Crée un index avec CREATE INDEX CONCURRENTLY, sans bloquer les écritures sur la table
+    pendant sa construction, à utiliser dans une révision à la place de `op.create_index` :
+
+    >>> create_index_concurrently("i_synthese_date_min", "synthese", ["date_min"],
+    ...                           schema="gn_synthese")
+
+    La création concurrente ne pouvant être réalisée dans une transaction, elle est exécutée
+    hors de la transaction de la migration (`autocommit_block`). Un index du même nom laissé
+    invalide par une tentative précédente échouée est supprimé puis recréé ; un index valide
+    existant est conservé, ce qui permet de relancer une révision interrompue. L’avancement
+    (pg_stat_progress_create_index) est journalisé toutes les `progress_interval` secondes,
+    et transmis à la fonction `progress` le cas échéant.
+
+    Les autres paramètres sont ceux de `op.create_index` (unique, postgresql_where, …).
+    Hors PostgreSQL, l’index est créé normalement.
+    """
+    migration_context = op.get_context()
+    if migration_context.dialect.name != "postgresql":
+        op.create_index(index_name, table_name, columns, schema=schema, **kw)
+        return
+    stop = threading.Event()
+    sampler = None
+    with migration_context.autocommit_block():
+        if not migration_context.as_sql:
+            connection = op.get_bind()
+            valid = connection.execute(
+                INDEX_VALIDITY_QUERY, {"name": index_name, "schema": schema}
+            ).scalar()
+            if valid:
+                logger.info("Index %s already exists", index_name)
+                return
+            elif valid is not None:
+                logger.warning("Dropping invalid index %s left by a failed attempt", index_name)
+                op.drop_index(index_name, table_name, schema=schema, postgresql_concurrently=True)
+            pid = connection.exec_driver_sql("SELECT pg_backend_pid()").scalar()
+            sampler = threading.Thread(
+                target=sample_index_progress,
+                args=(connection.engine, pid, stop, progress_interval, progress),
+                daemon=True,
+            )
+            sampler.start()
+        try:
+            op.create_index(
+                index_name, table_name, columns, schema=schema, postgresql_concurrently=True, **kw
+            )
+        finally:
+            if sampler is not None:
+                stop.set()
+                sampler.join()
+
+
+def drop_index_concurrently(index_name, table_name=None, *, schema=None, **kw):
+    """
+    Supprime un index avec DROP INDEX CONCURRENTLY IF EXISTS, hors de la transaction de la
+    migration : opération inverse de `create_index_concurrently`, pour la fonction
+    `downgrade` des révisions. Hors PostgreSQL, l’index est supprimé normalement.
+    """
+    migration_context = op.get_context()
+    if migration_context.dialect.name != "postgresql":
+        op.drop_index(index_name, table_name, schema=schema, **kw)
+        return
+    with migration_context.autocommit_block():
+        op.drop_index(
+            index_name,
+            table_name,
+            schema=schema,
+            postgresql_concurrently=True,
+            if_exists=True,
+            **kw,
+        )
+
+
+def get_range_bounds(start, end, interval):
+    """
+    Retourne les intervalles [début, fin[ successifs de longueur `interval` (entier,
+    timedelta ou relativedelta) couvrant [start, end[.
+    """
+    bounds = []
+    lower = start
+    while lower < end:
+        upper = lower + interval
+        bounds.append((lower, upper))
+        lower = upper
+    return bounds
+
+
+def render_bound(value):
+    if isinstance(value, (date, datetime)):
+        return f"'{value.isoformat()}'"
+    return str(int(value))
+
+
+# longueur maximale des identifiants PostgreSQL (NAMEDATALEN - 1)
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def get_suffixed_name(name, suffix):
+    """
+    Retourne le nom `name`_`suffix`, le nom étant tronqué afin que le suffixe soit conservé
+    dans la limite de longueur des identifiants PostgreSQL.
+    """
+    return f"{name[: MAX_IDENTIFIER_LENGTH - len(suffix) - 1]}_{suffix}"
+
+
+def get_partition_name(table_name, lower):
+    if isinstance(lower, datetime) and lower.time() != datetime.min.time():
+        suffix = lower.strftime("%Y%m%d%H%M%S")
+    elif isinstance(lower, (date, datetime)):
+        suffix = lower.strftime("%Y%m%d")
+    else:
+        suffix = str(lower).replace("-", "m")
+    return get_suffixed_name(table_name, suffix)
+
+
+def get_executor(connection):
+    """
+    Retourne la fonction d’exécution des requêtes et le dialecte : ceux de la connexion
+    si elle est fournie, sinon ceux de la migration en cours (compatible avec le mode --sql).
+    """
+    if connection is not None:
+        return (lambda sql: connection.execute(sa.text(sql))), connection.dialect
+    return op.execute, op.get_context().dialect
+
+
+def create_range_partitions(
+    table_name, start, end, interval, *, schema=None, default=False, connection=None
+):
+    """
+    Crée les partitions manquantes d’une table partitionnée par intervalle (PARTITION BY
+    RANGE) couvrant [start, end[ par tranches de `interval`, par exemple pour créer à
+    l’avance les partitions des mois à venir :
+
+    >>> create_range_partitions("synthese", date(2024, 1, 1), date(2026, 1, 1),
+    ...                         relativedelta(months=1), schema="gn_synthese")
+
+    Les partitions sont nommées d’après la table et leur borne inférieure
+    (synthese_20240101, …) ; celles qui existent déjà sont conservées. Avec `default`, une
+    partition par défaut (synthese_default) recevant les lignes hors de toutes les partitions
+    est également créée. Les lignes de la partition par défaut appartenant à une nouvelle
+    partition doivent en être retirées au préalable.
+
+    Utilisable dans une révision, ou hors migration avec `connection`.
+    Retourne la liste des noms des partitions.
+    """
+    execute, dialect = get_executor(connection)
+    preparer = dialect.identifier_preparer
+    parent = preparer.format_table(sa.table(table_name, schema=schema))
+    partitions = []
+    for lower, upper in get_range_bounds(start, end, interval):
+        name = get_partition_name(table_name, lower)
+        partition = preparer.format_table(sa.table(name, schema=schema))
+        execute(
+            f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {parent} "
+            f"FOR VALUES FROM ({render_bound(lower)}) TO ({render_bound(upper)})"
+        )
+        partitions.append(name)
+    if default:
+        name = get_suffixed_name(table_name, "default")
+        partition = preparer.format_table(sa.table(name, schema=schema))
+        execute(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {parent} DEFAULT")
+    return partitions
+
+
+def attach_partition(
+    table_name, partition_name, column, lower, upper, *, schema=None, connection=None
+):
+    """
+    Attache la table `partition_name`, préparée à l’avance (par exemple créée avec
+    CREATE TABLE … (LIKE table) puis remplie), comme partition [lower, upper[ de la table
+    partitionnée `table_name` selon la colonne `column`.
+
+    Une contrainte CHECK correspondant aux bornes est d’abord ajoutée sans validation puis
+    validée, ce qui n’empêche pas les écritures sur la partition ; PostgreSQL n’a alors pas
+    à parcourir la partition pendant l’ATTACH, qui ne bloque ainsi que brièvement. La
+    contrainte est supprimée une fois la partition attachée.
+    """
+    execute, dialect = get_executor(connection)
+    preparer = dialect.identifier_preparer
+    parent = preparer.format_table(sa.table(table_name, schema=schema))
+    partition = preparer.format_table(sa.table(partition_name, schema=schema))
+    column = preparer.quote(column)
+    constraint = preparer.quote(get_suffixed_name(partition_name, "bounds"))
+    lower, upper = render_bound(lower), render_bound(upper)
+    execute(
+        f"ALTER TABLE {partition} ADD CONSTRAINT {constraint} "
+        f"CHECK ({column} IS NOT NULL AND {column} >= {lower} AND {column} < {upper}) NOT VALID"
+    )
+    execute(f"ALTER TABLE {partition} VALIDATE CONSTRAINT {constraint}")
+    execute(
+        f"ALTER TABLE {parent} ATTACH PARTITION {partition} "
+        f"FOR VALUES FROM ({lower}) TO ({upper})"
+    )
+    execute(f"ALTER TABLE {partition} DROP CONSTRAINT {constraint}")
+
+
+TABLE_INDEXES_QUERY = sa.text("""
+    SELECT c.relname AS name, pg_get_indexdef(i.indexrelid) AS definition,
+           i.indisunique AS is_unique, i.indisprimary AS is_primary,
+           array(
+               SELECT a.attname
+               FROM unnest(i.indkey) k
+               JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k
+           ) AS columns,
+           con.contype AS constraint_type,
+           pg_get_constraintdef(con.oid) AS constraint_definition
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    LEFT JOIN pg_constraint con
+        ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+       AND con.contype IN ('p', 'u', 'x')
+    WHERE i.indrelid = CAST(:table AS regclass)
+    ORDER BY c.relname
+""")
+
+TABLE_FOREIGN_KEYS_QUERY = sa.text("""
+    SELECT conname AS name, pg_get_constraintdef(oid) AS definition
+    FROM pg_constraint
+    WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'
+    ORDER BY conname
+""")
+
+TABLE_COLUMNS_QUERY = sa.text("""
+    SELECT attname AS name, attidentity <> '' AS is_identity,
+           pg_get_serial_sequence(:table, attname) AS sequence
+    FROM pg_attribute
+    WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped
+""")
+
+
+TABLE_DEPENDENTS_QUERY = sa.text("""
+    SELECT DISTINCT 'view ' || CAST(r.ev_class AS regclass) AS name
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    WHERE d.classid = CAST('pg_rewrite' AS regclass)
+      AND d.refobjid = CAST(:table AS regclass)
+      AND r.ev_class <> d.refobjid
+    UNION
+    SELECT 'foreign key ' || conname || ' of ' || CAST(conrelid AS regclass)
+    FROM pg_constraint
+    WHERE confrelid = CAST(:table AS regclass) AND conrelid <> confrelid AND contype = 'f'
+    ORDER BY name
+""")
+
+TABLE_SECURITY_QUERY = sa.text("""
+    SELECT relrowsecurity OR EXISTS (
+               SELECT FROM pg_policy WHERE polrelid = pg_class.oid
+           ) AS row_security,
+           pg_get_userbyid(relowner) AS owner, current_user AS user
+    FROM pg_class
+    WHERE oid = CAST(:table AS regclass)
+""")
+
+TABLE_GRANTS_QUERY = sa.text("""
+    SELECT a.privilege_type AS privilege, a.is_grantable,
+           CASE WHEN a.grantee = 0 THEN 'PUBLIC'
+                ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+    FROM pg_class c, aclexplode(c.relacl) a
+    WHERE c.oid = CAST(:table AS regclass) AND a.grantee <> c.relowner
+    ORDER BY a.grantee, a.privilege_type
+""")
+
+TABLE_TRIGGERS_QUERY = sa.text("""
+    SELECT tgname AS name, pg_get_triggerdef(oid) AS definition, tgenabled AS enabled
+    FROM pg_trigger
+    WHERE tgrelid = CAST(:table AS regclass) AND NOT tgisinternal
+    ORDER BY tgname
+""")
+
+TRIGGER_ENABLED = {
+    "D": "DISABLE TRIGGER",
+    "R": "ENABLE REPLICA TRIGGER",
+    "A": "ENABLE ALWAYS TRIGGER",
+}
+
+
+def partition_table(
+    table_name,
+    column,
+    start,
+    end,
+    interval,
+    *,
+    schema=None,
+    key=None,
+    batch_size=10000,
+    default=True,
+    drop=True,
+    drop_unique=False,
+    autocommit=False,
+    progress=None,
+):
+    """
+    Convertit une table existante en table partitionnée par intervalle (PARTITION BY RANGE)
+    selon la colonne `column` (date ou entier), dans une révision :
+
+    >>> partition_table("synthese", "date_min", date(2000, 1, 1), date(2026, 1, 1),
+    ...                 relativedelta(years=1), schema="gn_synthese", key="id_synthese")
+
+    La table est renommée en <table>_old, ses index en <index>_old ; une table partitionnée
+    de même nom, de même propriétaire et de même structure (valeurs par défaut, contraintes
+    CHECK et NOT NULL, clés étrangères) est créée avec les partitions couvrant [start, end[ (voir
+    `create_range_partitions`) et, avec `default`, une partition par défaut pour les autres
+    lignes. Les lignes sont ensuite copiées par lots selon `key` (colonne indexée, par défaut
+    la première colonne de la clé primaire) avec `execute_in_batches`, les index étant créés
+    après la copie (les contraintes d’unicité étant recréées en tant que contraintes). La clé
+    primaire et les index uniques doivent contenir la colonne de partitionnement : elle est
+    ajoutée à la clé primaire ; un index unique qui ne la contient pas provoque une erreur,
+    sauf avec `drop_unique`, auquel cas il n’est pas recréé (avec un avertissement) et
+    l’unicité correspondante n’est plus garantie. Les séquences des colonnes serial sont
+    rattachées à la nouvelle table, les droits (GRANT) et les triggers y sont recréés, ces
+    derniers après la copie afin de ne pas être déclenchés par celle-ci.
+
+    Ne sont pas supportés, et provoquent une erreur avant toute modification : les colonnes
+    identity, les contraintes d’exclusion, la sécurité au niveau des lignes (ROW LEVEL
+    SECURITY et politiques), ainsi que les vues et les clés étrangères d’autres tables
+    dépendant de la table, qui continueraient de porter sur l’ancienne table et en
+    empêcheraient la suppression : elles doivent être supprimées au préalable puis recréées
+    après la conversion.
+
+    Avec `drop`, l’ancienne table est supprimée.
+
+    Par défaut, la conversion se fait dans la transaction de la migration : les autres
+    sessions ne voient la nouvelle table qu’une fois complète, avec ses index, et sont
+    bloquées par le verrou ACCESS EXCLUSIVE posé sur la table dès son renommage.
+    Avec `autocommit` (voir `execute_in_batches`), la transaction de la migration est validée
+    avant la copie et chaque lot est validé individuellement : pendant la copie, les autres
+    sessions voient alors une table partiellement remplie, sans clé primaire, index, ni
+    triggers, et peuvent y écrire sans contrôle d’unicité ; cette option est réservée à une
+    copie faite application arrêtée. En cas d’erreur, la copie peut être reprise avec
+    `execute_in_batches` après la dernière clé journalisée.
+    """
+    migration_context = op.get_context()
+    if migration_context.as_sql:
+        raise CommandError("partition_table() cannot be used in --sql mode")
+    connection = op.get_bind()
+    preparer = migration_context.dialect.identifier_preparer
+    old_name = get_suffixed_name(table_name, "old")
+    table = preparer.format_table(sa.table(table_name, schema=schema))
+    old_table = preparer.format_table(sa.table(old_name, schema=schema))
+    params = {"table": table}
+
+    columns = connection.execute(TABLE_COLUMNS_QUERY, params).all()
+    if any(col.is_identity for col in columns):
+        raise CommandError(f"Identity columns of {table} are not supported")
+    dependents = connection.execute(TABLE_DEPENDENTS_QUERY, params).scalars().all()
+    if dependents:
+        raise CommandError(
+            f"{table} cannot be partitioned while other objects depend on it: "
+            + ", ".join(dependents)
+        )
+    security = connection.execute(TABLE_SECURITY_QUERY, params).one()
+    if security.row_security:
+        raise CommandError(f"Row level security of {table} is not supported")
+    grants = connection.execute(TABLE_GRANTS_QUERY, params).all()
+    # definitions refer to the original table name, i.e. to the new table once created
+    indexes = connection.execute(TABLE_INDEXES_QUERY, params).all()
+    foreign_keys = connection.execute(TABLE_FOREIGN_KEYS_QUERY, params).all()
+    triggers = connection.execute(TABLE_TRIGGERS_QUERY, params).all()
+    for index in indexes:
+        if index.constraint_type == "x":
+            raise CommandError(f"Exclusion constraint {index.name} of {table} is not supported")
+        if index.is_unique and not index.is_primary and column not in index.columns:
+            if not drop_unique:
+                raise CommandError(
+                    f"Unique index {index.name} of {table} does not contain the partition key "
+                    f"{column}: it can only be dropped, with drop_unique=True"
+                )
+    (primary_key,) = [index for index in indexes if index.is_primary] or [None]
+    if key is None:
+        key = primary_key.columns[0] if primary_key is not None else column
+
+    op.execute(f"ALTER TABLE {table} RENAME TO {preparer.quote(old_name)}")
+    for index in indexes:
+        index_name = preparer.format_table(sa.table(index.name, schema=schema))
+        op.execute(
+            f"ALTER INDEX {index_name} RENAME TO "
+            f"{preparer.quote(get_suffixed_name(index.name, 'old'))}"
+        )
+    op.execute(
+        f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        f"INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS) "
+        f"PARTITION BY RANGE ({preparer.quote(column)})"
+    )
+    if security.owner != security.user:
+        op.execute(f"ALTER TABLE {table} OWNER TO {preparer.quote(security.owner)}")
+    for grant in grants:
+        op.execute(
+            f"GRANT {grant.privilege} ON {table} TO {grant.grantee}"
+            + (" WITH GRANT OPTION" if grant.is_grantable else "")
+        )
+    for col in columns:
+        if col.sequence is not None:
+            op.execute(
+                f"ALTER SEQUENCE {col.sequence} OWNED BY {table}.{preparer.quote(col.name)}"
+            )
+    for foreign_key in foreign_keys:
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {preparer.quote(foreign_key.name)} "
+            f"{foreign_key.definition}"
+        )
+    create_range_partitions(table_name, start, end, interval, schema=schema, default=default)
+
+    execute_in_batches(
+        f"INSERT INTO {table} SELECT * FROM {old_table} "
+        f"WHERE {preparer.quote(key)} BETWEEN :lower AND :upper",
+        sa.table(old_name, sa.column(key), schema=schema),
+        key,
+        batch_size=batch_size,
+        autocommit=autocommit,
+        progress=progress,
+    )
+
+    for index in indexes:
+        if index.is_primary:
+            pk_columns = list(index.columns)
+            if column not in pk_columns:
+                pk_columns.append(column)
+            op.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {preparer.quote(index.name)} "
+                f"PRIMARY KEY ({', '.join(map(preparer.quote, pk_columns))})"
+            )
+        elif index.is_unique and column not in index.columns:
+            logger.warning(
+                "Unique index %s does not contain the partition key %s, it is not created",
+                index.name,
+                column,
+            )
+        elif index.constraint_type == "u":
+            op.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {preparer.quote(index.name)} "
+                f"{index.constraint_definition}"
+            )
+        else:
+            op.execute(index.definition)
+    for trigger in triggers:
+        op.execute(trigger.definition)
+        if trigger.enabled in TRIGGER_ENABLED:
+            op.execute(
+                f"ALTER TABLE {table} {TRIGGER_ENABLED[trigger.enabled]} "
+                f"{preparer.quote(trigger.name)}"
+            )
+    if drop:
+        op.execute(f"DROP TABLE {old_table}")
+    op.execute(f"ANALYZE {table}")
@@ -1,9 +1,18 @@
+from functools import lru_cache
+
 from sqlalchemy.sql.expression import BooleanClauseList, BinaryExpression
 from flask_sqlalchemy.model import DefaultMeta
-from sqlalchemy.sql import select, Select, CompoundSelect
+from sqlalchemy.orm.attributes import QueryableAttribute
+
+from utils_flask_sqla.utils import is_joined
+from sqlalchemy.sql import bindparam, false, operators, select, visitors, Select, CompoundSelect
+from sqlalchemy.sql.elements import BindParameter
 
 AUTHORIZED_WHERECLAUSE_TYPES = [bool, BooleanClauseList, BinaryExpression]
 
+# Maximum number of filter shapes cached per cached qfilter method
+QFILTER_CACHE_SIZE = 128
+
 
 def is_whereclause_compatible(object):
     return any([isinstance(object, type_) for type_ in AUTHORIZED_WHERECLAUSE_TYPES])
@@ -40,10 +49,36 @@ def qfilter(*args_dec, **kwargs_dec):
     >>> query = Station.filter_by_paramsQ(id_station=1)
     >>> query2 = select(Station).where(Station.filter_by_params(id_station=1))
 
+    With `cache=True`, the structure built by the method is cached per (class, set of provided
+    parameters): on the first call with a given set of parameters, the method is called with bound
+    parameters in place of the values, and later calls only bind the values to a copy of the cached
+    statement. The method is then run once per shape instead of once per call, and the produced
+    statements always hit the SQLAlchemy compiled cache. The structure built by the method must
+    thus only depend on which parameters are provided, not on their values (lists, tuples and sets
+    are bound as expanding parameters, e.g. for `in_`, and None values are not bound). Statements
+    bound to the same (hashable) values of the same types are also cached and returned as is.
+
+    Warning: with `cache=True`, the method must not use parameter values in Python, as it receives
+    bound parameters instead of the values. A truthiness check (`if id_area:`) or an ordering
+    comparison (`id_area > 0`) raises `TypeError: Boolean value of this clause is not defined`.
+    An equality or membership test (`id_area == 1`, `id_area in (1, 2)`) is always False and an
+    f-string renders the parameter name (`:id_area`): the structure built by the first call is
+    then silently reused for every value.
+
+    Statistics of both caches are available with `Station.filter_by_params.cache_info()`
+    (one miss per shape) and `Station.filter_by_params.statement_cache_info()`.
+
+    >>> class Station(db.Model):
+            @qfilter(query=True, cache=True)
+            def filter_by_area(cls, id_area, **kwargs):
+                return kwargs["query"].where(Station.id_area == id_area)
+
     Parameters
     ----------
     query : bool
         decorated function must (or not) return a query (Select)
+    cache : bool
+        cache the structure built by the decorated function per set of provided parameters
 
     Returns
     -------
@@ -66,11 +101,59 @@ def qfilter(*args_dec, **kwargs_dec):
         return _qfilter(*args_dec, **kwargs_dec)
 
 
-def _qfilter(query=False):
+def get_param_kind(value):
+    if value is None:
+        return None
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return "expanding"
+    return "scalar"
+
+
+def get_bound_elements(element, keys):
+    """
+    Return the ids of the elements of the given clause which are, or contain,
+    a bound parameter whose key is in keys
+    """
+    found = {}
+
+    def walk(elem):
+        if id(elem) not in found:
+            found[id(elem)] = isinstance(elem, BindParameter) and elem.key in keys
+            for child in elem.get_children():
+                if walk(child):
+                    found[id(elem)] = True
+        return found[id(elem)]
+
+    walk(element)
+    return frozenset(id_ for id_, is_bound in found.items() if is_bound)
+
+
+def bind_values(element, bound_elements, params):
+    """
+    Return a copy of the given clause with values of params bound to its bound parameters,
+    as unique parameters. Only the elements containing bound parameters are copied.
+    """
+
+    def replace(elem, **kwargs):
+        if id(elem) not in bound_elements:
+            return elem
+        if isinstance(elem, BindParameter):
+            return BindParameter(
+                elem.key,
+                params[elem.key],
+                type_=elem.type,
+                unique=True,
+                expanding=elem.expanding,
+            )
+
+    return visitors.replacement_traverse(element, {}, replace)
+
+
+def _qfilter(query=False, cache=False):
     is_query = query
 
     def _qfilter_decorator(method):
-        def _(*args, **kwargs):
+        def call(*args, **kwargs):
             # verify if class of the method is ORM model
             sqla_class = args[0]
             if not isinstance(sqla_class, DefaultMeta):
@@ -98,6 +181,163 @@ def _qfilter(query=False):
             # if filter is wanted as where clause
             return result
 
+        def param_name(name):
+            return "{}_{}".format(method.__name__, name)
+
+        def bind(name, kind):
+            if kind is None:
+                return None
+            return bindparam(param_name(name), expanding=kind == "expanding")
+
+        @lru_cache(maxsize=QFILTER_CACHE_SIZE)
+        def build(sqla_class, args_kinds, kwargs_kinds):
+            args = [bind(i, kind) for i, kind in enumerate(args_kinds)]
+            kwargs = {name: bind(name, kind) for name, kind in kwargs_kinds}
+            result = call(sqla_class, *args, **kwargs)
+            if isinstance(result, bool):
+                return result, None
+            keys = {param_name(i) for i in range(len(args))}
+            keys |= {param_name(name) for name in kwargs}
+            return result, get_bound_elements(result, keys)
+
+        @lru_cache(maxsize=QFILTER_CACHE_SIZE)
+        def build_bound(sqla_class, args_kinds, kwargs_kinds, params):
+            params = {name: value for name, _, value in params}
+            return build_statement(sqla_class, args_kinds, kwargs_kinds, params)
+
+        def build_statement(sqla_class, args_kinds, kwargs_kinds, params):
+            result, bound_elements = build(sqla_class, args_kinds, kwargs_kinds)
+            if isinstance(result, bool):
+                return result
+            return bind_values(result, bound_elements, params)
+
+        def _(*args, **kwargs):
+            if not cache or kwargs.get("query", None) is not None:
+                return call(*args, **kwargs)
+            sqla_class, args = args[0], args[1:]
+            args_kinds = tuple(get_param_kind(value) for value in args)
+            kwargs_kinds = tuple(
+                sorted((name, get_param_kind(value)) for name, value in kwargs.items())
+            )
+            params = {param_name(i): value for i, value in enumerate(args)}
+            params.update({param_name(name): value for name, value in kwargs.items()})
+            # statements are immutable: the statement bound to the same values can be reused
+            try:
+                # values are keyed with their type (and the types of their items), as 1, 1.0
+                # and True are equal
+                hashable_params = []
+                for name, value in sorted(params.items()):
+                    if isinstance(value, (list, set)):
+                        value = tuple(value)
+                    types = tuple(map(type, value)) if isinstance(value, tuple) else type(value)
+                    hashable_params.append((name, types, value))
+                hashable_params = tuple(hashable_params)
+                hash(hashable_params)
+            except TypeError:
+                return build_statement(sqla_class, args_kinds, kwargs_kinds, params)
+            return build_bound(sqla_class, args_kinds, kwargs_kinds, hashable_params)
+
+        if cache:
+            _.cache_info = build.cache_info
+            _.statement_cache_info = build_bound.cache_info
+
+            def cache_clear():
+                build.cache_clear()
+                build_bound.cache_clear()
+
+            _.cache_clear = cache_clear
+
         return classmethod(_)
 
     return _qfilter_decorator
+
+
+def get_conjuncts(clause):
+    """
+    Return the list of predicates combined with AND in the given where clause
+    """
+    if clause is None:
+        return []
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [conjunct for c in clause.clauses for conjunct in get_conjuncts(c)]
+    return [clause]
+
+
+def is_same_join(join, other):
+    target, onclause, from_, flags = join
+    other_target, other_onclause, other_from, other_flags = other
+    if flags != other_flags or from_ is not other_from:
+        return False
+    if target is not other_target and not (
+        hasattr(target, "compare")
+        and hasattr(other_target, "compare")
+        and target.compare(other_target)
+    ):
+        return False
+    if onclause is None or other_onclause is None:
+        return onclause is other_onclause
+    return onclause.compare(other_onclause)
+
+
+def compose_filters(query, *filters):
+    """
+    Combine where clauses and selects returned by several qfilter methods (e.g. permissions,
+    scope and user filters) into the given select.
+
+    Joins of the given selects are added once: identical joins, and joins to a model or
+    relationship whose table is already part of the from clauses, are skipped. Where clauses are
+    split into their AND-combined predicates, and predicates structurally identical to an already
+    present one, such as the same `EXISTS` subquery on a relationship, are added only once.
+    Other clauses of the given selects (order by, limit...) are ignored.
+
+    >>> query = compose_filters(
+            select(Station),
+            Station.filter_by_scope(scope=2),  # select(Station).join(...).where(...)
+            Station.filter_by_params(**request.args),  # where clause
+        )
+
+    Parameters
+    ----------
+    query : Select
+        the select to filter
+    filters : Select or where clause
+        results of qfilter methods
+
+    Returns
+    -------
+    Select
+        the filtered select
+    """
+    predicates = get_conjuncts(query.whereclause)
+    new_predicates = []
+    joins = list(query._setup_joins)
+    for filter_ in filters:
+        if filter_ is True:
+            continue
+        elif filter_ is False:
+            filter_ = false()
+        if isinstance(filter_, Select):
+            for join in filter_._setup_joins:
+                target, onclause, from_, flags = join
+                if any(is_same_join(join, other) for other in joins):
+                    continue
+                if (
+                    onclause is None
+                    and from_ is None
+                    and (isinstance(target, (DefaultMeta, QueryableAttribute)))
+                    and is_joined(query, target)
+                ):
+                    continue
+                if from_ is None:
+                    query = query.join(target, onclause, **flags)
+                else:
+                    query = query.join_from(from_, target, onclause, **flags)
+                joins.append(join)
+            filter_ = filter_.whereclause
+        for predicate in get_conjuncts(filter_):
+            if not any(predicate.compare(other) for other in predicates):
+                predicates.append(predicate)
+                new_predicates.append(predicate)
+    if new_predicates:
+        query = query.where(*new_predicates)
+    return query
@@ -2,8 +2,9 @@ import csv
 import io
 import json
 from functools import wraps
+from types import GeneratorType
 
-from flask import Response, current_app
+from flask import Response, current_app, stream_with_context
 from werkzeug.datastructures import Headers
 
 
@@ -31,6 +32,27 @@ json_resp = json_resp_accept()
 json_resp_accept_empty_list = json_resp_accept([[]])
 
 
+def generate_json_array(items, buffer_size=65536):
+    """
+    Génère par blocs le tableau JSON des éléments donnés.
+    Les éléments de type bytes sont considérés comme déjà encodés en JSON
+    (e.g. résultat de la méthode as_json() des modèles @serializable).
+    """
+    buffer = bytearray(b"[")
+    for i, item in enumerate(items):
+        if i:
+            buffer += b","
+        if isinstance(item, (bytes, bytearray)):
+            buffer += item
+        else:
+            buffer += current_app.json.dumps(item, ensure_ascii=False).encode("utf-8")
+        if len(buffer) >= buffer_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+
 def to_json_resp(
     res,
     status=200,
@@ -52,8 +74,16 @@ def to_json_resp(
             "attachment",
             filename="export_{}.{}".format(filename, extension),
         )
+    if isinstance(res, (bytes, bytearray)):
+        # already encoded JSON, e.g. from as_json() or as_json_array()
+        body = res
+    elif isinstance(res, GeneratorType):
+        # streamed JSON array
+        body = stream_with_context(generate_json_array(res))
+    else:
+        body = current_app.json.dumps(res, ensure_ascii=False, indent=indent)
     return Response(
-        current_app.json.dumps(res, ensure_ascii=False, indent=indent),
+        body,
         status=status,
         mimetype="application/json",
         headers=headers,
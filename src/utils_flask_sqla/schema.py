@@ -1,8 +1,210 @@
+from functools import lru_cache
+from itertools import islice
+
+from marshmallow import Schema, fields, missing
 from marshmallow.fields import Nested
+from marshmallow.utils import ensure_text_type
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+import marshmallow_sqlalchemy
 from marshmallow_sqlalchemy.fields import RelatedList, Related
 
 # from flask_marshmallow.fields import RelatedList
 
+# Maximum number of (schema class, only, exclude) resolutions kept in cache
+ONLY_EXCLUDE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=ONLY_EXCLUDE_CACHE_SIZE)
+def get_fields_classification(schema_cls):
+    """
+    Return the sets of fields serialized by default, excluded by default and nested
+    for the given schema class
+    """
+    included_fields = set()
+    excluded_fields = set()
+    nested_fields = set()
+    for name, field in schema_cls._declared_fields.items():
+        # excluded fields at meta level are not even generated by auto-schema
+        if field is None:
+            continue
+        if (
+            isinstance(field, Nested)
+            or isinstance(field, RelatedList)
+            or isinstance(field, Related)
+        ):
+            nested_fields.add(name)
+        elif field.metadata.get("exclude", False):
+            excluded_fields.add(name)
+        elif (
+            hasattr(schema_cls.opts, "model")
+            and hasattr(schema_cls.opts.model.__mapper__.column_attrs, name)
+            and getattr(schema_cls.opts.model.__mapper__.column_attrs, name).deferred
+        ):
+            excluded_fields.add(name)
+        else:
+            included_fields.add(name)
+    return frozenset(included_fields), frozenset(excluded_fields), frozenset(nested_fields)
+
+
+@lru_cache(maxsize=ONLY_EXCLUDE_CACHE_SIZE)
+def resolve_only_exclude(schema_cls, only, exclude):
+    """
+    Return the ``only`` and ``exclude`` sets to give to marshmallow, and the first level fields
+    of ``only``, for the given schema class and ``only`` and ``exclude`` frozensets
+    """
+    included_fields, excluded_fields, nested_fields = get_fields_classification(schema_cls)
+    only = set(only) if only is not None else set()
+    additional_fields = {field[1:] for field in only if field.startswith("+")}
+    only = {field[1:] if field.startswith("+") else field for field in only}
+    firstlevel_only = {field.split(".", 1)[0] for field in only}
+    exclude = set(exclude) if exclude is not None else set()
+    exclude |= (excluded_fields | nested_fields) - firstlevel_only
+
+    # If only contains only nested & additional fields, we need to add included_fields to serialize nested, additional & included fields.
+    # If only does not contains nested or additional fields, we do nothing and marshmallow will serialize only specified fields.
+    if only and not firstlevel_only - nested_fields - additional_fields:
+        only |= included_fields
+    only -= {"-"}
+    return frozenset(only), frozenset(exclude), frozenset(firstlevel_only)
+
+
+def get_loader_options(schema, model):
+    """
+    Return SQLAlchemy loader options loading everything the given schema instance will dump
+    from instances of the given model: nested relationships are eagerly loaded (``selectinload``
+    for collections, ``joinedload`` otherwise) and columns are restricted with ``load_only``
+    when all dumped scalar fields are mapped columns.
+    """
+    mapper = model.__mapper__
+    options = []
+    columns = []
+    only_columns = True
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if isinstance(field, (Nested, Related, RelatedList)):
+            if attribute not in mapper.relationships:
+                continue
+            relationship = mapper.relationships[attribute]
+            attr = getattr(model, attribute)
+            related_model = relationship.mapper.class_
+            if relationship.uselist:
+                option = selectinload(attr)
+            else:
+                option = joinedload(attr)
+            if isinstance(field, Nested):
+                option = option.options(*get_loader_options(field.schema, related_model))
+            else:
+                related = field.inner if isinstance(field, RelatedList) else field
+                option = option.load_only(
+                    *[getattr(related_model, prop.key) for prop in related.related_keys]
+                )
+            options.append(option)
+        elif attribute in mapper.column_attrs:
+            columns.append(getattr(model, attribute))
+        else:
+            # e.g. properties or method fields which may need any column
+            only_columns = False
+    if only_columns and columns:
+        options.append(load_only(*columns))
+    return options
+
+
+def get_temporal_serializer(field, schema_cls):
+    data_format = (
+        field.format
+        or getattr(schema_cls.opts, field.SCHEMA_OPTS_VAR_NAME, None)
+        or field.DEFAULT_FORMAT
+    )
+    format_func = field.SERIALIZATION_FUNCS.get(data_format)
+    if format_func is not None:
+        return format_func
+    return lambda value: value.strftime(data_format)
+
+
+def get_field_serializer(field, schema_cls):
+    """
+    Return a tuple (supported, serializer) where serializer is the conversion applied by the
+    given field on non-null values (None if values are dumped as is), for plain scalar fields.
+    Other fields, including subclasses of marshmallow fields, are not supported.
+    """
+    field_cls = type(field)
+    if field_cls is fields.Raw:
+        return True, None
+    elif field_cls is fields.String:
+        return True, ensure_text_type
+    elif field_cls is fields.UUID:
+        return True, str
+    elif field_cls in (fields.Integer, fields.Float) and not field.as_string:
+        return True, int if field_cls is fields.Integer else float
+    elif field_cls in (fields.DateTime, fields.Date, fields.Time):
+        return True, get_temporal_serializer(field, schema_cls)
+    return False, None
+
+
+@lru_cache(maxsize=ONLY_EXCLUDE_CACHE_SIZE)
+def get_dump_function(schema_cls, field_names):
+    """
+    Return a function dump(obj, schema) dumping an object with the given fields of the schema
+    class, reading attributes directly and applying only the needed conversions for plain
+    scalar fields; other fields are serialized by the bound field of the schema instance,
+    as marshmallow does. Return None if the schema overrides get_attribute.
+    """
+    if schema_cls.get_attribute is not Schema.get_attribute:
+        return None
+    plan = []
+    for name in field_names:
+        field = schema_cls._declared_fields[name]
+        key = field.data_key if field.data_key is not None else name
+        attribute = field.attribute or name
+        supported, serializer = get_field_serializer(field, schema_cls)
+        if not supported or "." in attribute or field.dump_default is not missing:
+            attribute = None  # serialized by the field
+        plan.append((key, name, attribute, serializer))
+    plan = tuple(plan)
+
+    def dump(obj, schema):
+        ret = {}
+        for key, name, attribute, serializer in plan:
+            if attribute is None:
+                value = schema.dump_fields[name].serialize(
+                    name, obj, accessor=schema.get_attribute
+                )
+            else:
+                value = getattr(obj, attribute, missing)
+                if serializer is not None and value is not None and value is not missing:
+                    value = serializer(value)
+            if value is missing:
+                continue
+            ret[key] = value
+        return ret
+
+    return dump
+
+
+class ModelConverter(marshmallow_sqlalchemy.ModelConverter):
+    """
+    Model converter ignoring ``query_expression()`` properties, such as the ones added by
+    ``@serializable(hybrid_expressions=[...])``, which have no type to be converted to a field.
+
+    >>> class StationSchema(SQLAlchemyAutoSchema):
+            class Meta:
+                model = Station
+                model_converter = ModelConverter
+    """
+
+    def fields_for_model(self, model, *, exclude=None, **kwargs):
+        query_expressions = {
+            key
+            for key, prop in inspect(model).column_attrs.items()
+            if dict(prop.strategy_key).get("query_expression")
+        }
+        exclude = set(exclude or ()) | query_expressions
+        fields = super().fields_for_model(model, exclude=exclude, **kwargs)
+        for key in query_expressions:
+            fields.pop(key, None)
+        return fields
+
 
 class SmartRelationshipsMixin:
     """
@@ -39,47 +241,75 @@ class SmartRelationshipsMixin:
     """
 
     def __init__(self, *args, **kwargs):
-        included_fields = set()
-        excluded_fields = set()
-        nested_fields = set()
-        for name, field in self._declared_fields.items():
-            # excluded fields at meta level are not even generated by auto-schema
-            if field is None:
-                continue
-            if (
-                isinstance(field, Nested)
-                or isinstance(field, RelatedList)
-                or isinstance(field, Related)
-            ):
-                nested_fields.add(name)
-            elif field.metadata.get("exclude", False):
-                excluded_fields.add(name)
-            elif (
-                hasattr(self.opts, "model")
-                and hasattr(self.opts.model.__mapper__.column_attrs, name)
-                and getattr(self.opts.model.__mapper__.column_attrs, name).deferred
-            ):
-                excluded_fields.add(name)
-            else:
-                included_fields.add(name)
-
         only = kwargs.pop("only", None)
-        only = set(only) if only is not None else set()
-        additional_fields = {field[1:] for field in only if field.startswith("+")}
-        only = {field[1:] if field.startswith("+") else field for field in only}
-        firstlevel_only = {field.split(".", 1)[0] for field in only}
         exclude = kwargs.pop("exclude", None)
-        exclude = set(exclude) if exclude is not None else set()
-        exclude |= (excluded_fields | nested_fields) - firstlevel_only
-
-        # If only contains only nested & additional fields, we need to add included_fields to serialize nested, additional & included fields.
-        # If only does not contains nested or additional fields, we do nothing and marshmallow will serialize only specified fields.
-        if only and not firstlevel_only - nested_fields - additional_fields:
-            only |= included_fields
-        only -= {"-"}
+        only, exclude, firstlevel_only = resolve_only_exclude(
+            type(self),
+            frozenset(only) if only is not None else None,
+            frozenset(exclude) if exclude is not None else None,
+        )
         if only:
-            kwargs["only"] = only
+            kwargs["only"] = set(only)
         if exclude:
-            kwargs["exclude"] = exclude
+            kwargs["exclude"] = set(exclude)
             self.opts.exclude = set(self.opts.exclude) - set(firstlevel_only)
         super().__init__(*args, **kwargs)
+        if self.dict_class is dict and all(
+            name in self._declared_fields for name in self.dump_fields
+        ):
+            self._dump_function = get_dump_function(type(self), tuple(self.dump_fields))
+        else:
+            self._dump_function = None
+
+    def _serialize(self, obj, *, many=False):
+        # Flat schemas are dumped by a function precompiled for the resolved fields,
+        # objects supporting item access (e.g. dicts) use the marshmallow accessor
+        if self._dump_function is None:
+            return super()._serialize(obj, many=many)
+        if many and obj is not None:
+            return [self._serialize(o) for o in obj]
+        if hasattr(obj, "__getitem__"):
+            return super()._serialize(obj)
+        return self._dump_function(obj, self)
+
+    def loader_options(self, model=None):
+        """
+        Return loader options to apply on the select of the dumped objects,
+        so that dumping with this schema does not trigger any lazy load.
+
+        .. code-block:: python
+
+           schema = ParentSchema(only=["childs.pk"])
+           query = select(Parent).options(*schema.loader_options())
+           schema.dump(db.session.scalars(query).all(), many=True)
+
+        :param model: the model of the dumped objects, default to the schema ``Meta.model``
+        """
+        if model is None:
+            model = self.opts.model
+        return get_loader_options(self, model)
+
+    def dump_iter(self, iterable, chunk_size=1000):
+        """
+        Dump the objects of the given iterable, yielding serialized objects one by one.
+
+        Objects are consumed and dumped by chunks of ``chunk_size``, so the whole result never
+        has to be materialized: used with a ``yield_per`` result and ``json_resp``, the response
+        is streamed with constant memory usage.
+
+        .. code-block:: python
+
+           @json_resp
+           def export():
+               schema = ParentSchema(only=["childs"])
+               query = select(Parent).options(*schema.loader_options())
+               return schema.dump_iter(
+                   db.session.scalars(query.execution_options(yield_per=1000))
+               )
+        """
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            yield from self.dump(chunk, many=True)
@@ -2,17 +2,45 @@
 Serialize function for SQLAlchemy models
 """
 
+import json
+from json.encoder import encode_basestring
 from inspect import signature, getattr_static
 from warnings import warn
-from collections import defaultdict, ChainMap
+from collections import defaultdict, ChainMap, OrderedDict, namedtuple
 from itertools import chain
 from functools import lru_cache
+from threading import Lock
 from uuid import UUID
 
-from sqlalchemy.orm import ColumnProperty
-from sqlalchemy import inspect
+from flask import current_app, has_app_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import (
+    ColumnProperty,
+    configure_mappers,
+    query_expression,
+    with_expression,
+    defaultload,
+    aliased,
+)
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy import (
+    event,
+    inspect,
+    Column,
+    select,
+    func,
+    tuple_,
+    and_,
+    case,
+    cast,
+    extract,
+    literal,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.hybrid import hybrid_property, HYBRID_PROPERTY
-from sqlalchemy.types import DateTime, Date, Time
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.util import ClauseAdapter
+from sqlalchemy.types import DateTime, Date, Time, Text, Numeric
 from sqlalchemy.dialects.postgresql.base import UUID
 
 """
@@ -28,6 +56,12 @@ SERIALIZERS = {
     "numeric": lambda x: str(x) if x else None,
 }
 
+# maximum number of bound parameters of a statement
+BULK_MAX_PARAMETERS = {
+    "sqlite": 999,  # SQLITE_MAX_VARIABLE_NUMBER before SQLite 3.32
+    "postgresql": 65535,
+}
+
 
 def get_serializer(col):
     if isinstance(col, ColumnProperty):
@@ -50,11 +84,291 @@ def get_serializer(col):
         return None
 
 
-def get_serializable_decorator(fields=[], exclude=[], stringify=True):
+"""
+    Nombre maximal de plans de sérialisation (fields / exclude résolus)
+    conservés en cache pour chaque modèle
+"""
+FIELD_PLAN_CACHE_SIZE = 128
+
+FieldPlanCacheInfo = namedtuple(
+    "FieldPlanCacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"]
+)
+
+
+class FieldPlanCache:
+    """
+    Cache LRU borné des plans de sérialisation d'un modèle
+
+    Les clés de ce cache proviennent des paramètres fields et exclude fournis
+    par l'appelant (souvent issus de la query string) : sa taille doit donc être bornée.
+    Si maxsize est None, le cache n'est pas borné.
+    """
+
+    def __init__(self, maxsize=FIELD_PLAN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._plans:
+                self.hits += 1
+                self._plans.move_to_end(key)
+                return self._plans[key]
+            self.misses += 1
+        plan = compute()
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            if self.maxsize is not None and len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+        return plan
+
+    def info(self):
+        return FieldPlanCacheInfo(
+            self.hits, self.misses, self.evictions, self.maxsize, len(self._plans)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+"""
+    Plan de sérialisation d'un modèle pour un couple (fields, exclude) :
+    - columns : colonnes et propriétés, associées à leur sérializer
+    - relationships : relationships à sérialiser
+    - nested : fields et exclude à transmettre à chaque relationship
+    - windows : limite et tri des collections, e.g. 'childs[5:-date]'
+    - counts : champs de comptage des collections, e.g. '+childs_count'
+"""
+FieldPlan = namedtuple(
+    "FieldPlan", ["fields", "exclude", "columns", "relationships", "nested", "windows", "counts"]
+)
+
+
+def freeze_fields(fields, exclude):
+    """
+    Convertit fields et exclude en frozensets (None étant conservé), utilisés comme clés
+    des caches de plans de sérialisation
+    """
+    return (
+        frozenset(fields) if fields is not None else None,
+        frozenset(exclude) if exclude is not None else None,
+    )
+
+
+def split_field_window(field):
+    """
+    Sépare la limite et le tri d'une collection du nom du champ :
+    'childs[5:-date:pk].pk' -> ('childs.pk', 'childs', (5, (('date', True), ('pk', False))))
+    Le tri est optionnel, le préfixe '-' indique un tri décroissant.
+    """
+    first, dot, rest = field.partition(".")
+    if "[" not in first:
+        return field, first, None
+    key, _, spec = first.partition("[")
+    if not spec.endswith("]"):
+        raise Exception(f"Invalid field '{field}'.")
+    limit, *order = spec[:-1].split(":")
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise Exception(f"Invalid limit in field '{field}'.")
+    if limit < 1:
+        raise Exception(f"Invalid limit in field '{field}'.")
+    order = tuple((name.lstrip("-"), name.startswith("-")) for name in order if name)
+    return key + dot + rest, key, (limit, order)
+
+
+@lru_cache(maxsize=8)
+def get_json_value_encoder(default):
+    """
+    Encodeur JSON des valeurs non natives utilisant la fonction default donnée ;
+    l'ordre des clés des dictionnaires est conservé, comme pour les objets @serializable
+    """
+    return json.JSONEncoder(default=default, ensure_ascii=False, separators=(",", ":")).encode
+
+
+def encode_json_value(value):
+    """
+    Encode une valeur en JSON (str), en utilisant pour les types non natifs (dates, Decimal, …)
+    la fonction default du fournisseur JSON de Flask, ou à défaut celle de DefaultJSONProvider
+    """
+    if value is None:
+        return "null"
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring(value)
+    elif value_type is bool:
+        return "true" if value else "false"
+    elif value_type is int:
+        return int.__repr__(value)
+    default = DefaultJSONProvider.default
+    if has_app_context():
+        default = getattr(current_app.json, "default", default)
+    return get_json_value_encoder(default)(value)
+
+
+def encode_serializable(obj, parts, fields=None, exclude=None, stringify=None):
+    """
+    Ajoute à la liste parts le JSON d'un objet @serializable
+    """
+    obj_cls = type(obj)
+    if hasattr(obj_cls.as_dict, "__original_decorator") and hasattr(obj_cls, "as_json_encoder"):
+        obj_cls.as_json_encoder(fields, exclude, stringify)(obj, parts)
+    else:  # as_dict is overridden, we can only use its result
+        parts.append(
+            encode_json_value(obj.as_dict(fields=fields, exclude=exclude, stringify=stringify))
+        )
+
+
+def as_json_array(objs, fields=None, exclude=None, stringify=None):
+    """
+    Sérialise une liste d'objets @serializable en un tableau JSON (bytes)
+    équivalent à [o.as_dict(fields=fields, exclude=exclude) for o in objs],
+    sans construire de dictionnaires intermédiaires
+    """
+    parts = ["["]
+    for i, obj in enumerate(objs):
+        if i:
+            parts.append(",")
+        encode_serializable(obj, parts, fields, exclude, stringify)
+    parts.append("]")
+    return "".join(parts).encode("utf-8")
+
+
+def sql_json_array(query):
+    """
+    Expression PostgreSQL renvoyant le tableau JSON des résultats (à une colonne) de la requête,
+    dans l'ordre de la requête : array_to_json(ARRAY(<query>))
+    """
+    return func.array_to_json(func.array(query.scalar_subquery()))
+
+
+def sql_json_object(items):
+    """
+    Expression PostgreSQL json_build_object à partir d'une liste de couples (clé, expression)
+    Au-delà de 50 couples (limite de 100 arguments des fonctions PostgreSQL),
+    plusieurs objets json sont concaténés sous forme de texte, afin de conserver l'ordre des clés.
+    """
+    arguments = []
+    for key, value in items:
+        arguments += [literal(key), value]
+    if len(arguments) <= 100:
+        return func.json_build_object(*arguments)
+    chunks = [
+        func.json_build_object(*arguments[i : i + 100]) for i in range(0, len(arguments), 100)
+    ]
+    members = []
+    for chunk in chunks:
+        if members:
+            members.append(", ")
+        members.append(func.substr(func.left(cast(chunk, Text), -1), 2))  # strip {}
+    return cast(func.concat("{", *members, "}"), postgresql.JSON)
+
+
+def sql_str(value, sql_type):
+    """
+    Expression PostgreSQL équivalente à str() sur la valeur Python d'une colonne,
+    afin que as_json_expression produise le même JSON que as_dict :
+    dates ISO indépendantes du DateStyle, microsecondes uniquement si elles sont non nulles,
+    fuseau horaire au format +HH:MM
+    """
+    if isinstance(sql_type, Date):
+        return func.to_char(value, "YYYY-MM-DD")
+    elif isinstance(sql_type, (DateTime, Time)):
+        if isinstance(sql_type, DateTime):
+            time = value
+            text = func.to_char(value, "YYYY-MM-DD HH24:MI:SS")
+        else:
+            time = cast(value, Time)
+            text = func.to_char(time, "HH24:MI:SS")
+        text = text.op("||")(
+            case((func.to_char(time, "US") == "000000", ""), else_=func.to_char(time, ".US"))
+        )
+        if sql_type.timezone and isinstance(sql_type, DateTime):
+            text = text.op("||")(func.to_char(value, "TZH:TZM"))
+        elif sql_type.timezone:
+            text = (
+                text.op("||")(func.to_char(extract("timezone_hour", value), "FMS00"))
+                .op("||")(":")
+                .op("||")(func.to_char(func.abs(extract("timezone_minute", value)), "FM00"))
+            )
+        return text
+    else:
+        return cast(value, Text)
+
+
+def adapt_relationship_join(rel, clause, local_selectable, remote_selectable):
+    """
+    Adapte une condition de jointure de la relationship (primaryjoin ou secondaryjoin) : les
+    colonnes de rel.remote_side sont remplacées par celles de remote_selectable, les autres
+    par celles de local_selectable, critères supplémentaires compris
+    """
+
+    def replace(element):
+        if isinstance(element, Column):
+            if element in rel.remote_side:
+                return remote_selectable.corresponding_column(element)
+            return local_selectable.corresponding_column(element)
+
+    return visitors.replacement_traverse(clause, {}, replace)
+
+
+def get_relationship_clauses(rel, entity, related_entity):
+    """
+    Renvoie la clause FROM de la relationship (jointe à la table secondaire le cas échéant)
+    et la condition de corrélation avec l'entité parente
+    """
+    parent_selectable = inspect(entity).selectable
+    related_selectable = inspect(related_entity).selectable
+    if rel.secondary is None:
+        condition = adapt_relationship_join(
+            rel, rel.primaryjoin, parent_selectable, related_selectable
+        )
+        return related_selectable, condition
+    secondary = rel.secondary.alias()
+    condition = adapt_relationship_join(rel, rel.primaryjoin, parent_selectable, secondary)
+    join_condition = adapt_relationship_join(rel, rel.secondaryjoin, related_selectable, secondary)
+    return related_selectable.join(secondary, join_condition), condition
+
+
+def get_window_order_by(related_entity, order):
+    """
+    Tri d'une collection limitée : les colonnes demandées puis la clé primaire, afin que le
+    tri soit total, les valeurs nulles étant placées en dernier (en premier pour un tri
+    décroissant) comme dans le tri python des collections non préchargées
+    """
+    related_mapper = inspect(related_entity).mapper
+    order_by = [
+        (
+            getattr(related_entity, name).desc().nulls_first()
+            if desc
+            else getattr(related_entity, name).asc().nulls_last()
+        )
+        for name, desc in order
+    ]
+    names = {name for name, _ in order}
+    for col in related_mapper.primary_key:
+        key = related_mapper.get_property_by_column(col).key
+        if key not in names:
+            order_by.append(getattr(related_entity, key).asc())
+    return order_by
+
+
+def get_serializable_decorator(
+    fields=[], exclude=[], stringify=True, cache_size=FIELD_PLAN_CACHE_SIZE, hybrid_expressions=()
+):
     default_fields = fields
     default_exclude = exclude
     default_stringify = stringify
-    firstlevel_default_fields = {field.split(".")[0] for field in default_fields}
+    firstlevel_default_fields = {split_field_window(field)[1] for field in default_fields}
 
     def _serializable(cls):
         """
@@ -71,7 +385,7 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
             associées à leur sérializer en fonction de leur type
             """
             cls_db_columns = []
-            for prop in cls.__mapper__.column_attrs:
+            for prop in get_cls_column_attrs().values():
                 if isinstance(prop, ColumnProperty):  # and len(prop.columns) == 1:
                     # -1 : si on est dans le cas d'un heritage on recupere le dernier element de prop
                     # qui correspond à la derniere redefinition de cette colonne
@@ -106,6 +420,19 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                 )
             return cls_db_columns
 
+        @lru_cache(maxsize=None)
+        def get_cls_db_table_columns():
+            """
+            Colonnes de la table du modèle, indexées par nom d'attribut,
+            utilisées pour l'insertion en masse (les column_property calculées sont ignorées)
+            """
+            return {
+                prop.key: prop.columns[0]
+                for prop in get_cls_column_attrs().values()
+                if isinstance(prop.columns[0], Column)
+                and prop.columns[0].table is mapper.local_table
+            }
+
         def get_cls_db_relationships():
             """
             Liste des propriétés de type relationship
@@ -119,15 +446,100 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
             ]
 
         @lru_cache(maxsize=None)
+        def get_cls_properties():
+            """
+            Propriétés python (@property) et hybrid properties de la classe
+            """
+            properties = {
+                key: None for key in dir(cls) if isinstance(getattr_static(cls, key), property)
+            }
+            hybrid_properties = {
+                key: attr
+                for key, attr in mapper.all_orm_descriptors.items()
+                if attr.extension_type == HYBRID_PROPERTY
+            }
+            return properties, hybrid_properties
+
+        sql_hybrid_expressions = {}
+
+        def add_hybrid_expressions(mapper, cls):
+            """
+            Ajoute au mapper, lors de sa configuration, un attribut query_expression pour
+            chaque hybrid property déclarée dans hybrid_expressions, afin de recevoir la valeur
+            calculée en base lorsque la requête utilise les options renvoyées par
+            as_dict_loader_options().
+            """
+            _, hybrid_properties = get_cls_properties()
+            for key in hybrid_expressions:
+                if key not in hybrid_properties:
+                    raise Exception(f"'{key}' is not an hybrid property of {cls}.")
+                expression = getattr(cls, key).__clause_element__()
+                attr_name = f"_sql_{key}"
+                mapper.add_property(attr_name, query_expression())
+                sql_hybrid_expressions[key] = (attr_name, expression)
+
+        if hybrid_expressions and mapper.configured:
+            add_hybrid_expressions(mapper, cls)
+        elif hybrid_expressions:
+            event.listen(mapper, "mapper_configured", add_hybrid_expressions, once=True)
+
+        def get_cls_hybrid_expressions():
+            """
+            Hybrid properties de la classe déclarées dans hybrid_expressions, associées au nom
+            de l'attribut query_expression recevant leur valeur et à leur expression SQL
+            """
+            if hybrid_expressions:
+                configure_mappers()
+            return sql_hybrid_expressions
+
+        def get_cls_column_attrs():
+            """
+            Propriétés colonnes du mapper, sans les attributs query_expression des hybrid
+            properties
+            """
+            query_expressions = {
+                attr_name for attr_name, _ in get_cls_hybrid_expressions().values()
+            }
+            return {
+                key: prop
+                for key, prop in mapper.column_attrs.items()
+                if key not in query_expressions
+            }
+
+        field_plan_cache = FieldPlanCache(maxsize=cache_size)
+
         def get_columns_and_relationships(fields=None, exclude=None):
+            return field_plan_cache.get(
+                (fields, exclude), lambda: compute_columns_and_relationships(fields, exclude)
+            )
+
+        def compute_columns_and_relationships(fields, exclude):
+            properties, hybrid_properties = get_cls_properties()
             deferred_columns = {
-                key for key, props in mapper.column_attrs.items() if props.deferred
+                key for key, props in get_cls_column_attrs().items() if props.deferred
             }
             _default_exclude = set(default_exclude) | deferred_columns
             additional_fields = set()
+            counts = {}
+            windows = {}
+
+            def strip_windows(fields):
+                stripped_fields = []
+                given_windows = {}
+                for field in fields:
+                    field, key, window = split_field_window(field)
+                    if window is not None:
+                        if given_windows.setdefault(key, window) != window:
+                            raise Exception(f"Several windows given for relationship '{key}'.")
+                        windows[key] = window
+                    stripped_fields.append(field)
+                return stripped_fields
+
+            _default_fields = strip_windows(default_fields)
             if fields is None:
-                fields = default_fields
+                fields = _default_fields
             elif fields:
+                fields = strip_windows(fields)
                 base_fields = set()
                 relationship_fields = set()
                 for field in fields:
@@ -135,7 +547,18 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                         relationship_fields.add(field)
                     elif field.startswith("+"):
                         field = field.lstrip("+")
-                        additional_fields.add(field)
+                        rel = mapper.relationships.get(field[: -len("_count")])
+                        if (
+                            field.endswith("_count")
+                            and rel is not None
+                            and rel.uselist
+                            and field not in mapper.attrs
+                            and field not in properties
+                            and field not in hybrid_properties
+                        ):
+                            counts[field] = rel.key
+                        else:
+                            additional_fields.add(field)
                     else:
                         base_fields.add(field)
                     # We remove given fields from default_exclude!
@@ -145,24 +568,16 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                 else:  # given fields are only relationships or additional fields, but no columns
                     # if we have some columns in default fields, we add additional fields to these columns
                     if firstlevel_default_fields - set(mapper.relationships.keys()):
-                        fields = set(default_fields) | additional_fields | relationship_fields
+                        fields = set(_default_fields) | additional_fields | relationship_fields
                     # else, we do not add additional fields as we want ALL columns (default behaviour), not only additional columns
                     else:
-                        fields = set(default_fields) | relationship_fields
+                        fields = set(_default_fields) | relationship_fields
             if exclude is None:
                 exclude = _default_exclude
 
             # take 'a' instead of 'a.b'
             firstlevel_fields = [rel.split(".")[0] for rel in fields]
 
-            properties = {
-                key: None for key in dir(cls) if isinstance(getattr_static(cls, key), property)
-            }
-            hybrid_properties = {
-                key: attr
-                for key, attr in mapper.all_orm_descriptors.items()
-                if attr.extension_type == HYBRID_PROPERTY
-            }
             for field in (
                 (set([f for f in fields if "." not in f]) | additional_fields)
                 - set(mapper.attrs.keys())
@@ -178,7 +593,7 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
             _columns = {
                 key: col
                 for key, col in ChainMap(
-                    dict(mapper.column_attrs), properties, hybrid_properties
+                    get_cls_column_attrs(), properties, hybrid_properties
                 ).items()
                 if key in fields
             }
@@ -186,16 +601,221 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                 key: rel for key, rel in mapper.relationships.items() if key in firstlevel_fields
             }
             if not _columns:
-                _columns = ChainMap(dict(mapper.column_attrs), properties, hybrid_properties)
+                _columns = ChainMap(get_cls_column_attrs(), properties, hybrid_properties)
             if exclude:
                 _columns = {key: col for key, col in _columns.items() if key not in exclude}
                 _relationships = {
                     key: rel for key, rel in _relationships.items() if key not in exclude
                 }
+                counts = {field: key for field, key in counts.items() if field not in exclude}
 
-            _columns = {key: (col, get_serializer(col)) for key, col in _columns.items()}
+            _windows = {}
+            for key, rel in _relationships.items():
+                if key not in windows:
+                    continue
+                if not rel.uselist:
+                    raise Exception(f"Relationship '{key}' on {cls} is not a collection.")
+                limit, order = windows[key]
+                for name, _ in order:
+                    if name not in rel.mapper.columns:
+                        raise Exception(f"Field '{name}' does not exist on {rel.mapper.class_}.")
+                _windows[key] = windows[key]
+
+            if any(key in hybrid_properties for key in _columns):
+                sql_expressions = get_cls_hybrid_expressions()
+            else:
+                sql_expressions = {}
 
-            return fields, exclude, _columns, _relationships
+            _columns = {
+                key: (
+                    col,
+                    get_serializer(col),
+                    sql_expressions[key][0] if key in sql_expressions else None,
+                )
+                for key, col in _columns.items()
+            }
+
+            # fields and exclude to give to each relationship serialization
+            _nested = {}
+            for key in _relationships:
+                _fields = frozenset(
+                    field.split(".", 1)[1] for field in fields if field.startswith(f"{key}.")
+                )
+                _exclude = frozenset(
+                    field.split(".", 1)[1] for field in exclude if field.startswith(f"{key}.")
+                )
+                _nested[key] = (_fields or None, _exclude or None)
+
+            return FieldPlan(fields, exclude, _columns, _relationships, _nested, _windows, counts)
+
+        def get_window(self, key, window):
+            """
+            Renvoie les objets de la collection limitée et triée selon window,
+            préchargés par as_dict_preload() ou à défaut extraits de la relationship
+            """
+            preloaded_windows = vars(self).get("_as_dict_windows", {})
+            if (key, window) in preloaded_windows:
+                return preloaded_windows[(key, window)]
+            limit, order = window
+            related_mapper = mapper.relationships[key].mapper
+            names = {name for name, _ in order}
+            order = list(order) + [
+                (related_mapper.get_property_by_column(col).key, False)
+                for col in related_mapper.primary_key
+                if related_mapper.get_property_by_column(col).key not in names
+            ]
+            objs = list(getattr(self, key))
+            # même tri que get_window_order_by() : nulls en dernier, clé primaire départageant
+            for name, desc in reversed(order):
+                objs.sort(key=lambda o: (getattr(o, name) is None, getattr(o, name)), reverse=desc)
+            return objs[:limit]
+
+        def get_count(obj, key):
+            """
+            Nombre d'objets de la collection, préchargé par as_dict_preload() le cas échéant
+            """
+            preloaded_counts = vars(obj).get("_as_dict_counts", {})
+            if key in preloaded_counts:
+                return preloaded_counts[key]
+            return len(getattr(obj, key))
+
+        def get_collection(obj, key, window):
+            """
+            Objets de la collection à sérialiser, limitée et triée selon window le cas échéant
+            """
+            if window is not None:
+                return get_window(obj, key, window)
+            return getattr(obj, key)
+
+        def get_parent_keys(objs):
+            """
+            Objets indexés par leur clé primaire (les objets non persistés sont ignorés)
+            """
+            parent_keys = {}
+            for obj in objs:
+                identity = inspect(obj).identity
+                if identity is not None:
+                    parent_keys[identity] = obj
+            return parent_keys
+
+        def get_related_clauses(rel, parent_keys):
+            """
+            Clause FROM et condition de filtre des objets liés aux objets de clés primaires
+            données, selon la condition de jointure complète de la relationship, et colonnes
+            de clé primaire de l'objet parent auquel chaque objet lié est associé
+            """
+            parent = aliased(cls)
+            from_clause, condition = get_relationship_clauses(rel, parent, rel.mapper.class_)
+            key_columns = [
+                getattr(parent, mapper.get_property_by_column(col).key)
+                for col in mapper.primary_key
+            ]
+            if len(key_columns) == 1:
+                keys_clause = key_columns[0].in_([parent_key[0] for parent_key in parent_keys])
+            else:
+                keys_clause = tuple_(*key_columns).in_(parent_keys)
+            return from_clause, and_(condition, keys_clause), key_columns
+
+        def query_window(session, rel, parent_keys, window, count):
+            """
+            Charge les collections limitées de l'ensemble des objets en une requête fenêtrée :
+            row_number() OVER (PARTITION BY <clé du parent> ORDER BY ...)
+            Renvoie les objets liés et le nombre total d'objets liés par clé du parent.
+            """
+            related_cls = rel.mapper.class_
+            limit, order = window
+            from_clause, whereclause, partition_by = get_related_clauses(rel, parent_keys)
+            columns = [col.label(f"_key_{i}") for i, col in enumerate(partition_by)]
+            columns.append(
+                func.row_number()
+                .over(partition_by=partition_by, order_by=get_window_order_by(related_cls, order))
+                .label("_row_number")
+            )
+            if count:
+                columns.append(func.count().over(partition_by=partition_by).label("_count"))
+            subquery = (
+                select(related_cls, *columns)
+                .select_from(from_clause)
+                .where(whereclause)
+                .subquery()
+            )
+            key_columns = [subquery.c[f"_key_{i}"] for i in range(len(partition_by))]
+            query = (
+                select(aliased(related_cls, subquery), *key_columns)
+                .where(subquery.c._row_number <= limit)
+                .order_by(*key_columns, subquery.c._row_number)
+            )
+            if count:
+                query = query.add_columns(subquery.c._count)
+            children = defaultdict(list)
+            counts = {}
+            for row in session.execute(query):
+                parent_key = tuple(row[1 : len(partition_by) + 1])
+                children[parent_key].append(row[0])
+                if count:
+                    counts[parent_key] = row[-1]
+            return children, counts
+
+        def query_counts(session, rel, parent_keys):
+            """
+            Compte les objets liés de l'ensemble des objets en une requête groupée
+            """
+            from_clause, whereclause, key_columns = get_related_clauses(rel, parent_keys)
+            query = (
+                select(*key_columns, func.count())
+                .select_from(from_clause)
+                .where(whereclause)
+                .group_by(*key_columns)
+            )
+            return {tuple(row[:-1]): row[-1] for row in session.execute(query)}
+
+        def preloadfn(cls, objs, fields=None, exclude=None, session=None):
+            """
+            Méthode qui précharge, pour l'ensemble des objets donnés et en une requête par
+            relationship, les collections limitées (e.g. 'childs[5:-date]') et les comptages
+            (e.g. '+childs_count') demandés dans fields, avant leur sérialisation par as_dict
+
+            >>> parents = db.session.scalars(select(Parent)).all()
+            >>> fields = ["childs[5:-date]", "+childs_count"]
+            >>> Parent.as_dict_preload(parents, fields=fields)
+            >>> [p.as_dict(fields=fields) for p in parents]
+
+            Les collections limitées des objets liés sont également préchargées.
+            """
+            objs = list(objs)
+            fields, exclude = freeze_fields(fields, exclude)
+            plan = get_columns_and_relationships(fields, exclude)
+            if not objs or not (plan.windows or plan.counts):
+                return objs
+            if session is None:
+                session = cls.query.session
+            counted = set(plan.counts.values())
+            parent_keys = get_parent_keys(objs)
+            if not parent_keys:
+                return objs
+            for key, window in plan.windows.items():
+                rel = plan.relationships[key]
+                children, counts = query_window(
+                    session, rel, list(parent_keys), window, count=key in counted
+                )
+                for parent_key, obj in parent_keys.items():
+                    preloaded_windows = vars(obj).setdefault("_as_dict_windows", {})
+                    preloaded_windows[(key, window)] = children[parent_key]
+                    if key in counted:
+                        preloaded_counts = vars(obj).setdefault("_as_dict_counts", {})
+                        preloaded_counts[key] = counts.get(parent_key, 0)
+                related_cls = rel.mapper.class_
+                if hasattr(related_cls, "as_dict_preload"):
+                    related_cls.as_dict_preload(
+                        chain.from_iterable(children.values()), *plan.nested[key], session=session
+                    )
+            for key in counted - set(plan.windows):
+                rel = mapper.relationships[key]
+                counts = query_counts(session, rel, list(parent_keys))
+                for parent_key, obj in parent_keys.items():
+                    preloaded_counts = vars(obj).setdefault("_as_dict_counts", {})
+                    preloaded_counts[key] = counts.get(parent_key, 0)
+            return objs
 
         def serializefn(
             self,
@@ -224,12 +844,20 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                     Il est également possible de spécifier les champs d’une relationship
                     à prendre en compte, sans limite de profondeur, avec un '.' :
                         fields=['child.column1', 'child.otherchild.column2']
+                    Une collection peut être limitée et triée avec la notation
+                    'relationship[limite:tri]', le préfixe '-' indiquant un tri décroissant,
+                    et son nombre d'éléments ajouté avec '+relationship_count', e.g. :
+                        fields=['childs[5:-date:pk].column1', '+childs_count']
+                    Voir as_dict_preload() pour charger ces collections en une requête.
                 exclude: list
                     Liste de champs à exclure.
                     Les exclusions s’appliquent après la sélection des champs avec fields.
                     Il est également possible d’utiliser la notation avec un '.', e.g. :
                         fields=['child'],exclude=['child.column2']
 
+                Les fields et exclude transmis au as_dict des objets liés sont des frozensets
+                (ou None) : un as_dict surchargé ne doit pas les modifier en place.
+
                 Les arguments ci-après sont dépréciés en faveur de fields et exclude.
 
                 recursif: boolean
@@ -293,14 +921,9 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                     if depth:
                         depth -= 1
 
-            if fields is not None:
-                fields = frozenset(fields)
-            if exclude is not None:
-                exclude = frozenset(exclude)
+            fields, exclude = freeze_fields(fields, exclude)
 
-            fields, exclude, _columns, _relationships = get_columns_and_relationships(
-                fields, exclude
-            )
+            plan = get_columns_and_relationships(fields, exclude)
 
             serialize_kwargs = {
                 "recursif": recursif,
@@ -310,13 +933,20 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
             }
 
             data = {}
-            for key, props in _columns.items():
-                col, serializer = props
-                data[key] = getattr(self, key)
+            for key, props in plan.columns.items():
+                col, serializer, sql_attr_name = props
+                if sql_attr_name is not None and sql_attr_name in vars(self):
+                    # hybrid property already computed by the database
+                    data[key] = vars(self)[sql_attr_name]
+                else:
+                    data[key] = getattr(self, key)
                 if stringify and serializer is not None and data[key] is not None:
                     data[key] = serializer(data[key])
-            for key, rel in _relationships.items():
-                if unloaded is not None:
+            for field, key in plan.counts.items():
+                data[field] = get_count(self, key)
+            for key, rel in plan.relationships.items():
+                window = plan.windows.get(key)
+                if window is None and unloaded is not None:
                     m = inspect(self)
                     if key in m.unloaded:
                         err = f"Relationship '{key}' on '{self}' is not loaded"
@@ -325,16 +955,9 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
                         elif unloaded == "warn":
                             warn(err)
                 kwargs = serialize_kwargs.copy()
-                _fields = [
-                    field.split(".", 1)[1] for field in fields if field.startswith(f"{key}.")
-                ]
-                kwargs["fields"] = _fields or None
-                _exclude = [
-                    field.split(".", 1)[1] for field in exclude if field.startswith(f"{key}.")
-                ]
-                kwargs["exclude"] = _exclude or None
+                kwargs["fields"], kwargs["exclude"] = plan.nested[key]
                 if rel.uselist:
-                    data[key] = [o.as_dict(**kwargs) for o in getattr(self, key)]
+                    data[key] = [o.as_dict(**kwargs) for o in get_collection(self, key, window)]
                 else:
                     rel_object = getattr(self, rel.key)
                     if rel_object:
@@ -345,6 +968,248 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
 
         serializefn.__original_decorator = True
 
+        json_encoder_cache = FieldPlanCache(maxsize=cache_size)
+
+        def get_json_encoder(fields=None, exclude=None, stringify=None):
+            fields, exclude = freeze_fields(fields, exclude)
+            if stringify is None:
+                stringify = default_stringify
+            return json_encoder_cache.get(
+                (fields, exclude, stringify),
+                lambda: compile_json_encoder(fields, exclude, stringify),
+            )
+
+        def compile_json_encoder(fields, exclude, stringify):
+            """
+            Compile le plan de sérialisation en une fonction encode(obj, parts) qui ajoute
+            à la liste parts le JSON de l'objet, tel que produit par as_dict
+            """
+            plan = get_columns_and_relationships(fields, exclude)
+            columns = [
+                (
+                    encode_basestring(key) + ":",
+                    key,
+                    serializer if stringify else None,
+                    sql_attr_name,
+                )
+                for key, (col, serializer, sql_attr_name) in plan.columns.items()
+            ]
+            counts = [(encode_basestring(field) + ":", key) for field, key in plan.counts.items()]
+            relationships = [
+                (
+                    encode_basestring(key) + ":",
+                    key,
+                    rel.uselist,
+                    plan.windows.get(key),
+                    plan.nested[key],
+                )
+                for key, rel in plan.relationships.items()
+            ]
+
+            def encode(obj, parts):
+                separator = "{"
+                obj_dict = vars(obj)
+                for prefix, key, serializer, sql_attr_name in columns:
+                    if sql_attr_name is not None and sql_attr_name in obj_dict:
+                        value = obj_dict[sql_attr_name]
+                    else:
+                        value = getattr(obj, key)
+                    if serializer is not None and value is not None:
+                        value = serializer(value)
+                    parts.append(separator)
+                    parts.append(prefix)
+                    parts.append(encode_json_value(value))
+                    separator = ","
+                for prefix, key in counts:
+                    parts.append(separator)
+                    parts.append(prefix)
+                    parts.append(int.__repr__(get_count(obj, key)))
+                    separator = ","
+                for prefix, key, uselist, window, nested in relationships:
+                    parts.append(separator)
+                    parts.append(prefix)
+                    separator = ","
+                    if uselist:
+                        parts.append("[")
+                        for i, related_obj in enumerate(get_collection(obj, key, window)):
+                            if i:
+                                parts.append(",")
+                            encode_serializable(related_obj, parts, *nested)
+                        parts.append("]")
+                    else:
+                        related_obj = getattr(obj, key)
+                        if related_obj:
+                            encode_serializable(related_obj, parts, *nested)
+                        else:  # relationship may be null
+                            parts.append("null")
+                parts.append("}" if separator == "," else "{}")
+
+            return encode
+
+        def jsonexpressionfn(cls, fields=None, exclude=None, stringify=None, entity=None):
+            """
+            Méthode qui compile le plan de sérialisation en une expression SQL PostgreSQL
+            (json_build_object) produisant le JSON de as_dict(fields=fields, exclude=exclude)
+
+            Les relationships sont compilées en sous-requêtes corrélées
+            (json_agg ordonné et limité pour les collections), les champs ajoutés avec
+            '+relationship_count' en sous-requêtes de comptage.
+            Les colonnes de type Geometry sont ignorées, les colonnes stringifiées par as_dict
+            ainsi que les Numeric sont converties en texte au format de Python.
+            Les @property et hybrid properties sans expression SQL (cf. hybrid_expressions) ne
+            peuvent être compilées : une exception est levée, elles doivent être explicitement
+            exclues (exclude) ou absentes de fields.
+
+            Parameters
+            ----------
+                entity: alias de la classe sur lequel porte l'expression (par défaut la classe)
+            """
+            if not hasattr(cls.as_dict, "__original_decorator"):
+                raise Exception(f"as_dict of {cls} is overridden and can not be compiled to SQL.")
+            fields, exclude = freeze_fields(fields, exclude)
+            if stringify is None:
+                stringify = default_stringify
+            if entity is None:
+                entity = cls
+            plan = get_columns_and_relationships(fields, exclude)
+
+            items = []
+            for key, (col, serializer, sql_attr_name) in plan.columns.items():
+                if isinstance(col, ColumnProperty):
+                    sql_type = col.columns[-1].type
+                    if sql_type.__class__.__name__ == "Geometry":
+                        continue
+                elif sql_attr_name is None:
+                    raise Exception(
+                        f"Field '{key}' on {cls} can not be computed in SQL, exclude it explicitly."
+                    )
+                else:
+                    sql_type = None
+                value = getattr(entity, key)
+                if stringify and serializer is not None:
+                    value = sql_str(value, sql_type)
+                elif isinstance(sql_type, Numeric) and sql_type.asdecimal:
+                    value = cast(value, Text)  # Decimal are encoded as strings
+                items.append((key, value))
+            for field, key in plan.counts.items():
+                rel = mapper.relationships[key]
+                related_entity = aliased(rel.mapper.class_)
+                from_clause, condition = get_relationship_clauses(rel, entity, related_entity)
+                items.append(
+                    (
+                        field,
+                        select(func.count())
+                        .select_from(from_clause)
+                        .where(condition)
+                        .scalar_subquery(),
+                    )
+                )
+            for key, rel in plan.relationships.items():
+                related_cls = rel.mapper.class_
+                related_entity = aliased(related_cls)
+                from_clause, condition = get_relationship_clauses(rel, entity, related_entity)
+                related_object = related_cls.as_json_expression(
+                    *plan.nested[key], entity=related_entity
+                )
+                query = select(related_object).select_from(from_clause).where(condition)
+                if rel.uselist:
+                    window = plan.windows.get(key)
+                    if window is not None:
+                        limit, order = window
+                        order_by = get_window_order_by(related_entity, order)
+                        query = query.order_by(*order_by).limit(limit)
+                    elif rel.order_by:
+                        adapter = ClauseAdapter(inspect(related_entity).selectable)
+                        query = query.order_by(*[adapter.traverse(c) for c in rel.order_by])
+                    items.append((key, sql_json_array(query)))
+                else:
+                    items.append((key, query.scalar_subquery()))
+            return sql_json_object(items)
+
+        def jsonselectfn(
+            cls, query=None, fields=None, exclude=None, stringify=None, as_text=False
+        ):
+            """
+            Méthode qui renvoie une requête PostgreSQL produisant directement le document JSON
+            (tableau) des objets de la requête donnée, sérialisés comme avec as_dict,
+            sans hydratation d'objets ORM
+
+            >>> query = select(Model).where(Model.id > 10).order_by(Model.id).limit(100)
+            >>> document = db.session.scalar(Model.as_json_select(query, fields, as_text=True))
+            >>> return to_json_resp(document.encode())
+
+            Parameters
+            ----------
+                query: requête select(Model), éventuellement filtrée, ordonnée et limitée
+                as_text: renvoyer le document sous forme de texte plutôt que de JSON
+            """
+            if query is None:
+                query = select(cls)
+            json_object = cls.as_json_expression(fields, exclude, stringify)
+            document = sql_json_array(query.with_only_columns(json_object))
+            if as_text:
+                document = cast(document, Text)
+            return select(document)
+
+        def jsonfn(self, fields=None, exclude=None, stringify=None):
+            """
+            Méthode qui renvoie directement le JSON (bytes) de l'objet, équivalent à
+            celui de as_dict(fields=fields, exclude=exclude), sans construire de dictionnaire
+            intermédiaire ; le résultat peut être passé à to_json_resp.
+            """
+            parts = []
+            encode_serializable(self, parts, fields, exclude, stringify)
+            return "".join(parts).encode("utf-8")
+
+        def loaderoptionsfn(cls, fields=None, exclude=None):
+            """
+            Méthode qui renvoie les options de chargement permettant de calculer en base,
+            dans la requête SELECT, les hybrid properties sérialisées par as_dict
+            avec les fields et exclude donnés (y compris dans les relationships)
+
+            >>> query = select(Model).options(*Model.as_dict_loader_options(fields=fields))
+            >>> [o.as_dict(fields=fields) for o in db.session.scalars(query)]
+
+            Seules les hybrid properties déclarées avec
+            @serializable(hybrid_expressions=[...]) sont calculées en base, les autres restent
+            évaluées en python.
+            """
+            fields, exclude = freeze_fields(fields, exclude)
+            plan = get_columns_and_relationships(fields, exclude)
+            options = [
+                with_expression(getattr(cls, sql_attr_name), sql_hybrid_expressions[key][1])
+                for key, (_, _, sql_attr_name) in plan.columns.items()
+                if sql_attr_name is not None
+            ]
+            for key, rel in plan.relationships.items():
+                related_cls = rel.mapper.class_
+                if hasattr(related_cls, "as_dict_loader_options"):
+                    related_options = related_cls.as_dict_loader_options(*plan.nested[key])
+                    if related_options:
+                        options.append(defaultload(getattr(cls, key)).options(*related_options))
+            return options
+
+        def prewarmfn(cls, fields=None, exclude=None, _seen=None):
+            """
+            Méthode qui précalcule les plans de sérialisation utilisés par as_dict
+            pour les fields et exclude donnés, ainsi que ceux des relationships concernées
+
+            À appeler au démarrage de l'application pour les jeux de champs connus,
+            afin que les premières requêtes ne paient pas leur résolution.
+            """
+            fields, exclude = freeze_fields(fields, exclude)
+            if _seen is None:
+                _seen = set()
+            if (mapper, fields, exclude) in _seen:
+                return
+            _seen.add((mapper, fields, exclude))
+            plan = get_columns_and_relationships(fields, exclude)
+            for key, rel in plan.relationships.items():
+                related_cls = rel.mapper.class_
+                if hasattr(related_cls, "prewarm_as_dict"):
+                    _fields, _exclude = plan.nested[key]
+                    related_cls.prewarm_as_dict(_fields, _exclude, _seen=_seen)
+
         def populatefn(self, dict_in, recursif=False):
             """
             Méthode qui initie les valeurs de l'objet à partir d'un dictionnaire
@@ -435,6 +1300,131 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
 
             return self
 
+        def bulk_populatefn(
+            cls, dicts_in, recursif=False, batch_size=1000, returning=True, session=None
+        ):
+            """
+            Méthode qui insère ou met à jour (upsert) en masse des lignes à partir
+            d'un itérable de dictionnaires, sans instancier d'objets ORM
+
+            Les lignes sont écrites par lots avec des requêtes
+            ``INSERT ... ON CONFLICT (pk) DO UPDATE ... RETURNING pk``.
+            Un lot regroupe des lignes consécutives de même jeu de clés : un changement de jeu
+            de clés écrit le lot en cours, les lignes sont ainsi écrites dans l'ordre d'entrée.
+            Si plusieurs lignes d'un lot ont la même clé primaire, seule la dernière est écrite.
+
+            Parameters
+            ----------
+                dicts_in : itérable de dictionnaires contenant les valeurs des colonnes
+                recursif: si on renseigne les relationships many-to-one à partir de leur id
+                    (ou d'un dictionnaire contenant leur id), comme le fait from_dict ;
+                    l'objet lié n'est pas mis à jour
+                batch_size: nombre maximal de lignes par requête, réduit si besoin pour ne pas
+                    dépasser le nombre maximal de paramètres d'une requête du dialecte
+                returning: si on renvoie les clés primaires des lignes écrites
+                session: session SQLAlchemy à utiliser (par défaut celle de ``Model.query``)
+
+            Returns
+            -------
+                list
+                    liste des clés primaires (tuples) des lignes écrites si returning est True,
+                    sinon None
+            """
+            if session is None:
+                session = cls.query.session
+            dialect = session.get_bind(mapper).dialect
+            if dialect.name == "postgresql":
+                insert = postgresql.insert
+            elif dialect.name == "sqlite":
+                insert = sqlite.insert
+            else:
+                raise Exception(f"Bulk upsert is not supported with '{dialect.name}' dialect.")
+            if len(mapper.tables) > 1:
+                raise Exception(f"Bulk upsert is not supported for {cls}.")
+
+            table = mapper.local_table
+            columns = get_cls_db_table_columns()
+            pk_columns = list(table.primary_key.columns)
+            relationships = {
+                rel.key: rel for rel in mapper.relationships if rel.direction is MANYTOONE
+            }
+
+            def to_row(dict_in):
+                row = {}
+                for key, value in dict_in.items():
+                    if key in columns:
+                        row[columns[key].key] = value
+                    elif key in mapper.relationships:
+                        if not recursif:
+                            continue
+                        if key not in relationships:
+                            raise Exception(
+                                f"Relationship '{key}' on {cls} is not a many-to-one relationship."
+                            )
+                        pairs = relationships[key].local_remote_pairs
+                        for local_col, remote_col in pairs:
+                            if value is None:
+                                row[local_col.key] = None
+                            elif isinstance(value, dict):
+                                if remote_col.key not in value:
+                                    raise Exception(
+                                        f"Relationship '{key}' on {cls} expects "
+                                        f"'{remote_col.key}' value."
+                                    )
+                                row[local_col.key] = value[remote_col.key]
+                            elif len(pairs) == 1:
+                                row[local_col.key] = value
+                            else:
+                                raise Exception(
+                                    f"Relationship '{key}' on {cls} has a composite key, "
+                                    "a dict is expected."
+                                )
+                    else:
+                        raise Exception(f"Field '{key}' does not exist on {cls}.")
+                return row
+
+            def write(rows):
+                rows = list(rows)
+                stmt = insert(table).values(rows)
+                update_columns = set(rows[0].keys()) - {col.key for col in pk_columns}
+                if update_columns:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=pk_columns,
+                        set_={key: stmt.excluded[key] for key in update_columns},
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=pk_columns)
+                if returning:
+                    stmt = stmt.returning(*pk_columns)
+                result = session.execute(stmt)
+                if returning:
+                    pks.extend(tuple(row) for row in result)
+
+            pks = []
+            pk_keys = [col.key for col in pk_columns]
+            max_rows = max(1, BULK_MAX_PARAMETERS[dialect.name] // len(table.columns))
+            batch_size = min(batch_size, max_rows)
+            # rows of the batch by primary key, a row replacing the previous one with the same
+            # primary key as a row cannot be updated twice by the same statement
+            batch = {}
+            batch_keys = None
+            for dict_in in dicts_in:
+                row = to_row(dict_in)
+                row_keys = frozenset(row.keys())
+                # a statement writes rows with the same keys: the pending batch is written
+                # when keys change so that rows with the same primary key are written in order
+                if batch and (row_keys != batch_keys or len(batch) >= batch_size):
+                    write(batch.values())
+                    batch = {}
+                batch_keys = row_keys
+                if all(key in row for key in pk_keys):
+                    batch[tuple(row[key] for key in pk_keys)] = row
+                else:
+                    batch[object()] = row  # generated primary key
+            if batch:
+                write(batch.values())
+            return pks if returning else None
+
         if hasattr(cls, "as_dict"):
             # the Model has a as_dict(self, data) method, which expects serialized data as argument
             if len(signature(cls.as_dict).parameters) == 2:
@@ -460,6 +1450,15 @@ def get_serializable_decorator(fields=[], exclude=[], stringify=True):
         else:
             cls.as_dict = serializefn
         cls.from_dict = populatefn
+        cls.bulk_from_dicts = classmethod(bulk_populatefn)
+        cls.prewarm_as_dict = classmethod(prewarmfn)
+        cls.as_dict_loader_options = classmethod(loaderoptionsfn)
+        cls.as_dict_preload = classmethod(preloadfn)
+        cls.as_json = jsonfn
+        cls.as_json_encoder = staticmethod(get_json_encoder)
+        cls.as_json_expression = classmethod(jsonexpressionfn)
+        cls.as_json_select = classmethod(jsonselectfn)
+        cls.as_dict_cache = field_plan_cache
 
         return cls
 
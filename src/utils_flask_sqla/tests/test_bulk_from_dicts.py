@@ -0,0 +1,120 @@
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship
+
+from utils_flask_sqla.serializers import serializable
+from .utils import statements
+
+db = SQLAlchemy()
+
+
+@serializable
+class Parent(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+
+@serializable
+class Child(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    parent_pk = db.Column(db.Integer, db.ForeignKey(Parent.pk))
+    parent = relationship("Parent", backref="childs")
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture(scope="class")
+def parents(app):
+    with db.session.begin_nested():
+        db.session.add_all([Parent(pk=1, name="p1"), Parent(pk=2, name="p2")])
+
+
+@pytest.mark.usefixtures("parents")
+class TestBulkFromDicts:
+    def test_insert_and_update(self, app):
+        Child.bulk_from_dicts(
+            [{"pk": i, "name": f"c{i}", "parent_pk": 1} for i in range(1, 6)],
+            batch_size=2,
+            returning=False,
+        )
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Child)) == 5
+
+        Child.bulk_from_dicts(
+            [{"pk": 1, "name": "updated"}, {"pk": 6, "name": "c6"}], returning=False
+        )
+        db.session.expire_all()
+        assert db.session.get(Child, 1).name == "updated"
+        assert db.session.get(Child, 1).parent_pk == 1
+        assert db.session.get(Child, 6).name == "c6"
+
+    def test_relationships(self, app):
+        Child.bulk_from_dicts(
+            [
+                {"pk": 10, "parent": 2},
+                {"pk": 11, "parent": {"pk": 1}},
+                {"pk": 12, "parent": None},
+            ],
+            recursif=True,
+            returning=False,
+        )
+        db.session.expire_all()
+        assert db.session.get(Child, 10).parent_pk == 2
+        assert db.session.get(Child, 11).parent_pk == 1
+        assert db.session.get(Child, 12).parent_pk is None
+
+        # relationships are ignored when not recursif, like from_dict
+        Child.bulk_from_dicts([{"pk": 10, "parent": 1}], returning=False)
+        db.session.expire_all()
+        assert db.session.get(Child, 10).parent_pk == 2
+
+        with pytest.raises(Exception, match=".*not a many-to-one relationship.*"):
+            Parent.bulk_from_dicts([{"pk": 3, "childs": [10]}], recursif=True)
+
+        with pytest.raises(Exception, match=".*expects 'pk' value.*"):
+            Child.bulk_from_dicts([{"pk": 13, "parent": {"name": "p3"}}], recursif=True)
+
+    def test_duplicated_primary_keys(self, app):
+        Child.bulk_from_dicts(
+            [{"pk": 30, "name": "first"}, {"pk": 31, "name": "c31"}, {"pk": 30, "name": "last"}],
+            returning=False,
+        )
+        db.session.expire_all()
+        assert db.session.get(Child, 30).name == "last"
+
+    def test_rows_written_in_order(self, app):
+        Child.bulk_from_dicts(
+            [
+                {"pk": 40, "name": "first", "parent_pk": 1},
+                {"pk": 40, "name": "second"},
+                {"pk": 41, "name": "c41", "parent_pk": 2},
+                {"pk": 40, "name": "last", "parent_pk": 2},
+            ],
+            returning=False,
+        )
+        db.session.expire_all()
+        assert db.session.get(Child, 40).name == "last"
+        assert db.session.get(Child, 40).parent_pk == 2
+
+    def test_batch_size(self, app, statements):
+        Child.bulk_from_dicts(
+            [{"pk": i, "name": f"c{i}", "parent_pk": 1} for i in range(100, 1100)],
+            returning=False,
+        )
+        # batches are limited to 999 parameters on SQLite, i.e. 333 rows of 3 columns
+        assert len(statements) == 4
+        assert db.session.scalar(sa.select(sa.func.count()).where(Child.pk >= 100)) == 1000
+
+    def test_unexisting_field(self, app):
+        with pytest.raises(Exception, match=".*Field 'unexisting' does not exist.*"):
+            Child.bulk_from_dicts([{"pk": 20, "unexisting": 1}])
@@ -0,0 +1,468 @@
+import io
+import json
+import os
+import random
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+import pytest
+from alembic.script import Script, ScriptDirectory
+from flask import Flask
+from flask_migrate import Migrate
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+
+from utils_flask_sqla.commands import (
+    db_cli,
+    get_revisions_key,
+    iter_sql_statements,
+    load_revisions,
+    RevisionGraph,
+)
+
+db = SQLAlchemy()
+migrate = Migrate()
+
+ENV_PY = """
+from alembic import context
+from flask import current_app
+
+db = current_app.extensions["migrate"].db
+with db.engine.connect() as connection:
+    context.configure(
+        connection=connection, **current_app.extensions["migrate"].configure_args
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+"""
+
+REVISION_PY = """\"\"\"{doc}\"\"\"
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+branch_labels = {branch_labels!r}
+depends_on = {depends_on!r}
+
+
+def upgrade():
+    from alembic import op
+
+    op.execute("INSERT INTO upgrades VALUES ('{revision}')")
+
+
+def downgrade():
+    pass
+"""
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    app.config["MIGRATIONS_CACHE"] = False
+    db.init_app(app)
+    migrate.init_app(app, db)
+    with app.app_context():
+        yield app
+
+
+def write_revision(
+    versions, revision, down_revision=None, branch_labels=None, depends_on=None, doc=""
+):
+    (versions / f"{revision}.py").write_text(
+        REVISION_PY.format(
+            revision=revision,
+            down_revision=down_revision,
+            branch_labels=branch_labels,
+            depends_on=depends_on,
+            doc=doc or revision.upper(),
+        )
+    )
+
+
+@pytest.fixture
+def migrations(app, tmp_path):
+    """
+    Branch a: a1 - a2 - a3 - a5 (merge of a3 and a4)
+                     \\ a4 /
+    Branch b: b1 - b2 (depends on a2)
+    """
+    (tmp_path / "alembic.ini").write_text("[alembic]\n")
+    (tmp_path / "env.py").write_text(ENV_PY)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    write_revision(versions, "a1", branch_labels=("a",))
+    write_revision(versions, "a2", "a1")
+    write_revision(versions, "a3", "a2")
+    write_revision(versions, "a4", "a2")
+    write_revision(versions, "a5", ("a3", "a4"))
+    write_revision(versions, "b1", branch_labels=("b",))
+    write_revision(versions, "b2", "b1", depends_on="a2")
+    with db.engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE upgrades (revision VARCHAR)"))
+        connection.execute(sa.text("CREATE TABLE alembic_version (version_num VARCHAR)"))
+    yield tmp_path
+    with db.engine.begin() as connection:
+        connection.execute(sa.text("DROP TABLE upgrades"))
+        connection.execute(sa.text("DROP TABLE alembic_version"))
+
+
+def set_current_heads(*heads):
+    with db.engine.begin() as connection:
+        connection.execute(sa.text("DELETE FROM alembic_version"))
+        for head in heads:
+            connection.execute(sa.text("INSERT INTO alembic_version VALUES (:h)"), {"h": head})
+
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
+
+
+class TestExec:
+    def test_jsonl(self, runner):
+        result = runner.invoke(
+            db_cli,
+            [
+                "exec",
+                "--jsonl",
+                "--batch-size=2",
+                "WITH RECURSIVE t(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM t WHERE n < 5) SELECT n, 'n' || n AS label FROM t",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        assert [json.loads(line) for line in result.stdout.splitlines()] == [
+            {"n": n, "label": f"n{n}"} for n in range(1, 6)
+        ]
+
+    def test_json(self, runner):
+        result = runner.invoke(db_cli, ["exec", "--json", "SELECT 1 AS a"])
+        assert result.exit_code == 0, result.output
+        assert json.loads(result.stdout) == [{"a": 1}]
+
+    def test_file(self, runner, tmp_path):
+        script = tmp_path / "script.sql"
+        script.write_text("""
+            CREATE TABLE t (v VARCHAR); -- comment; with semicolon
+            /* block; comment */
+            INSERT INTO t VALUES ('a;b'), ('it''s');
+            SELECT v AS "odd;name" FROM t
+            """)
+        result = runner.invoke(db_cli, ["exec", "--no-commit", "--jsonl", "--file", str(script)])
+        assert result.exit_code == 0, result.output
+        assert [json.loads(line) for line in result.stdout.splitlines()] == [
+            {"odd;name": "a;b"},
+            {"odd;name": "it's"},
+        ]
+        timings = result.stderr.splitlines()
+        assert len(timings) == 3
+        assert "INSERT INTO t" in timings[1]
+
+    def test_missing_command(self, runner):
+        result = runner.invoke(db_cli, ["exec"])
+        assert result.exit_code == 2
+
+    def test_json_and_jsonl(self, runner):
+        result = runner.invoke(db_cli, ["exec", "--json", "--jsonl", "SELECT 1"])
+        assert result.exit_code == 2
+        assert "--json and --jsonl cannot be used together" in result.output
+
+
+class TestIterSqlStatements:
+    def test_statements(self):
+        script = io.StringIO(
+            "SELECT 1;SELECT ';' -- ;\n"
+            ";\n"
+            "CREATE FUNCTION f() RETURNS int AS $body$\n"
+            "BEGIN RETURN 1; END;\n"
+            "$body$ LANGUAGE plpgsql;\n"
+            "SELECT $$a;b$$, $1; /* multi\n"
+            'line; comment */ SELECT "a;""b" FROM t'
+        )
+        assert list(iter_sql_statements(script)) == [
+            "SELECT 1",
+            "SELECT ';' -- ;",
+            "CREATE FUNCTION f() RETURNS int AS $body$\nBEGIN RETURN 1; END;\n$body$ LANGUAGE plpgsql",
+            "SELECT $$a;b$$, $1",
+            '/* multi\nline; comment */ SELECT "a;""b" FROM t',
+        ]
+
+    def test_escape_strings(self):
+        script = io.StringIO(
+            "SELECT E'it\\'s; ok', e'\\\\';\n"
+            "SELECT E'multi\\\nline;', code'a;b' FROM t; SELECT 'a\\'; SELECT 2"
+        )
+        assert list(iter_sql_statements(script)) == [
+            "SELECT E'it\\'s; ok', e'\\\\'",
+            "SELECT E'multi\\\nline;', code'a;b' FROM t",
+            "SELECT 'a\\'",
+            "SELECT 2",
+        ]
+
+
+def get_upgrades():
+    with db.engine.connect() as connection:
+        return connection.execute(sa.text("SELECT revision FROM upgrades")).scalars().all()
+
+
+class TestAutoupgrade:
+    def test_autoupgrade(self, runner, migrations):
+        set_current_heads("a3", "b1")
+        result = runner.invoke(
+            db_cli, ["autoupgrade", "--single-transaction", "-d", str(migrations)]
+        )
+        assert result.exit_code == 0, result.output
+        upgrades = get_upgrades()
+        assert sorted(upgrades) == ["a4", "a5", "b2"]
+        assert upgrades.index("a4") < upgrades.index("a5")
+        timings = result.stderr.splitlines()
+        assert len(timings) == 4
+        assert "a2 -> a4" in timings[upgrades.index("a4")]
+        assert timings[-1].endswith("total")
+        assert "transaction_per_migration" not in runner.app.extensions["migrate"].configure_args
+        with db.engine.connect() as connection:
+            heads = connection.execute(sa.text("SELECT version_num FROM alembic_version"))
+            assert sorted(heads.scalars()) == ["a5", "b2"]
+
+    def test_configure_args_not_forwarded(self, runner, migrations):
+        set_current_heads("a5", "b1")
+        (migrations / "env.py").write_text(
+            ENV_PY.replace(', **current_app.extensions["migrate"].configure_args', "")
+        )
+        result = runner.invoke(
+            db_cli, ["autoupgrade", "--transaction-per-migration", "-d", str(migrations)]
+        )
+        assert result.exit_code == 1
+        assert "env.py does not forward the configure_args" in result.stderr
+        assert get_upgrades() == []
+        # single transaction is the default of alembic
+        result = runner.invoke(
+            db_cli, ["autoupgrade", "--single-transaction", "-d", str(migrations)]
+        )
+        assert result.exit_code == 0, result.output
+        assert get_upgrades() == ["b2"]
+
+    def test_report(self, runner, migrations):
+        set_current_heads("a3", "b1")
+        report_path = migrations / "report.json"
+        result = runner.invoke(
+            db_cli,
+            ["autoupgrade", "--report", "--report-file", str(report_path), "-d", str(migrations)],
+        )
+        assert result.exit_code == 0, result.output
+        report = json.loads(report_path.read_text())
+        assert [revision["revision"] for revision in report["revisions"]] == get_upgrades()
+        for revision in report["revisions"]:
+            # revision insert and version table update
+            assert revision["statements"] >= 2
+            assert revision["lock_wait"] is None  # only sampled on PostgreSQL
+            assert not revision["failed"]
+        assert report["duration"] >= sum(r["duration"] for r in report["revisions"])
+        summary = result.stderr.splitlines()[-4:]
+        assert summary[0].split() == ["duration", "statements", "lock", "wait", "revision"]
+        assert "a2 -> a4" in "".join(summary)
+
+    def test_report_failure(self, runner, migrations):
+        set_current_heads("a5", "b1")
+        (migrations / "versions" / "b2.py").write_text(
+            (migrations / "versions" / "b2.py")
+            .read_text()
+            .replace("INSERT INTO", "INSERT INTO b2_")
+        )
+        result = runner.invoke(db_cli, ["autoupgrade", "--report", "-d", str(migrations)])
+        assert result.exit_code == 1
+        assert result.stderr.splitlines()[-1].endswith("upgrade b1 -> b2  (failed)")
+
+    def test_uninstalled_branch(self, runner, migrations):
+        set_current_heads("a2")
+        result = runner.invoke(db_cli, ["autoupgrade", "-d", str(migrations)])
+        assert result.exit_code == 0, result.output
+        assert sorted(get_upgrades()) == ["a3", "a4", "a5"]
+
+    def test_public_api_only(self, monkeypatch, runner, migrations):
+        monkeypatch.delattr(ScriptDirectory, "_upgrade_revs")
+        set_current_heads("a4", "b1")
+        result = runner.invoke(db_cli, ["autoupgrade", "-d", str(migrations)])
+        assert result.exit_code == 0, result.output
+        assert sorted(get_upgrades()) == ["a3", "a5", "b2"]
+
+    def test_up_to_date(self, runner, migrations):
+        set_current_heads("a5", "b2")
+        result = runner.invoke(db_cli, ["autoupgrade", "-d", str(migrations)])
+        assert result.exit_code == 0, result.output
+        assert result.stderr == ""
+        assert get_upgrades() == []
+
+    def test_sql(self, runner, migrations):
+        set_current_heads("a5", "b1")
+        result = runner.invoke(db_cli, ["autoupgrade", "--sql", "-d", str(migrations)])
+        assert result.exit_code == 0, result.output
+        assert "INSERT INTO upgrades VALUES ('b2')" in result.stdout
+        assert "INSERT INTO upgrades VALUES ('a" not in result.stdout
+        assert get_upgrades() == []
+
+
+class TestRevisionsCache:
+    def test_cache(self, app, runner, migrations):
+        cache_path = migrations / "cache" / "revisions.json"
+        app.config["MIGRATIONS_CACHE"] = str(cache_path)
+        try:
+            set_current_heads("a3", "b1")
+            args = ["status", "--deps", "-d", str(migrations)]
+            expected = runner.invoke(db_cli, args, color=False).stdout
+            assert cache_path.exists()
+
+            # break a revision module without changing its size nor its modification time:
+            # it is not imported as the cache is still valid
+            path = migrations / "versions" / "a4.py"
+            content, stat = path.read_text(), path.stat()
+            path.write_text("raise ImportError".ljust(len(content), "#"))
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            result = runner.invoke(db_cli, args, color=False)
+            assert result.exit_code == 0, result.output
+            assert result.stdout == expected
+
+            path.write_text(content)
+            write_revision(migrations / "versions", "a6", "a5")
+            result = runner.invoke(db_cli, args, color=False)
+            assert result.exit_code == 0, result.output
+            assert "  [ ] ┸ a6 A6" in result.stdout.splitlines()
+
+            result = runner.invoke(db_cli, ["autoupgrade", "-d", str(migrations)])
+            assert result.exit_code == 0, result.output
+            assert sorted(get_upgrades()) == ["a4", "a5", "a6", "b2"]
+        finally:
+            app.config["MIGRATIONS_CACHE"] = False
+
+    def test_private_api_missing(self, monkeypatch, migrations):
+        # the cache is disabled if the revision files can not be listed
+        script = ScriptDirectory(str(migrations))
+        script.revision_map.heads  # revisions are loaded before the private API is removed
+        monkeypatch.delattr(Script, "_list_py_dir")
+        cache_path = migrations / "revisions.json"
+        revisions = load_revisions(script, str(cache_path))
+        assert sorted(revision.revision for revision in revisions) == [
+            "a1",
+            "a2",
+            "a3",
+            "a4",
+            "a5",
+            "b1",
+            "b2",
+        ]
+        assert not cache_path.exists()
+
+    def test_str_version_locations(self, migrations):
+        # version locations are strings before alembic 1.13
+        script = ScriptDirectory(str(migrations))
+        key = get_revisions_key(script)
+        assert len(key) == 7
+        script._version_locations = [str(location) for location in script._version_locations]
+        assert get_revisions_key(script) == key
+
+
+def make_synthetic_revisions(size, branches=1, seed=0):
+    """
+    Return synthetic revisions of the given number of branches with forks and merges
+    """
+    rnd = random.Random(seed)
+    revisions = []
+    for branch in range(branches):
+        tips = [f"{branch}_0"]
+        revisions.append(
+            SimpleNamespace(
+                revision=tips[0],
+                down_revision=None,
+                dependencies=None,
+                branch_labels={f"branch{branch}"},
+                doc="",
+            )
+        )
+        for i in range(1, size):
+            revision = f"{branch}_{i}"
+            if rnd.random() < 0.15 and len(tips) > 1:
+                down_revision = tuple(rnd.sample(tips, 2))
+                tips = [tip for tip in tips if tip not in down_revision]
+            else:
+                down_revision = rnd.choice(tips)
+                if rnd.random() < 0.7:
+                    tips.remove(down_revision)
+            tips.append(revision)
+            revisions.append(
+                SimpleNamespace(
+                    revision=revision,
+                    down_revision=down_revision,
+                    dependencies=None,
+                    branch_labels={f"branch{branch}"},
+                    doc="",
+                )
+            )
+    return revisions
+
+
+class TestStatus:
+    def test_status(self, runner, migrations):
+        set_current_heads("a3", "b1")
+        result = runner.invoke(db_cli, ["status", "--deps", "-d", str(migrations)], color=False)
+        assert result.exit_code == 0, result.output
+        assert result.stdout.splitlines() == [
+            "[a ×]",
+            "  [x] ┰ a1 A1",
+            "  [x] ┣┓ a2 A2",
+            "  [ ]  ┃ a4 A4",
+            "  [x] ┃ a3 A3",
+            "  [ ] ┗┛ a5 A5",
+            "[b ×]",
+            "  [x] ┰ b1 B1",
+            "  [ ] ┸ b2 B2",
+            "        └ (a) a2 A2",
+            "Some branches are outdated, you can upgrade with 'autoupgrade' sub-command.",
+        ]
+
+    def test_applied(self):
+        revisions = make_synthetic_revisions(200, branches=2)
+        graph = RevisionGraph(revisions, ["0_150", "1_20"])
+        assert "0_0" in graph.applied and "1_0" in graph.applied
+        assert "0_150" in graph.applied and "0_199" not in graph.applied
+
+    def test_upgrade_targets(self):
+        revisions = make_synthetic_revisions(200, branches=3)
+        graph = RevisionGraph(revisions, ["0_150", "1_199"])
+        targets = graph.get_upgrade_targets()
+        assert targets and not any(target.startswith("2_") for target in targets)
+        assert not targets & graph.applied and not any(graph.next[rev] for rev in targets)
+        assert graph.get_ancestors(targets) >= {
+            rev for rev in graph.revisions if rev.startswith("0_")
+        }
+
+    def test_layout(self):
+        revisions = make_synthetic_revisions(2000)
+        graph = RevisionGraph(revisions)
+        layout = list(graph.layout("0_0"))
+        assert len(layout) == 2000
+        assert {rev for rev, _, _ in layout} == set(graph.revisions)
+
+
+def benchmark_revision_graph(sizes=(1000, 5000, 20000)):
+    """
+    Print the duration of the indexation and the layout of synthetic revision graphs
+
+        python -m utils_flask_sqla.tests.test_commands
+    """
+    for size in sizes:
+        revisions = make_synthetic_revisions(size)
+        start = perf_counter()
+        graph = RevisionGraph(revisions)
+        indexed = perf_counter()
+        for _ in graph.layout("0_0"):
+            pass
+        end = perf_counter()
+        print(
+            f"{size:>6} revisions: index {indexed - start:.3f}s, layout {end - indexed:.3f}s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    benchmark_revision_graph()
@@ -0,0 +1,141 @@
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship, selectinload
+from sqlalchemy.ext.hybrid import hybrid_property
+from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+
+from utils_flask_sqla.schema import ModelConverter
+from utils_flask_sqla.serializers import serializable
+
+db = SQLAlchemy()
+
+
+@serializable(hybrid_expressions=["childs_count"])
+class Parent(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+    @hybrid_property
+    def childs_count(self):
+        return len(self.childs)
+
+    @childs_count.expression
+    def childs_count(cls):
+        return (
+            sa.select(sa.func.count(Child.pk)).where(Child.parent_pk == cls.pk).scalar_subquery()
+        )
+
+    @hybrid_property
+    def label(self):
+        return "parent {}".format(self.name)
+
+
+@serializable(hybrid_expressions=["double"])
+class Child(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer)
+    parent_pk = db.Column(db.Integer, db.ForeignKey(Parent.pk))
+    parent = relationship(Parent, backref="childs")
+
+    @hybrid_property
+    def double(self):
+        return self.value * 2
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture(scope="class")
+def data(app):
+    p1 = Parent(pk=1, name="p1")
+    p2 = Parent(pk=2, name="p2")
+    with db.session.begin_nested():
+        db.session.add_all(
+            [p1, p2, Child(pk=1, value=1, parent=p1), Child(pk=2, value=2, parent=p1)]
+        )
+    db.session.expunge_all()
+
+
+@pytest.mark.usefixtures("data")
+class TestHybridExpressions:
+    def test_loader_options(self, app):
+        fields = ["pk", "childs_count", "label"]
+        options = Parent.as_dict_loader_options(fields=fields)
+        assert len(options) == 1  # label has no SQL expression
+        query = sa.select(Parent).options(*options).order_by(Parent.pk)
+        parents = db.session.scalars(query).all()
+        # childs relationship has not been loaded to compute childs_count
+        assert all("childs" in sa.inspect(p).unloaded for p in parents)
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "childs_count": 2, "label": "parent p1"},
+            {"pk": 2, "childs_count": 0, "label": "parent p2"},
+        ]
+        assert all("childs" in sa.inspect(p).unloaded for p in parents)
+        db.session.expunge_all()
+
+    def test_without_loader_options(self, app):
+        parent = db.session.get(Parent, 1)
+        assert parent.as_dict(fields=["childs_count"]) == {"childs_count": 2}
+        assert "childs" not in sa.inspect(parent).unloaded
+        db.session.expunge_all()
+
+    def test_relationship_loader_options(self, app):
+        fields = ["pk", "childs.pk", "childs.double"]
+        query = (
+            sa.select(Parent)
+            .where(Parent.pk == 1)
+            .options(selectinload(Parent.childs))
+            .options(*Parent.as_dict_loader_options(fields=fields))
+        )
+        parent = db.session.scalars(query).one()
+        assert all("_sql_double" in vars(child) for child in parent.childs)
+        assert parent.as_dict(fields=fields) == {
+            "pk": 1,
+            "childs": [{"pk": 1, "double": 2}, {"pk": 2, "double": 4}],
+        }
+        db.session.expunge_all()
+
+    def test_query_expressions_columns(self, app):
+        # query expressions are registered when the mappers are configured,
+        # not while serializing
+        assert "_sql_childs_count" in sa.inspect(Parent).attrs
+        assert "_sql_double" in sa.inspect(Child).attrs
+        child = Child()
+        child.from_dict({"pk": 3, "value": 3, "_sql_double": 12})
+        assert "_sql_double" not in vars(child)
+        assert child.as_dict() == {"pk": 3, "value": 3, "parent_pk": None, "double": 6}
+
+    def test_auto_schema(self, app):
+        class PlainParent(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+
+            @hybrid_property
+            def double(self):
+                return self.pk * 2
+
+        serializable(PlainParent)
+        sa.orm.configure_mappers()
+        # no query expression is added unless requested
+        assert set(sa.inspect(PlainParent).attrs.keys()) == {"pk"}
+
+        class PlainParentSchema(SQLAlchemyAutoSchema):
+            class Meta:
+                model = PlainParent
+
+        assert set(PlainParentSchema().fields) == {"pk"}
+
+        class HybridChildSchema(SQLAlchemyAutoSchema):
+            class Meta:
+                model = Child
+                model_converter = ModelConverter
+
+        assert set(HybridChildSchema().fields) == {"pk", "value"}
@@ -0,0 +1,72 @@
+import io
+import json
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+from werkzeug.exceptions import BadRequest
+
+from utils_flask_sqla.serializers import serializable
+from utils_flask_sqla.ingest import iter_json_array, iter_request_json_array, ingest
+
+db = SQLAlchemy()
+
+
+@serializable
+class Item(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+class TestIterJsonArray:
+    @pytest.mark.parametrize("read_size", [1, 2, 7, 65536, 1 << 20])
+    def test_elements(self, read_size):
+        data = [1, 12345, -1.5e3, "é,]", None, True, [1, [2]], {"a": {"b": "]"}}]
+        stream = io.BytesIO(json.dumps(data, ensure_ascii=False).encode())
+        assert list(iter_json_array(stream, read_size=read_size)) == data
+
+    @pytest.mark.parametrize("document", [b"[]", b"  [ ] ", b"\n[\n]\n"])
+    def test_empty(self, document):
+        assert list(iter_json_array(io.BytesIO(document), read_size=1)) == []
+
+    @pytest.mark.parametrize(
+        "document", [b"", b"{}", b"[1,", b"[1 2]", b"[1,]", b"[1] 2", b'["a]']
+    )
+    def test_invalid(self, document):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.BytesIO(document), read_size=1))
+
+    def test_request(self, app):
+        with app.test_request_context(data=b'[{"pk": 1}]'):
+            assert list(iter_request_json_array()) == [{"pk": 1}]
+        with app.test_request_context(data=b'{"pk": 1}'):
+            with pytest.raises(BadRequest):
+                list(iter_request_json_array())
+
+
+class TestIngest:
+    def test_ingest(self, app):
+        progress = []
+        report = ingest(
+            Item,
+            ({"pk": i, "name": f"item {i}"} for i in range(1, 8)),
+            chunk_size=3,
+            progress=lambda count, duration: progress.append(count),
+        )
+        assert report["count"] == 7
+        assert len(report["chunks"]) == 3
+        assert progress == [3, 6, 7]
+        assert not any(isinstance(o, Item) for o in db.session)
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Item)) == 7
+        assert db.session.get(Item, 7).name == "item 7"
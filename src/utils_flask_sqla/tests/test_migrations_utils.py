@@ -0,0 +1,339 @@
+from contextlib import contextmanager
+from datetime import date
+import io
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.util import CommandError
+from alembic.operations import Operations
+from dateutil.relativedelta import relativedelta
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+
+from utils_flask_sqla.migrations.utils import (
+    attach_partition,
+    create_index_concurrently,
+    create_range_partitions,
+    drop_index_concurrently,
+    execute_in_batches,
+    partition_table,
+)
+from .utils import get_postgresql_uri
+
+db = SQLAlchemy()
+
+
+class Measure(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, sa.CheckConstraint("value < 100"))
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def measures(app):
+    with db.engine.begin() as connection:
+        Measure.__table__.create(connection)
+        connection.execute(
+            sa.insert(Measure), [{"pk": pk, "value": pk % 3} for pk in range(1, 26)]
+        )
+    yield
+    with db.engine.begin() as connection:
+        Measure.__table__.drop(connection)
+
+
+@contextmanager
+def migration(engine=None):
+    """
+    Run alembic operations as in a revision, in a migration transaction
+    """
+    with (engine or db.engine).connect() as connection:
+        context = MigrationContext.configure(connection)
+        with Operations.context(context), context.begin_transaction():
+            yield
+
+
+def get_values():
+    with db.engine.connect() as connection:
+        return dict(connection.execute(sa.select(Measure.pk, Measure.value)).all())
+
+
+UPDATE = "UPDATE measure SET value = value + pk WHERE pk BETWEEN :lower AND :upper"
+
+
+@pytest.mark.usefixtures("measures")
+class TestExecuteInBatches:
+    def test_batches(self):
+        progress = []
+        with migration():
+            report = execute_in_batches(
+                UPDATE,
+                "measure",
+                "pk",
+                batch_size=10,
+                progress=lambda count, last, duration: progress.append((count, last)),
+            )
+        assert report["count"] == 25
+        assert len(report["batches"]) == 3
+        assert report["last"] == 25
+        assert progress == [(10, 10), (20, 20), (25, 25)]
+        assert get_values() == {pk: pk % 3 + pk for pk in range(1, 26)}
+
+    def test_where(self):
+        with migration():
+            report = execute_in_batches(
+                UPDATE + " AND value = 0",
+                Measure.__table__,
+                "pk",
+                batch_size=3,
+                where=Measure.value == 0,
+            )
+        assert report["count"] == 8
+        assert len(report["batches"]) == 3
+        assert get_values() == {pk: pk if pk % 3 == 0 else pk % 3 for pk in range(1, 26)}
+
+    def test_resume(self):
+        with pytest.raises(sa.exc.IntegrityError):
+            with migration():
+                execute_in_batches(
+                    UPDATE.replace("pk", "pk * 5", 1), "measure", "pk", batch_size=5
+                )
+        # batches have been committed, up to the one violating the check constraint
+        values = get_values()
+        assert all(values[pk] == pk % 3 + pk * 5 for pk in range(1, 16))
+        assert all(values[pk] == pk % 3 for pk in range(16, 26))
+
+        with migration():
+            report = execute_in_batches(
+                "DELETE FROM measure WHERE pk BETWEEN :lower AND :upper",
+                "measure",
+                "pk",
+                batch_size=5,
+                start_after=15,
+            )
+        assert report["count"] == 10
+        assert sorted(get_values()) == list(range(1, 16))
+
+    def test_connection(self):
+        with db.engine.begin() as connection:
+            report = execute_in_batches(
+                UPDATE, "measure", "pk", batch_size=10, connection=connection
+            )
+        assert report["count"] == 25
+        assert get_values() == {pk: pk % 3 + pk for pk in range(1, 26)}
+
+    def test_connection_autocommit(self):
+        with db.engine.begin() as connection:
+            with pytest.raises(CommandError, match="autocommit"):
+                execute_in_batches(UPDATE, "measure", "pk", autocommit=True, connection=connection)
+        assert get_values() == {pk: pk % 3 for pk in range(1, 26)}
+
+
+@contextmanager
+def postgresql_sql():
+    """
+    Render alembic operations for PostgreSQL as in --sql mode
+    """
+    output = io.StringIO()
+    context = MigrationContext.configure(
+        dialect_name="postgresql", opts={"as_sql": True, "output_buffer": output}
+    )
+    with Operations.context(context), context.begin_transaction():
+        yield output
+
+
+def get_statements(output):
+    return [line for line in output.getvalue().splitlines() if line]
+
+
+def get_indexes():
+    return {index["name"] for index in sa.inspect(db.engine).get_indexes("measure")}
+
+
+@pytest.mark.usefixtures("measures")
+class TestIndexes:
+    def test_create_drop(self):
+        with migration():
+            create_index_concurrently("i_measure_value", "measure", ["value"])
+        assert get_indexes() == {"i_measure_value"}
+        with migration():
+            drop_index_concurrently("i_measure_value", "measure")
+        assert get_indexes() == set()
+
+    def test_postgresql_sql(self):
+        with postgresql_sql() as output:
+            create_index_concurrently(
+                "i_measure_value", "measure", ["value"], schema="s", postgresql_where="value > 0"
+            )
+            drop_index_concurrently("i_measure_value", "measure", schema="s")
+        assert get_statements(output) == [
+            "BEGIN;",
+            "COMMIT;",
+            "CREATE INDEX CONCURRENTLY i_measure_value ON s.measure (value) WHERE value > 0;",
+            "BEGIN;",
+            "COMMIT;",
+            "DROP INDEX CONCURRENTLY IF EXISTS s.i_measure_value;",
+            "BEGIN;",
+            "COMMIT;",
+        ]
+
+
+class TestPartitions:
+    def test_create_range_partitions(self):
+        with postgresql_sql() as output:
+            partitions = create_range_partitions(
+                "obs", date(2024, 11, 1), date(2025, 1, 15), relativedelta(months=1), default=True
+            )
+            create_range_partitions("obs", -10, 10, 10, schema="s")
+        assert partitions == ["obs_20241101", "obs_20241201", "obs_20250101"]
+        assert get_statements(output)[1:-1] == [
+            "CREATE TABLE IF NOT EXISTS obs_20241101 PARTITION OF obs "
+            "FOR VALUES FROM ('2024-11-01') TO ('2024-12-01');",
+            "CREATE TABLE IF NOT EXISTS obs_20241201 PARTITION OF obs "
+            "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01');",
+            "CREATE TABLE IF NOT EXISTS obs_20250101 PARTITION OF obs "
+            "FOR VALUES FROM ('2025-01-01') TO ('2025-02-01');",
+            "CREATE TABLE IF NOT EXISTS obs_default PARTITION OF obs DEFAULT;",
+            "CREATE TABLE IF NOT EXISTS s.obs_m10 PARTITION OF s.obs FOR VALUES FROM (-10) TO (0);",
+            "CREATE TABLE IF NOT EXISTS s.obs_0 PARTITION OF s.obs FOR VALUES FROM (0) TO (10);",
+        ]
+
+        # generated names are truncated to the PostgreSQL identifiers length, keeping suffixes
+        with postgresql_sql() as output:
+            partitions = create_range_partitions("o" * 70, 0, 10, 10, default=True)
+        assert partitions == ["o" * 61 + "_0"]
+        assert f" {'o' * 55}_default PARTITION OF" in get_statements(output)[-2]
+
+    def test_attach_partition(self):
+        with postgresql_sql() as output:
+            attach_partition("obs", "obs_2030", "date", date(2030, 1, 1), date(2031, 1, 1))
+        assert get_statements(output)[1:-1] == [
+            "ALTER TABLE obs_2030 ADD CONSTRAINT obs_2030_bounds CHECK "
+            "(date IS NOT NULL AND date >= '2030-01-01' AND date < '2031-01-01') NOT VALID;",
+            "ALTER TABLE obs_2030 VALIDATE CONSTRAINT obs_2030_bounds;",
+            "ALTER TABLE obs ATTACH PARTITION obs_2030 FOR VALUES FROM ('2030-01-01') TO ('2031-01-01');",
+            "ALTER TABLE obs_2030 DROP CONSTRAINT obs_2030_bounds;",
+        ]
+
+
+PARTITIONED_TABLE_SQL = """
+    CREATE TABLE obs (
+        id serial PRIMARY KEY,
+        date date NOT NULL,
+        value integer DEFAULT 0 CHECK (value >= 0)
+    );
+    CREATE INDEX i_obs_value ON obs (value);
+    CREATE UNIQUE INDEX i_obs_id_value ON obs (id, value);
+    ALTER TABLE obs ADD CONSTRAINT obs_date_value_key UNIQUE (date, value);
+    INSERT INTO obs (date, value)
+    SELECT DATE '2023-12-25' + i * 3, i FROM generate_series(0, 49) i;
+    CREATE TABLE obs_log (id integer);
+    CREATE FUNCTION log_obs() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN INSERT INTO obs_log VALUES (NEW.id); RETURN NULL; END
+    $$;
+    CREATE TRIGGER tri_log_obs AFTER INSERT ON obs FOR EACH ROW EXECUTE FUNCTION log_obs();
+    CREATE ROLE obs_reader;
+    GRANT SELECT ON obs TO obs_reader;
+"""
+
+
+@pytest.fixture
+def postgresql_engine():
+    engine = sa.create_engine(get_postgresql_uri())
+    with engine.begin() as connection:
+        connection.exec_driver_sql(PARTITIONED_TABLE_SQL)
+    yield engine
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "DROP VIEW IF EXISTS obs_view; DROP TABLE IF EXISTS obs, obs_old, obs_log; "
+            "DROP FUNCTION log_obs; DROP ROLE obs_reader;"
+        )
+    engine.dispose()
+
+
+@pytest.mark.postgresql
+class TestPartitionTable:
+    def test_partition_table(self, postgresql_engine):
+        engine = postgresql_engine
+        with migration(engine):
+            partition_table(
+                "obs",
+                "date",
+                date(2024, 1, 1),
+                date(2024, 4, 1),
+                relativedelta(months=1),
+                drop_unique=True,
+            )
+        with engine.connect() as connection:
+            query = (
+                "SELECT CAST(inhrelid AS regclass)::text, count(o.id) FROM pg_inherits "
+                "LEFT JOIN obs o ON o.tableoid = inhrelid "
+                "WHERE inhparent = CAST('obs' AS regclass) GROUP BY 1 ORDER BY 1"
+            )
+            assert connection.exec_driver_sql(query).all() == [
+                ("obs_20240101", 10),
+                ("obs_20240201", 10),
+                ("obs_20240301", 10),
+                ("obs_default", 20),
+            ]
+            assert connection.exec_driver_sql("SELECT to_regclass('obs_old')").scalar() is None
+            indexes = connection.exec_driver_sql(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'obs' ORDER BY 1"
+            )
+            # the unique index without the partition key is not created
+            assert indexes.scalars().all() == ["i_obs_value", "obs_date_value_key", "obs_pkey"]
+            constraints = connection.exec_driver_sql(
+                "SELECT conname, contype FROM pg_constraint "
+                "WHERE conrelid = CAST('obs' AS regclass) AND contype IN ('p', 'u') ORDER BY 1"
+            )
+            assert constraints.all() == [("obs_date_value_key", "u"), ("obs_pkey", "p")]
+            assert connection.exec_driver_sql(
+                "SELECT has_table_privilege('obs_reader', 'obs', 'SELECT')"
+            ).scalar()
+            # the trigger has not been fired by the copy, but is fired by new rows
+            assert connection.exec_driver_sql("SELECT count(*) FROM obs_log").scalar() == 0
+            connection.exec_driver_sql("INSERT INTO obs (date) VALUES ('2024-02-10')")
+            assert connection.exec_driver_sql("SELECT id FROM obs_log").scalar() == 51
+
+    @pytest.mark.parametrize(
+        "sql,error",
+        [
+            (
+                "CREATE VIEW obs_view AS SELECT * FROM obs",
+                "other objects depend on it: view obs_view",
+            ),
+            ("ALTER TABLE obs ENABLE ROW LEVEL SECURITY", "Row level security"),
+            (
+                "ALTER TABLE obs ADD CONSTRAINT obs_excl "
+                "EXCLUDE USING gist (int4range(id, id, '[]') WITH &&)",
+                "Exclusion constraint obs_excl",
+            ),
+            (None, "Unique index i_obs_id_value .* does not contain the partition key"),
+        ],
+    )
+    def test_unsupported(self, postgresql_engine, sql, error):
+        engine = postgresql_engine
+        if sql is not None:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(sql)
+        with pytest.raises(CommandError, match=error):
+            with migration(engine):
+                partition_table(
+                    "obs",
+                    "date",
+                    date(2024, 1, 1),
+                    date(2024, 4, 1),
+                    1,
+                    drop_unique=sql is not None,
+                )
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("SELECT to_regclass('obs_old')").scalar() is None
+            assert connection.exec_driver_sql("SELECT count(*) FROM obs").scalar() == 50
@@ -16,19 +16,30 @@ else:
     from itertools import pairwise
 
 
+from datetime import date
+from decimal import Decimal
+
 import pytest
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import sqlalchemy as sa
 from werkzeug.exceptions import BadRequest
 
-from utils_flask_sqla.db import ordered
+from utils_flask_sqla.db import (
+    ordered,
+    paginated,
+    paginated_with_count,
+    resolve_column_path,
+    encode_cursor,
+    decode_cursor,
+)
 
 db = SQLAlchemy()
 
 
 class Parent(db.Model):
     pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
 
 
 class Child(db.Model):
@@ -47,10 +58,10 @@ def app():
         yield app
 
 
-@pytest.fixture(scope="class")
+@pytest.fixture(scope="module")
 def data(app):
-    p1 = Parent(pk=1)
-    p2 = Parent(pk=2)
+    p1 = Parent(pk=1, name="b")
+    p2 = Parent(pk=2, name="a")
     c1 = Child(pk=1, parent_pk=1)
     c2 = Child(pk=2, parent_pk=2)
     c3 = Child(pk=3, parent_pk=1)
@@ -187,3 +198,156 @@ class TestOrdered:
         with app.test_request_context("?sort=parent.unexisting"):
             with pytest.raises(BadRequest, match=".*does not have.*"):
                 stmt = ordered(query, Child, join=True)
+
+    def test_ordered_relationship_multiple_columns(self, app):
+        query = sa.select(Child)
+
+        with app.test_request_context("?sort=-parent.name,parent.pk,-pk"):
+            stmt = ordered(query, Child, join=True)
+            assert len(stmt.get_final_froms()) == 1  # parent joined once
+            results = db.session.execute(stmt).scalars().all()
+            assert [c.pk for c in results] == [3, 1, 4, 2]
+
+    def test_path_resolution_cache(self, app):
+        resolve_column_path.cache_clear()
+        query = sa.select(Child)
+
+        for _ in range(2):
+            with app.test_request_context("?sort=parent.name,parent.pk"):
+                ordered(query, Child, join=True)
+        info = resolve_column_path.cache_info()
+        assert info.misses == 2
+        assert info.hits == 2
+
+
+def fetch_pages(app, query, model, url, limit, **kwargs):
+    pages = []
+    cursor = None
+    while True:
+        page_url = url if cursor is None else f"{url}&cursor={cursor}"
+        with app.test_request_context(page_url):
+            items, cursor = paginated(query, model, limit=limit, **kwargs)
+        pages.append([item.pk for item in items])
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.usefixtures("data")
+class TestPaginated:
+    @pytest.mark.parametrize(
+        "url,expected",
+        [
+            ("?", [1, 2, 3, 4]),
+            ("?sort=-pk", [4, 3, 2, 1]),
+            ("?sort=parent_pk", [1, 3, 2, 4]),
+            ("?sort=-parent_pk", [2, 4, 1, 3]),
+            ("?sort=-parent_pk,-pk", [4, 2, 3, 1]),
+            ("?sort=parent.name,-pk", [4, 2, 3, 1]),
+        ],
+    )
+    @pytest.mark.parametrize("limit", [1, 3, 4, 10])
+    def test_pages(self, app, url, expected, limit):
+        pages = fetch_pages(app, sa.select(Child), Child, url, limit, join=True)
+        assert [pk for page in pages for pk in page] == expected
+        assert all(len(page) == limit for page in pages[:-1])
+
+    def test_filtered(self, app):
+        query = sa.select(Child).where(Child.parent_pk == 2)
+        assert fetch_pages(app, query, Child, "?sort=-pk", 1) == [[4], [2]]
+
+    def test_keyset_clause(self, app):
+        with app.test_request_context(f"?sort=parent_pk&cursor={encode_cursor([1, 1])}"):
+            statements = []
+            listener = lambda conn, cursor, statement, *args: statements.append(statement)
+            sa.event.listen(db.engine, "before_cursor_execute", listener)
+            try:
+                items, cursor = paginated(sa.select(Child), Child, limit=2)
+            finally:
+                sa.event.remove(db.engine, "before_cursor_execute", listener)
+        assert [item.pk for item in items] == [3, 2]
+        assert "(child.parent_pk, child.pk) > (?, ?)" in statements[0]
+
+    def test_cursor(self):
+        columns = [
+            sa.Column("a", sa.Date),
+            sa.Column("b", sa.Numeric),
+            sa.Column("c", sa.String),
+            sa.Column("d", sa.Integer),
+        ]
+        values = [date(2024, 1, 2), Decimal("1.5"), "é", None]
+        assert decode_cursor(encode_cursor(values), columns) == values
+
+    @pytest.mark.parametrize(
+        "cursor", ["not-a-cursor", encode_cursor([1]), encode_cursor(["1", 1])]
+    )
+    def test_invalid_cursor(self, app, cursor):
+        with app.test_request_context(f"?sort=parent_pk&cursor={cursor}"):
+            with pytest.raises(BadRequest, match="Invalid cursor"):
+                paginated(sa.select(Child), Child)
+
+
+@pytest.mark.usefixtures("data")
+class TestPaginatedWithCount:
+    def test_pages(self, app):
+        query = sa.select(Child).where(Child.parent_pk == 1).order_by(Child.pk)
+        assert [
+            ([c.pk for c in items], total)
+            for items, total in (
+                paginated_with_count(query, page=page, limit=1) for page in range(1, 4)
+            )
+        ] == [([1], 2), ([3], 2), ([], 2)]
+
+        items, total = paginated_with_count(query.where(Child.pk > 10))
+        assert (items, total) == ([], 0)
+
+    def test_single_statement(self, app):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        sa.event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            items, total = paginated_with_count(
+                sa.select(Child).order_by(Child.pk), limit=3, approximate=0
+            )
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", listener)
+        assert [c.pk for c in items] == [1, 2, 3]
+        assert total == 4
+        # no planner estimation with sqlite
+        assert len(statements) == 1
+        assert "(SELECT count(*)" in statements[0]
+
+    def test_distinct_group_by(self, app):
+        query = sa.select(Child.parent_pk).distinct().order_by(Child.parent_pk)
+        assert paginated_with_count(query, limit=1) == ([1], 2)
+
+        query = (
+            sa.select(Child.parent_pk, sa.func.count().label("count"))
+            .group_by(Child.parent_pk)
+            .order_by(Child.parent_pk)
+        )
+        assert paginated_with_count(query, page=2, limit=1) == ([(2, 2)], 2)
+
+    def test_columns(self, app):
+        query = sa.select(Child.pk, Child.parent_pk).order_by(Child.pk)
+        assert paginated_with_count(query, limit=2) == ([(1, 1), (2, 2)], 4)
+
+        # core select, without ORM entity
+        query = sa.select(Child.__table__.c.pk).order_by(Child.__table__.c.pk)
+        assert paginated_with_count(query, limit=2) == ([1, 2], 4)
+
+    def test_duplicating_join(self, app):
+        # rows duplicated by a join are neither merged in the page nor in the total
+        query = sa.select(Parent).join(Parent.childs).order_by(Parent.pk, Child.pk)
+        items, total = paginated_with_count(query, limit=2)
+        assert [p.pk for p in items] == [1, 1]
+        assert total == db.session.scalar(
+            sa.select(sa.func.count()).select_from(Parent).join(Parent.childs)
+        )
+        db.session.expunge_all()
+
+    def test_joined_collection(self, app):
+        query = sa.select(Parent).options(sa.orm.joinedload(Parent.childs)).order_by(Parent.pk)
+        items, total = paginated_with_count(query, limit=1)
+        assert [(p.pk, sorted(c.pk for c in p.childs)) for p in items] == [(1, [1, 3])]
+        assert total == 2
+        db.session.expunge_all()
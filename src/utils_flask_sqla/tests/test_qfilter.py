@@ -4,7 +4,7 @@ from sqlalchemy import func, and_, select
 
 from flask_sqlalchemy import SQLAlchemy
 
-from utils_flask_sqla.models import qfilter
+from utils_flask_sqla.models import qfilter, compose_filters
 
 db = SQLAlchemy()
 
@@ -29,6 +29,48 @@ class BarModel(db.Model):
     def where_pk_list(cls, pk, **kwargs):
         return BarModel.pk == pk
 
+    @qfilter(cache=True)
+    def where_pk_cached(cls, pk, **kwargs):
+        return BarModel.pk == pk
+
+    @qfilter(query=True, cache=True)
+    def filter_cached(cls, **kwargs):
+        query = kwargs["query"]
+        if "pk" in kwargs:
+            query = query.where(BarModel.pk == kwargs["pk"])
+        if "pks" in kwargs:
+            query = query.where(BarModel.pk.in_(kwargs["pks"]))
+        return query
+
+
+class OwnerModel(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+
+class PetModel(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String)
+    owner_pk = db.Column(db.Integer, db.ForeignKey(OwnerModel.pk))
+    owner = db.relationship(OwnerModel, backref="pets")
+
+    @qfilter(query=True)
+    def filter_by_owner(cls, name, **kwargs):
+        return kwargs["query"].join(PetModel.owner).where(OwnerModel.name == name)
+
+    @qfilter(query=True)
+    def filter_by_owner_with_cat(cls, **kwargs):
+        return (
+            kwargs["query"]
+            .join(PetModel.owner)
+            .where(OwnerModel.pets.any(PetModel.kind == "cat"))
+            .where(PetModel.kind != "fish")
+        )
+
+    @qfilter
+    def where_not_fish(cls, **kwargs):
+        return and_(PetModel.kind != "fish", OwnerModel.pets.any(PetModel.kind == "cat"))
+
 
 @pytest.fixture(scope="session")
 def app():
@@ -76,3 +118,68 @@ class TestQfilter:
             ).one_or_none()
             is bar
         )
+
+    def test_qfilter_cache(self, bar):
+        BarModel.filter_cached.cache_clear()
+        for pk in [bar.pk, bar.pk + 1, bar.pk]:
+            assert db.session.scalars(BarModel.filter_cached(pk=pk)).one_or_none() is (
+                bar if pk == bar.pk else None
+            )
+        assert db.session.scalars(BarModel.filter_cached(pks=[bar.pk, -1])).all() == [bar]
+        assert db.session.scalars(BarModel.filter_cached(pks=[-1])).all() == []
+        assert db.session.scalars(BarModel.filter_cached()).all() == [bar]
+        info = BarModel.filter_cached.cache_info()
+        assert info.misses == 3  # pk, pks and no parameter
+        assert info.hits == 2
+        info = BarModel.filter_cached.statement_cache_info()
+        assert info.misses == 5
+        assert info.hits == 1
+
+        # equal values of different types are bound to different statements
+        for value in [1, True, 1.0]:
+            (param,) = BarModel.filter_cached(pk=value).compile().params.values()
+            assert type(param) is type(value)
+            (param,) = BarModel.filter_cached(pks=[value]).compile().params.values()
+            assert [type(v) for v in param] == [type(value)]
+
+        # filters with the same shape may be combined in the same statement
+        query = select(BarModel).where(
+            BarModel.where_pk_cached(bar.pk) | BarModel.where_pk_cached(pk=bar.pk + 1)
+        )
+        assert db.session.scalars(query).all() == [bar]
+        query = select(BarModel).where(BarModel.where_pk_cached(bar.pk + 1))
+        assert db.session.scalars(query).all() == []
+
+        # a given query is not cached
+        query = BarModel.filter_cached(pk=bar.pk, query=select(BarModel).where(BarModel.pk < 0))
+        assert db.session.scalars(query).all() == []
+        assert BarModel.filter_cached.cache_info().misses == 3
+
+    def test_compose_filters(self, app):
+        with db.session.begin_nested():
+            alice, bob = OwnerModel(pk=1, name="alice"), OwnerModel(pk=2, name="bob")
+            db.session.add_all(
+                [
+                    PetModel(pk=1, kind="cat", owner=alice),
+                    PetModel(pk=2, kind="dog", owner=alice),
+                    PetModel(pk=3, kind="fish", owner=alice),
+                    PetModel(pk=4, kind="dog", owner=bob),
+                ]
+            )
+        query = compose_filters(
+            select(PetModel).order_by(PetModel.pk),
+            PetModel.filter_by_owner("alice"),
+            PetModel.filter_by_owner_with_cat(),
+            PetModel.where_not_fish(),
+            PetModel.pk > 0,
+            True,
+        )
+        sql = str(query)
+        assert sql.count("JOIN") == 1
+        assert sql.count("EXISTS") == 1
+        assert sql.count("!=") == 1
+        assert [pet.pk for pet in db.session.scalars(query)] == [1, 2]
+
+        assert compose_filters(query, PetModel.filter_by_owner("alice")) is query
+        query = compose_filters(query, PetModel.filter_by_owner("bob"))
+        assert db.session.scalars(query).all() == []
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+from flask import Flask
+
+from utils_flask_sqla.response import json_resp, to_json_resp
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+
+    @app.route("/stream")
+    @json_resp
+    def stream():
+        return (item for item in [{"a": 1}, b'{"b":2}', [3]])
+
+    return app
+
+
+class TestToJsonResp:
+    def test_json(self, app):
+        with app.test_request_context():
+            response = to_json_resp({"a": "é"})
+            assert response.is_streamed is False
+            assert json.loads(response.get_data()) == {"a": "é"}
+
+    def test_bytes(self, app):
+        with app.test_request_context():
+            response = to_json_resp('{"a": "é"}'.encode("utf-8"))
+            assert response.mimetype == "application/json"
+            assert json.loads(response.get_data()) == {"a": "é"}
+
+    def test_generator(self, app):
+        response = app.test_client().get("/stream")
+        assert response.is_streamed
+        assert json.loads(response.get_data()) == [{"a": 1}, {"b": 2}, [3]]
+
+    def test_empty_generator(self, app):
+        with app.test_request_context():
+            response = to_json_resp(item for item in [])
+            assert json.loads(response.get_data()) == []
@@ -1,3 +1,6 @@
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
 from unittest import TestCase
 
 import marshmallow as ma
@@ -8,7 +11,11 @@ from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask_sqlalchemy import SQLAlchemy
 
-from utils_flask_sqla.schema import SmartRelationshipsMixin
+from utils_flask_sqla.schema import (
+    SmartRelationshipsMixin,
+    get_fields_classification,
+    resolve_only_exclude,
+)
 
 db = SQLAlchemy()
 
@@ -448,3 +455,83 @@ class TestSmartRelationshipsMixin:
             DeferredSchema(only=["+b"]).dump(d), {"pk": 1, "a": "A", "b": "B"}
         )
         TestCase().assertDictEqual(DeferredSchema(only=["b"]).dump(d), {"b": "B"})
+
+    def test_cache(self):
+        included, excluded, nested = get_fields_classification(ChildSchema)
+        assert included == {"pk", "col", "parent_pk", "address_pk"}
+        assert excluded == set()
+        assert nested == {"parent", "hobbies", "address"}
+
+        resolve_only_exclude.cache_clear()
+        ChildSchema(only=["+parent", "parent.pk"])
+        ChildSchema(only=("parent.pk", "+parent"))
+        info = resolve_only_exclude.cache_info()
+        assert info.misses == 1
+        assert info.hits == 1
+
+        parent = Parent(pk=1, col="p")
+        child = Child(pk=1, col="c", parent_pk=1, parent=parent)
+        TestCase().assertDictEqual(
+            ChildSchema(only=["+parent", "parent.pk"]).dump(child),
+            {"pk": 1, "col": "c", "parent_pk": 1, "address_pk": None, "parent": {"pk": 1}},
+        )
+
+    def test_fast_dump(self):
+        class Obj:
+            pass
+
+        class FlatSchema(SmartRelationshipsMixin, ma.Schema):
+            class Meta:
+                datetimeformat = "%d/%m/%Y %H:%M"
+
+            i = ma.fields.Integer()
+            f = ma.fields.Float()
+            d = ma.fields.Decimal(places=2)
+            b = ma.fields.Boolean()
+            t = ma.fields.Boolean(truthy={"yes"})
+            s = ma.fields.String(data_key="string")
+            u = ma.fields.UUID()
+            dt = ma.fields.DateTime()
+            date = ma.fields.Date()
+            a = ma.fields.String(attribute="other")
+            n = ma.fields.String()
+            missing = ma.fields.String()
+
+        class CustomSchema(FlatSchema):
+            m = ma.fields.Method("get_m")
+
+            def get_m(self, obj):
+                return obj.other + 1
+
+        obj = Obj()
+        obj.i, obj.f, obj.d, obj.b = "1", 2, "1.234", 1
+        obj.s, obj.u = b"\xc3\xa9", uuid.UUID(int=1)
+        obj.dt, obj.date = datetime(2024, 1, 2, 3, 4), date(2024, 1, 2)
+        obj.other, obj.n, obj.t = 5, None, "yes"
+        expected = {
+            "i": 1,
+            "f": 2.0,
+            "d": Decimal("1.23"),
+            # truthy / falsy values are serialized as booleans before marshmallow 4
+            "b": FlatSchema._declared_fields["b"].serialize("b", obj),
+            "t": FlatSchema._declared_fields["t"].serialize("t", obj),
+            "string": "é",
+            "u": "00000000-0000-0000-0000-000000000001",
+            "dt": "02/01/2024 03:04",
+            "date": "2024-01-02",
+            "a": "5",
+            "n": None,
+        }
+
+        schema = FlatSchema()
+        assert schema._dump_function is not None
+        assert schema.dump(obj) == expected
+        assert schema.dump([obj], many=True) == [expected]
+        # dicts are dumped by marshmallow
+        assert FlatSchema(only=["i", "n"]).dump({"i": 1, "n": 2}) == {"i": 1, "n": "2"}
+
+        # fields without fast path are serialized by the bound fields of the schema
+        schema = CustomSchema()
+        assert schema._dump_function is not None
+        assert schema.dump(obj) == {**expected, "m": 6}
+        assert CustomSchema(only=["i", "a"])._dump_function is not None
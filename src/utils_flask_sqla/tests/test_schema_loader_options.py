@@ -0,0 +1,156 @@
+import json
+from types import GeneratorType
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from marshmallow.fields import Nested
+from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, auto_field
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship
+
+from utils_flask_sqla.response import to_json_resp
+from utils_flask_sqla.schema import SmartRelationshipsMixin
+from .utils import statements
+
+db = SQLAlchemy()
+
+
+cor_hobby_child = db.Table(
+    "cor_hobby_child",
+    db.Column("id_child", db.Integer, db.ForeignKey("child.pk")),
+    db.Column("id_hobby", db.Integer, db.ForeignKey("hobby.pk")),
+)
+
+
+class Parent(db.Model):
+    __tablename__ = "parent"
+    pk = db.Column(db.Integer, primary_key=True)
+    col = db.Column(db.String)
+
+
+class Hobby(db.Model):
+    __tablename__ = "hobby"
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+
+class Child(db.Model):
+    __tablename__ = "child"
+    pk = db.Column(db.Integer, primary_key=True)
+    col = db.Column(db.String)
+    parent_pk = db.Column(db.Integer, db.ForeignKey(Parent.pk))
+    parent = relationship(Parent, backref="childs")
+    hobbies = relationship(Hobby, secondary=cor_hobby_child)
+
+
+class ParentLoadingSchema(SmartRelationshipsMixin, SQLAlchemyAutoSchema):
+    class Meta:
+        model = Parent
+
+    childs = Nested("ChildLoadingSchema", many=True)
+
+
+class ChildLoadingSchema(SmartRelationshipsMixin, SQLAlchemyAutoSchema):
+    class Meta:
+        model = Child
+        include_fk = True
+
+    parent = Nested(ParentLoadingSchema)
+    hobbies = auto_field()
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture(scope="module")
+def data(app):
+    hobbies = [Hobby(pk=1, name="tennis"), Hobby(pk=2, name="chess")]
+    parents = [Parent(pk=1, col="p1"), Parent(pk=2, col="p2")]
+    childs = [
+        Child(pk=1, col="c1", parent=parents[0], hobbies=hobbies),
+        Child(pk=2, col="c2", parent=parents[0]),
+        Child(pk=3, col="c3", parent=parents[1], hobbies=hobbies[1:]),
+    ]
+    with db.session.begin_nested():
+        db.session.add_all(hobbies + parents + childs)
+    db.session.expunge_all()
+
+
+@pytest.mark.usefixtures("data")
+class TestLoaderOptions:
+    def test_nested(self, app, statements):
+        schema = ParentLoadingSchema(only=["childs.col", "childs.hobbies"])
+        query = sa.select(Parent).options(*schema.loader_options()).order_by(Parent.pk)
+        parents = db.session.scalars(query).all()
+        assert schema.dump(parents, many=True) == [
+            {
+                "pk": 1,
+                "col": "p1",
+                "childs": [{"col": "c1", "hobbies": [1, 2]}, {"col": "c2", "hobbies": []}],
+            },
+            {"pk": 2, "col": "p2", "childs": [{"col": "c3", "hobbies": [2]}]},
+        ]
+        # parents, childs and hobbies
+        assert len(statements) == 3
+        db.session.expunge_all()
+
+    def test_many_to_one(self, app, statements):
+        schema = ChildLoadingSchema(only=["col", "parent.col"])
+        query = sa.select(Child).options(*schema.loader_options()).order_by(Child.pk)
+        childs = db.session.scalars(query).all()
+        assert schema.dump(childs, many=True) == [
+            {"col": "c1", "parent": {"col": "p1"}},
+            {"col": "c2", "parent": {"col": "p1"}},
+            {"col": "c3", "parent": {"col": "p2"}},
+        ]
+        assert len(statements) == 1
+        db.session.expunge_all()
+
+    def test_load_only(self, app):
+        schema = ChildLoadingSchema(only=["col"])
+        query = sa.select(Child).options(*schema.loader_options())
+        child = db.session.scalars(query.where(Child.pk == 1)).one()
+        assert {"parent_pk", "parent", "hobbies"} <= sa.inspect(child).unloaded
+        assert "col" not in sa.inspect(child).unloaded
+        db.session.expunge_all()
+
+
+@pytest.mark.usefixtures("data")
+class TestDumpIter:
+    def test_dump_iter(self, app):
+        schema = ChildLoadingSchema(only=["pk", "parent.col"])
+        query = (
+            sa.select(Child)
+            .options(*schema.loader_options())
+            .order_by(Child.pk)
+            .execution_options(yield_per=2)
+        )
+        dumped = schema.dump_iter(db.session.scalars(query), chunk_size=2)
+        assert isinstance(dumped, GeneratorType)
+        assert list(dumped) == [
+            {"pk": 1, "parent": {"col": "p1"}},
+            {"pk": 2, "parent": {"col": "p1"}},
+            {"pk": 3, "parent": {"col": "p2"}},
+        ]
+        assert list(schema.dump_iter([])) == []
+        db.session.expunge_all()
+
+    def test_streamed_response(self, app):
+        schema = ParentLoadingSchema()
+        with app.test_request_context():
+            parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk))
+            response = to_json_resp(schema.dump_iter(parents))
+            assert response.is_streamed
+            assert json.loads(b"".join(response.response)) == [
+                {"pk": 1, "col": "p1"},
+                {"pk": 2, "col": "p2"},
+            ]
+        db.session.expunge_all()
@@ -1,3 +1,4 @@
+from decimal import Decimal
 from uuid import uuid4
 import datetime
 
@@ -6,13 +7,17 @@ from unittest import TestCase
 import json
 from shapely import wkt
 
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import UUID, HSTORE, ARRAY, JSON, JSONB
 from sqlalchemy.orm import relationship, deferred, column_property
 from geoalchemy2 import Geometry
 
-from utils_flask_sqla.serializers import serializable
+from utils_flask_sqla.serializers import serializable, as_json_array, sql_json_object
+from .utils import get_postgresql_uri
 
 db = SQLAlchemy()
 
@@ -938,3 +943,234 @@ class TestSerializers:
             },
             d.as_dict(fields=["+field2", "+field3"]),
         )
+
+    def test_field_plan_cache(self):
+        @serializable(cache_size=2)
+        class CachedParent(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            field1 = db.Column(db.String)
+            field2 = db.Column(db.String)
+
+        @serializable
+        class CachedChild(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            parent_pk = db.Column(db.Integer, db.ForeignKey(CachedParent.pk))
+            parent = relationship(CachedParent, backref="childs")
+
+        parent = CachedParent(pk=1, field1="f1", field2="f2")
+        parent.as_dict()
+        parent.as_dict()
+        parent.as_dict(fields=["field1"])
+        assert CachedParent.as_dict_cache.info() == (1, 2, 0, 2, 2)
+        parent.as_dict(fields=["field2"])
+        assert CachedParent.as_dict_cache.info() == (1, 3, 1, 2, 2)
+        parent.as_dict()
+        assert CachedParent.as_dict_cache.info() == (1, 4, 2, 2, 2)
+
+        CachedParent.as_dict_cache.clear()
+        CachedChild.prewarm_as_dict(fields=["parent.field1"])
+        assert CachedChild.as_dict_cache.info().misses == 1
+        assert CachedParent.as_dict_cache.info().misses == 1
+        child = CachedChild(pk=1, parent=parent)
+        TestCase().assertDictEqual(
+            {"pk": 1, "parent_pk": None, "parent": {"field1": "f1"}},
+            child.as_dict(fields=["parent.field1"]),
+        )
+        assert CachedChild.as_dict_cache.info().hits == 1
+        assert CachedParent.as_dict_cache.info().hits == 1
+
+    def test_as_json(self):
+        @serializable
+        class JsonParent(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            name = db.Column(db.Unicode)
+            date = db.Column(db.Date)
+            uuid = db.Column(UUID(as_uuid=True))
+            flag = db.Column(db.Boolean)
+            ratio = db.Column(db.Float)
+            data = db.Column(JSONB)
+            geom = db.Column(Geometry("GEOMETRY", 4326))
+
+            @property
+            def label(self):
+                return f"parent {self.name}"
+
+        @serializable
+        class JsonChild(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            parent_pk = db.Column(db.Integer, db.ForeignKey(JsonParent.pk))
+            parent = relationship(JsonParent, backref="childs")
+
+        @serializable
+        class JsonOverriddenChild(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            parent_pk = db.Column(db.Integer, db.ForeignKey(JsonParent.pk))
+            parent = relationship(JsonParent, backref="overridden_childs")
+
+            def as_dict(self, data):
+                data["overridden"] = True
+                return data
+
+        parent = JsonParent(
+            pk=1,
+            name='é"\n',
+            date=datetime.date(2024, 1, 2),
+            uuid=uuid4(),
+            flag=False,
+            ratio=0.5,
+            data={"a": [1, None]},
+        )
+        JsonChild(pk=1, parent=parent)
+        JsonChild(pk=2, parent=parent)
+        JsonOverriddenChild(pk=3, parent=parent)
+        orphan = JsonChild(pk=3)
+
+        for obj, kwargs in [
+            (parent, {}),
+            (parent, {"fields": ["pk", "label"]}),
+            (parent, {"fields": ["childs", "overridden_childs", "+childs_count"]}),
+            (parent, {"fields": ["childs[1:-pk]"], "exclude": ["childs.parent_pk"]}),
+            (parent, {"stringify": False, "exclude": ["date", "uuid"]}),
+            (parent.childs[0], {"fields": ["parent.name"]}),
+            (orphan, {"fields": ["parent"]}),
+        ]:
+            assert json.loads(obj.as_json(**kwargs)) == obj.as_dict(**kwargs)
+
+        assert json.loads(as_json_array(parent.childs + [orphan], fields=["parent.pk"])) == [
+            o.as_dict(fields=["parent.pk"]) for o in parent.childs + [orphan]
+        ]
+
+        # non native values are encoded as by the Flask JSON provider, even without application
+        kwargs = {"stringify": False, "fields": ["uuid", "date", "pk"]}
+        with Flask(__name__).app_context() as ctx:
+            expected = json.loads(ctx.app.json.dumps(parent.as_dict(**kwargs)))
+        assert json.loads(parent.as_json(**kwargs)) == expected
+        # keys order of overridden as_dict is kept
+        overridden_child = parent.overridden_childs[0]
+        with Flask(__name__).app_context():
+            assert list(json.loads(overridden_child.as_json())) == list(overridden_child.as_dict())
+
+    def test_as_json_expression(self):
+        @serializable
+        class SqlParent(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            date = db.Column(db.Date)
+            geom = db.Column(Geometry("GEOMETRY", 4326))
+
+            @property
+            def label(self):
+                return f"parent {self.pk}"
+
+        @serializable
+        class SqlChild(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            parent_pk = db.Column(db.Integer, db.ForeignKey(SqlParent.pk))
+            parent = relationship(SqlParent, backref="childs")
+            dated_parent = relationship(
+                SqlParent,
+                primaryjoin=lambda: sa.and_(
+                    SqlParent.pk == SqlChild.parent_pk, SqlParent.date.isnot(None)
+                ),
+                viewonly=True,
+            )
+
+        def compile(query):
+            return str(
+                query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            )
+
+        sql = compile(SqlParent.as_json_select(fields=["pk", "date", "geom"]))
+        assert "array_to_json(array((SELECT json_build_object('pk', " in sql
+        assert "to_char(sql_parent.date, 'YYYY-MM-DD')" in sql
+        assert "geom" not in sql
+        assert "label" not in compile(SqlParent.as_json_select(exclude=["label"]))
+
+        sql = compile(SqlParent.as_json_select(fields=["pk", "childs[2:-pk]", "+childs_count"]))
+        assert "'childs_count', (SELECT count(*)" in sql
+        assert "ORDER BY sql_child_2.pk DESC" in sql
+        assert "LIMIT" in sql
+
+        sql = compile(SqlChild.as_json_select(fields=["parent.pk"]))
+        assert "WHERE sql_parent_1.pk = sql_child.parent_pk" in sql
+
+        sql = compile(SqlChild.as_json_select(fields=["dated_parent.pk"]))
+        assert "sql_parent_1.pk = sql_child.parent_pk AND sql_parent_1.date IS NOT NULL" in sql
+
+        # python only properties are never silently left out of the document
+        for kwargs in [{}, {"fields": ["label"]}, {"fields": ["pk", "+label"]}]:
+            with pytest.raises(Exception, match="Field 'label' .* can not be computed in SQL.*"):
+                SqlParent.as_json_select(**kwargs)
+
+    @pytest.mark.postgresql
+    def test_as_json_expression_postgresql(self):
+        @serializable
+        class PgParent(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            date = db.Column(db.Date)
+            datetime = db.Column(db.DateTime)
+            timestamp = db.Column(db.DateTime(timezone=True))
+            time = db.Column(db.Time)
+            timetz = db.Column(db.Time(timezone=True))
+            numeric = db.Column(db.Numeric(8, 3))
+            ratio = db.Column(db.Float)
+            uuid = db.Column(UUID(as_uuid=True))
+
+            @property
+            def label(self):
+                return f"parent {self.pk}"
+
+        @serializable
+        class PgChild(db.Model):
+            pk = db.Column(db.Integer, primary_key=True)
+            parent_pk = db.Column(db.Integer, db.ForeignKey(PgParent.pk))
+            parent = relationship(PgParent, backref="childs")
+
+        paris = datetime.timezone(datetime.timedelta(hours=1))
+        engine = sa.create_engine(
+            get_postgresql_uri(), connect_args={"options": "-c timezone=Europe/Paris"}
+        )
+        tables = [PgParent.__table__, PgChild.__table__]
+        db.metadata.create_all(engine, tables=tables)
+        try:
+            with sa.orm.Session(engine) as session, Flask(__name__).app_context() as ctx:
+                session.add_all(
+                    [
+                        PgParent(
+                            pk=1,
+                            date=datetime.date(2024, 1, 2),
+                            datetime=datetime.datetime(2024, 1, 2, 10, 30, 0, 500000),
+                            timestamp=datetime.datetime(2024, 1, 2, 10, 30, tzinfo=paris),
+                            time=datetime.time(10, 30, 15, 500000),
+                            timetz=datetime.time(10, 30, tzinfo=paris),
+                            numeric=Decimal("12.500"),
+                            ratio=0.5,
+                            uuid=uuid4(),
+                            childs=[PgChild(pk=1), PgChild(pk=2)],
+                        ),
+                        PgParent(pk=2, datetime=datetime.datetime(2024, 1, 2, 10, 30)),
+                    ]
+                )
+                session.flush()
+                session.expire_all()
+
+                for kwargs in [
+                    {"exclude": ["label"]},
+                    {"fields": ["pk", "childs", "+childs_count"]},
+                    {"fields": ["timestamp", "childs[1:-pk]"]},
+                ]:
+                    query = sa.select(PgParent).order_by(PgParent.pk)
+                    document = session.scalar(PgParent.as_json_select(query, **kwargs))
+                    expected = [p.as_dict(**kwargs) for p in session.scalars(query)]
+                    assert document == json.loads(ctx.app.json.dumps(expected))
+                document = session.scalar(PgParent.as_json_select(query, exclude=["label"]))
+                assert document[0]["timestamp"] == "2024-01-02 10:30:00+01:00"
+                assert document[0]["time"] == "10:30:15.500000"
+
+                # keys order is kept beyond the 100 arguments of json_build_object
+                keys = [f"key{i}" for i in range(120)]
+                document = session.scalar(
+                    sa.select(sql_json_object([(key, sa.literal(key)) for key in keys]))
+                )
+                assert list(document.items()) == [(key, key) for key in keys]
+        finally:
+            db.metadata.drop_all(engine, tables=tables)
@@ -0,0 +1,58 @@
+import sqlalchemy as sa
+from sqlalchemy.orm import declarative_base, relationship, Session
+
+from utils_flask_sqla.utils import ensure_joined, get_joined_tables, is_already_joined, is_joined
+
+Base = declarative_base()
+
+
+class Parent(Base):
+    __tablename__ = "parent"
+    pk = sa.Column(sa.Integer, primary_key=True)
+
+
+class Child(Base):
+    __tablename__ = "child"
+    pk = sa.Column(sa.Integer, primary_key=True)
+    parent_pk = sa.Column(sa.Integer, sa.ForeignKey(Parent.pk))
+    parent = relationship(Parent)
+
+
+class Toy(Base):
+    __tablename__ = "toy"
+    pk = sa.Column(sa.Integer, primary_key=True)
+    child_pk = sa.Column(sa.Integer, sa.ForeignKey(Child.pk))
+    child = relationship(Child, backref="toys")
+
+
+class TestJoins:
+    def test_is_joined(self):
+        query = sa.select(Child)
+        assert is_joined(query, Child)
+        assert not is_joined(query, Parent)
+        assert not is_joined(query, Child.parent)
+        assert is_joined(query.join(Child.parent), Child.parent)
+        assert is_joined(query.join(Parent), Parent)
+        assert is_joined(query.where(Parent.pk == 1), Parent)
+        assert is_joined(query.join(Child.toys).join(Child.parent), Parent)
+        # correlated subqueries are not part of from clauses
+        subquery = sa.select(Parent.pk).where(Parent.pk == Child.parent_pk).exists()
+        assert not is_joined(query.where(subquery), Parent)
+
+    def test_ensure_joined(self):
+        query = ensure_joined(sa.select(Child), Child.parent)
+        assert ensure_joined(query, Child.parent) is query
+        assert ensure_joined(query, Parent) is query
+        query = ensure_joined(query, Child.toys, isouter=True)
+        assert str(query).count("JOIN") == 2
+        assert "LEFT OUTER JOIN toy" in str(query)
+
+    def test_cache(self):
+        query = sa.select(Child).join(Child.parent)
+        assert get_joined_tables(query) is get_joined_tables(query)
+
+    def test_is_already_joined(self):
+        query = Session().query(Child).join(Child.parent)
+        assert is_already_joined(Parent, query)
+        assert not is_already_joined(Toy, query)
+        assert is_already_joined(Child, sa.select(Child))
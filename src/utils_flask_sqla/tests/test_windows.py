@@ -0,0 +1,156 @@
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship
+
+from utils_flask_sqla.serializers import serializable
+from .utils import statements
+
+db = SQLAlchemy()
+
+
+cor_parent_tag = db.Table(
+    "cor_parent_tag",
+    db.Column("id_parent", db.Integer, db.ForeignKey("parent.pk")),
+    db.Column("id_tag", db.Integer, db.ForeignKey("tag.pk")),
+)
+
+
+@serializable
+class Tag(db.Model):
+    __tablename__ = "tag"
+    pk = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+
+
+@serializable
+class Parent(db.Model):
+    __tablename__ = "parent"
+    pk = db.Column(db.Integer, primary_key=True)
+    tags = relationship(Tag, secondary=cor_parent_tag)
+    ranked_childs = relationship(
+        "Child", primaryjoin="and_(Child.parent_pk == Parent.pk, Child.rank > 1)", viewonly=True
+    )
+
+
+@serializable
+class Child(db.Model):
+    pk = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer)
+    parent_pk = db.Column(db.Integer, db.ForeignKey(Parent.pk))
+    parent = relationship(Parent, backref="childs")
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = Flask("utils-flask-sqla")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture(scope="class")
+def data(app):
+    tags = [Tag(pk=i, name=f"tag{i}") for i in range(1, 4)]
+    parents = [Parent(pk=1, tags=tags), Parent(pk=2, tags=tags[:1]), Parent(pk=3)]
+    childs = [Child(pk=i, rank=i % 4, parent_pk=1 + i % 2) for i in range(1, 11)]
+    with db.session.begin_nested():
+        db.session.add_all(tags + parents + childs)
+    db.session.expunge_all()
+
+
+@pytest.mark.usefixtures("data")
+class TestWindows:
+    def test_preload(self, app, statements):
+        parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk)).all()
+        fields = ["childs[2:-rank:pk].pk", "+childs_count"]
+        Parent.as_dict_preload(parents, fields=fields)
+        assert len(statements) == 2
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "childs_count": 5, "childs": [{"pk": 2}, {"pk": 6}]},
+            {"pk": 2, "childs_count": 5, "childs": [{"pk": 3}, {"pk": 7}]},
+            {"pk": 3, "childs_count": 0, "childs": []},
+        ]
+        assert len(statements) == 2
+        assert all("childs" in sa.inspect(p).unloaded for p in parents)
+        db.session.expunge_all()
+
+    def test_preload_secondary(self, app, statements):
+        parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk)).all()
+        fields = ["tags[2:-name].name", "+tags_count"]
+        Parent.as_dict_preload(parents, fields=fields)
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "tags_count": 3, "tags": [{"name": "tag3"}, {"name": "tag2"}]},
+            {"pk": 2, "tags_count": 1, "tags": [{"name": "tag1"}]},
+            {"pk": 3, "tags_count": 0, "tags": []},
+        ]
+        assert len(statements) == 2
+        db.session.expunge_all()
+
+    def test_preload_count_only(self, app, statements):
+        parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk)).all()
+        fields = ["+childs_count"]
+        Parent.as_dict_preload(parents, fields=fields)
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "childs_count": 5},
+            {"pk": 2, "childs_count": 5},
+            {"pk": 3, "childs_count": 0},
+        ]
+        assert len(statements) == 2
+        db.session.expunge_all()
+
+    def test_without_preload(self, app):
+        parent = db.session.get(Parent, 2)
+        assert parent.as_dict(fields=["childs[2:-rank:pk].pk", "+childs_count"]) == {
+            "pk": 2,
+            "childs_count": 5,
+            "childs": [{"pk": 3}, {"pk": 7}],
+        }
+        db.session.expunge_all()
+
+    @pytest.mark.parametrize("preload", [True, False])
+    def test_primaryjoin_criteria(self, app, preload):
+        parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk)).all()
+        fields = ["ranked_childs[2:rank].pk", "+ranked_childs_count"]
+        if preload:
+            Parent.as_dict_preload(parents, fields=fields)
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "ranked_childs_count": 3, "ranked_childs": [{"pk": 2}, {"pk": 6}]},
+            {"pk": 2, "ranked_childs_count": 2, "ranked_childs": [{"pk": 3}, {"pk": 7}]},
+            {"pk": 3, "ranked_childs_count": 0, "ranked_childs": []},
+        ]
+        db.session.expunge_all()
+
+    @pytest.mark.parametrize("preload", [True, False])
+    def test_primary_key_tiebreaker(self, app, preload):
+        parents = db.session.scalars(sa.select(Parent).order_by(Parent.pk)).all()
+        fields = ["childs[3:-rank].pk"]
+        if preload:
+            Parent.as_dict_preload(parents, fields=fields)
+        assert [p.as_dict(fields=fields) for p in parents] == [
+            {"pk": 1, "childs": [{"pk": 2}, {"pk": 6}, {"pk": 10}]},
+            {"pk": 2, "childs": [{"pk": 3}, {"pk": 7}, {"pk": 1}]},
+            {"pk": 3, "childs": []},
+        ]
+        db.session.expunge_all()
+
+    def test_conflicting_windows(self, app):
+        parent = Parent(pk=4)
+        with pytest.raises(Exception, match="Several windows given for relationship 'childs'."):
+            parent.as_dict(fields=["childs[2:rank].pk", "childs[3].rank"])
+        parent.as_dict(fields=["childs[2:rank].pk", "childs[2:rank].rank"])
+
+    def test_invalid_window(self, app):
+        parent = Parent(pk=4)
+        with pytest.raises(Exception, match="Invalid limit.*"):
+            parent.as_dict(fields=["childs[0]"])
+        with pytest.raises(Exception, match="Invalid limit.*"):
+            parent.as_dict(fields=["childs[a]"])
+        with pytest.raises(Exception, match="Field 'unexisting' does not exist.*"):
+            parent.as_dict(fields=["childs[1:unexisting]"])
+        child = Child(pk=11, parent=parent)
+        with pytest.raises(Exception, match=".*is not a collection.*"):
+            child.as_dict(fields=["parent[1]"])
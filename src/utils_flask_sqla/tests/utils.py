@@ -1,5 +1,8 @@
 import json
+import os
 
+import pytest
+import sqlalchemy as sa
 from flask import testing
 from werkzeug.datastructures import Headers
 
@@ -26,3 +29,31 @@ class JSONClient(testing.FlaskClient):
             )
         kwargs["headers"] = headers
         return super().open(*args, **kwargs)
+
+
+def get_postgresql_uri():
+    """
+    URI of the PostgreSQL database used by tests marked with @pytest.mark.postgresql,
+    these tests are skipped when the TEST_POSTGRESQL_URI environment variable is not set
+    """
+    uri = os.environ.get("TEST_POSTGRESQL_URI")
+    if not uri:
+        pytest.skip("TEST_POSTGRESQL_URI is not set")
+    return uri
+
+
+@pytest.fixture
+def statements(app):
+    """
+    SQL statements executed by the Flask-SQLAlchemy engine of the app fixture during the test,
+    to be imported by test modules defining an app fixture in an application context
+    """
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = app.extensions["sqlalchemy"].engine
+    sa.event.listen(engine, "before_cursor_execute", count_statements)
+    yield statements
+    sa.event.remove(engine, "before_cursor_execute", count_statements)
@@ -5,8 +5,15 @@ from contextlib import ExitStack
 from tempfile import TemporaryDirectory
 from shutil import copyfileobj
 from urllib.request import urlopen
-from contextlib import suppress
-from sqlalchemy.sql import visitors
+from weakref import WeakKeyDictionary
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import QueryableAttribute
+from sqlalchemy.sql.selectable import Join
+
+# tables of the from clauses of select statements, computed once per statement object
+_joined_tables_cache = WeakKeyDictionary()
 
 
 class remote_file(ExitStack):
@@ -36,35 +43,72 @@ class remote_file(ExitStack):
         return remote_file_path
 
 
+def get_joined_tables(select):
+    """
+    Return the set of tables which are part of the from clauses of the given select,
+    including joined tables. The result is cached per statement object.
+    """
+    try:
+        return _joined_tables_cache[select]
+    except KeyError:
+        pass
+    tables = set()
+    from_clauses = list(select.get_final_froms())
+    while from_clauses:
+        from_clause = from_clauses.pop()
+        if isinstance(from_clause, Join):
+            from_clauses += [from_clause.left, from_clause.right]
+        else:
+            tables.add(from_clause)
+    tables = frozenset(tables)
+    _joined_tables_cache[select] = tables
+    return tables
+
+
+def get_join_target_table(target):
+    """
+    Return the table to join for the given model or relationship attribute
+    """
+    if isinstance(target, QueryableAttribute):
+        return target.property.mapper.local_table
+    return sa.inspect(target).local_table
+
+
+def is_joined(select, target):
+    """
+    Check if the table of the given model or relationship attribute is part of the from clauses
+    of the given select, in linear time of the number of from clauses.
+    """
+    return get_join_target_table(target) in get_joined_tables(select)
+
+
+def ensure_joined(select, target, **kwargs):
+    """
+    Join the given model or relationship attribute to the select,
+    unless its table is already part of the from clauses of the select.
+    Additional keyword arguments (e.g. `isouter`) are passed to `select.join`.
+
+    >>> query = ensure_joined(select(Child), Child.parent)
+    >>> query = ensure_joined(query, Child.parent)  # parent is not joined twice
+    """
+    if is_joined(select, target):
+        return select
+    return select.join(target, **kwargs)
+
+
 def is_already_joined(my_class, query):
     """
     Check if the given class is already present is the current query
     _class: SQLAlchemy class
     query: SQLAlchemy query
     return boolean
+
+    Only the from clauses and joins of the query are considered: aliases of the class and
+    tables only used in correlated subqueries are not detected.
     """
-    for visitor in visitors.iterate(query):
-        # Checking for `.join(Parent.child)` clauses
-        if visitor.__visit_name__ == "binary":
-            for vis in visitors.iterate(visitor):
-                # Visitor might not have table attribute
-                with suppress(AttributeError):
-                    # Verify if already present based on table name
-                    if my_class.__table__.fullname == vis.table.fullname:
-                        return True
-        # Checking for `.join(Child)` clauses
-        if visitor.__visit_name__ == "table":
-            # Visitor might be of ColumnCollection or so,
-            # which cannot be compared to model
-            with suppress(TypeError):
-                if my_class == visitor.entity_namespace:
-                    return True
-        # Checking for `Model.column` clauses
-        if visitor.__visit_name__ == "column":
-            with suppress(AttributeError):
-                if my_class.__table__.fullname == visitor.table.fullname:
-                    return True
-    return False
+    if isinstance(query, Query):
+        query = query.statement
+    return is_joined(query, my_class)
 
 
 def strtobool(s: str):